@@ -0,0 +1,66 @@
+"""
+Measure the memory used by each element, excluding the memory used by
+values, for the element classes in :mod:`manipulate.elements` and for
+equivalent classes without ``__slots__``, as they were before.
+
+Run with::
+
+  python -m benchmarks.memory
+"""
+import tracemalloc
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Generic, TypeVar
+
+from manipulate.elements import Element, File, Text
+
+T = TypeVar('T')
+
+
+@dataclass
+class DictElement(Generic[T]):
+    value: T
+    parent: 'DictElement[Any] | None' = None
+    line: int | None = None
+    column: int | None = None
+
+
+@dataclass
+class DictText(DictElement[str]):
+    prefix: str = ''
+
+
+def bytes_per_element(factory: Callable[[int], object], count: int) -> float:
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        elements = [factory(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    # exclude the list holding the elements:
+    overhead = len(elements) * 8
+    return (after - before - overhead) / count
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=100_000)
+    args = parser.parse_args()
+
+    value = 'x'
+    file = File(Path('file.txt'))
+    dict_file = DictElement(Path('file.txt'))
+    cases: list[tuple[str, Callable[[int], object]]] = [
+        ('Element (before)', lambda i: DictElement(value, dict_file, 1, 1)),
+        ('Element (after)', lambda i: Element(value, file, 1, 1)),
+        ('Text (before)', lambda i: DictText(value, dict_file, 1, 1)),
+        ('Text (after)', lambda i: Text(value, file, 1, 1)),
+    ]
+    for name, factory in cases:
+        print(f'{name:<20} {bytes_per_element(factory, args.count):8.1f} bytes per element')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+Benchmarks for the pipeline engine, measuring elements per second, files per second
+and peak RSS for each stage over a set of synthetic trees. Each benchmark is run in a
+fresh process so that peak RSS reflects only that benchmark.
+
+Run with::
+
+  python -m benchmarks.pipeline
+
+Use ``--save`` to store the results as a baseline and ``--compare`` to compare
+the results against a stored baseline, exiting with a non-zero status if any
+benchmark has regressed by more than the tolerance.
+"""
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from argparse import ArgumentParser
+from collections import deque
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+from manipulate import manipulate
+from manipulate.actions import Action, Classify, Container, Replace, Transform
+from manipulate.destinations import Destination, Files as FilesDestination
+from manipulate.elements import Element, End, File, Start, Text
+from manipulate.sources import Files, Memory, Source
+
+DEFAULT_BASELINE = Path(__file__).parent / 'baseline.json'
+
+
+class Discard:
+    def handle(self, elements: Iterable[Element[Any]]) -> None:
+        deque(elements, maxlen=0)
+
+
+@dataclass
+class Counter:
+    """
+    An action that counts the elements and files passing through it.
+    """
+
+    elements: int = 0
+    files: int = 0
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            self.elements += 1
+            if isinstance(element, Start) and isinstance(element.value, File):
+                self.files += 1
+            yield element
+
+
+def passthrough(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+    yield from elements
+
+
+class Identity(Transform):
+
+    def transform(self, element: Element[Any]) -> Element[Any] | None:
+        return element
+
+
+class PythonText(Text):
+    __slots__ = ()
+
+
+def make_tree(root: Path, count: int, lines: int) -> list[Path]:
+    root.mkdir()
+    paths = []
+    line = 'x = "some text for a line of a file"\n'
+    for i in range(count):
+        directory = root / f'{i // 100:04d}'
+        directory.mkdir(exist_ok=True)
+        path = directory / f'{i:06d}.py'
+        path.write_text(line * lines)
+        paths.append(path)
+    return paths
+
+
+@dataclass
+class Trees:
+    small: list[Path]
+    huge: list[Path]
+
+    @classmethod
+    def make(cls, root: Path, scale: float) -> 'Trees':
+        return cls(
+            small=make_tree(root / 'small', max(1, int(10_000 * scale)), 10),
+            huge=make_tree(root / 'huge', 3, max(1, int(1_000_000 * scale))),
+        )
+
+
+class Deep:
+    """
+    A source of files containing text deeply nested within other elements.
+    """
+
+    def __init__(self, files: int, depth: int, texts: int) -> None:
+        self.files, self.depth, self.texts = files, depth, texts
+
+    def elements(self) -> Iterator[Element[Any]]:
+        for i in range(self.files):
+            parent: Element[Any] = File(Path(f'{i}.py'))
+            yield Start(parent)
+            file = parent
+            for level in range(self.depth):
+                parent = Element(level, parent=parent)
+            for line in range(self.texts):
+                yield Text('x = 1\n', parent=parent, line=line + 1, column=1)
+            yield End(file)
+
+
+Case = Callable[[Trees, float], tuple[Source, Sequence[Action], Destination]]
+
+CLASSIFY = Classify({'.py': PythonText})
+IN_PLACE = FilesDestination(atomic=True)
+REPLACE = Replace({**{f'name{i}': f'other{i}' for i in range(200)}, 'text': 'words'})
+
+
+def chunked(paths: list[Path]) -> Files:
+    return Files(paths, chunk_size=64 * 1024)
+
+
+CASES: dict[str, Case] = {
+    'small/source': lambda t, s: (Files(t.small), [], Discard()),
+    'small/tracker-10': lambda t, s: (Files(t.small), [passthrough] * 10, Discard()),
+    'small/container': lambda t, s: (Files(t.small), [Container(File)], Discard()),
+    'small/classify': lambda t, s: (Files(t.small), [CLASSIFY], Discard()),
+    'small/destination': lambda t, s: (Files(t.small), [], IN_PLACE),
+    'huge/source': lambda t, s: (Files(t.huge), [], Discard()),
+    'huge/chunked': lambda t, s: (chunked(t.huge), [], Discard()),
+    'huge/classify': lambda t, s: (chunked(t.huge), [CLASSIFY], Discard()),
+    'huge/replace': lambda t, s: (chunked(t.huge), [REPLACE], Discard()),
+    'huge/destination': lambda t, s: (chunked(t.huge), [], IN_PLACE),
+    'deep/tracker-10': lambda t, s: (
+        Deep(max(1, int(100 * s)), 50, 1000), [passthrough] * 10, Discard()
+    ),
+    'deep/classify': lambda t, s: (Deep(max(1, int(100 * s)), 50, 1000), [CLASSIFY], Discard()),
+    'memory/tracker-1': lambda t, s: (
+        Memory(*[Text('x')] * int(1_000_000 * s)), [passthrough], Discard()
+    ),
+    'memory/tracker-10': lambda t, s: (
+        Memory(*[Text('x')] * int(1_000_000 * s)), [passthrough] * 10, Discard()
+    ),
+    'memory/tracker-50': lambda t, s: (
+        Memory(*[Text('x')] * int(100_000 * s)), [passthrough] * 50, Discard()
+    ),
+    'memory/fused-10': lambda t, s: (
+        Memory(*[Text('x')] * int(1_000_000 * s)), [Identity()] * 10, Discard()
+    ),
+}
+
+
+@dataclass
+class Result:
+    elements_per_second: float
+    files_per_second: float
+    peak_rss_mb: float
+
+
+def run_case(name: str, trees: Trees, scale: float) -> Result:
+    source, actions, destination = CASES[name](trees, scale)
+    counter = Counter()
+    start = time.perf_counter()
+    manipulate(source, [*actions, counter], destination)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS:
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return Result(
+        elements_per_second=counter.elements / seconds,
+        files_per_second=counter.files / seconds,
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor,
+    )
+
+
+def run(names: Iterable[str], scale: float) -> dict[str, Result]:
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    with TemporaryDirectory() as root:
+        trees = Trees.make(Path(root), scale)
+        for name in names:
+            with context.Pool(1) as pool:
+                results[name] = pool.apply(run_case, (name, trees, scale))
+            print(format_result(name, results[name]), flush=True)
+    return results
+
+
+def format_result(name: str, result: Result, baseline: Result | None = None) -> str:
+    text = (
+        f'{name:<20} {result.elements_per_second:14,.0f} elements/s '
+        f'{result.files_per_second:10,.0f} files/s {result.peak_rss_mb:8.1f} MB'
+    )
+    if baseline is not None:
+        text += (
+            f'  ({change(result.elements_per_second, baseline.elements_per_second):+.1%} '
+            f'elements/s, {change(result.peak_rss_mb, baseline.peak_rss_mb):+.1%} MB)'
+        )
+    return text
+
+
+def change(current: float, baseline: float) -> float:
+    return (current - baseline) / baseline if baseline else 0.0
+
+
+def regressions(
+    results: dict[str, Result], baseline: dict[str, Result], tolerance: float
+) -> list[str]:
+    found = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if change(result.elements_per_second, expected.elements_per_second) < -tolerance:
+            found.append(f'{name}: elements/s')
+        if change(result.peak_rss_mb, expected.peak_rss_mb) > tolerance:
+            found.append(f'{name}: peak RSS')
+    return found
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = ArgumentParser(description=(__doc__ or '').split('\n\n')[0])
+    parser.add_argument('names', nargs='*', help='benchmarks to run, defaults to all')
+    parser.add_argument('--scale', type=float, default=1.0, help='scale the size of the trees')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help='save results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='compare against the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    names = args.names or list(CASES)
+    unknown = set(names) - set(CASES)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    results = run(names, args.scale)
+
+    status = 0
+    if args.compare:
+        baseline = {
+            name: Result(**data) for name, data in json.loads(args.baseline.read_text()).items()
+        }
+        print(f'\nCompared with {args.baseline}:')
+        for name, result in results.items():
+            print(format_result(name, result, baseline.get(name)))
+        found = regressions(results, baseline, args.tolerance)
+        if found:
+            print('\nRegressions:\n' + '\n'.join(found))
+            status = 1
+    if args.save:
+        args.baseline.write_text(
+            json.dumps({name: asdict(result) for name, result in results.items()}, indent=2)
+        )
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,40 +1,248 @@
-from typing import Sequence, Any, Iterable
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, Future, wait, FIRST_COMPLETED
+from inspect import isasyncgenfunction
+from threading import Event, Semaphore
+from typing import (
+    Sequence, Any, Iterable, Iterator, AsyncIterable, AsyncIterator, TypeGuard, cast
+)
 
-from .actions import Action
-from .destinations import Destination
+from ._pipeline import Tracker, has_blocks, apply_actions, chain, spans
+from .actions import Action, AsyncAction, Select
+from .cache import fingerprint
+from .destinations import Destination, AsyncDestination
 from .elements import Element
-from .sources import Source
+from .journal import Journal
+from .sources import Source, AsyncSource
 
 
-class Tracker:
-    current_action: Action
-    current_element: Element[Any]
+def _pushdown(source: Source, actions: Sequence[Action]) -> Source:
+    """
+    Push the ``path_predicate`` of each action down into the source, if it has
+    a ``where`` method, up to the first action without a true ``preserves_paths``.
+    """
+    where = getattr(source, 'where', None)
+    if where is None:
+        return source
+    for action in actions:
+        predicate = getattr(action, 'path_predicate', None)
+        if predicate is not None:
+            source = where(predicate)
+            where = source.where  # type: ignore[attr-defined]
+        elif not getattr(action, 'preserves_paths', False):
+            break
+    return source
 
-    def before(self, action: Action, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
-        for element in elements:
-            self.current_action = action
-            self.current_element = element
-            yield element
 
-    def after(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+def _process(
+    actions: Sequence[Action], blocks: bool, keep_blocks: bool, span: list[Element[Any]]
+) -> list[Element[Any]]:
+    return list(chain(span, actions, blocks=blocks, keep_blocks=keep_blocks))
+
+
+def _parallel(
+    executor: Executor,
+    elements: Iterable[Element[Any]],
+    actions: Sequence[Action],
+    ordered: bool,
+    max_pending: int,
+    blocks: bool,
+    keep_blocks: bool,
+) -> Iterator[Element[Any]]:
+    pending: deque[Future[list[Element[Any]]]] = deque()
+
+    def complete(limit: int) -> Iterator[Element[Any]]:
+        nonlocal pending
+        while len(pending) > limit:
+            if ordered:
+                yield from pending.popleft().result()
+            else:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                pending = deque(not_done)
+                for future in done:
+                    yield from future.result()
+
+    try:
+        for span in spans(elements):
+            pending.append(executor.submit(_process, actions, blocks, keep_blocks, span))
+            yield from complete(max_pending - 1)
+        yield from complete(0)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def manipulate(
+    source: Source,
+    actions: Sequence[Action],
+    destination: Destination,
+    executor: Executor | None = None,
+    ordered: bool = True,
+    max_pending: int = 100,
+    tracker: Tracker | None = None,
+    journal: Journal | None = None,
+) -> None:
+    """
+    Pass the elements from the source through each of the actions in turn
+    and then on to the destination. Consecutive :class:`~manipulate.actions.Transform`
+    actions are fused into a single pass using :func:`~manipulate.actions.fuse`,
+    unless the ``tracker`` has a false ``fuse`` attribute.
+
+    A ``tracker``, such as a :class:`~manipulate.profile.Profile`, may be
+    supplied to observe the elements entering each action.
+
+    If an ``executor``, such as a :class:`~concurrent.futures.ProcessPoolExecutor`,
+    is supplied, the elements are split at file boundaries and the actions are
+    run on each file's elements using that executor. Results are passed to the
+    destination in source order if ``ordered`` is true, or as they complete if
+    not. No more than ``max_pending`` files will be in flight at once.
+    When using a process pool, the actions and elements must be picklable.
+
+    Sources, actions and destinations with a true ``blocks`` attribute may provide
+    or receive :class:`~manipulate.elements.Block` elements. Blocks are replaced by
+    the elements they contain before any action or destination without one.
+
+    Actions, such as :class:`~manipulate.actions.Select`, may provide a
+    ``path_predicate`` that is pushed down into a source with a ``where`` method,
+    such as :class:`~manipulate.sources.Files`, so that the files it excludes are
+    never read. This is only done for actions that come before any action that does
+    not have a true ``preserves_paths`` attribute, indicating that excluding files
+    before it would not change what it does with the others.
+
+    A :class:`~manipulate.cache.Cache` used by the source or destination must be
+    for the same actions.
+
+    If a :class:`~manipulate.journal.Journal` for the same actions is supplied, files
+    it records as completed by an earlier run are skipped, and each top-level file is
+    recorded in it once the destination asks for the element after the file's
+    :class:`~manipulate.elements.End`. The journal is removed once the run completes.
+    Destinations that carry on writing files after that, such as
+    :class:`~manipulate.destinations.Files` with ``writers`` or a
+    :class:`~manipulate.fanout.FanOut`, whose branches are fed through queues,
+    may leave files recorded that were never written if the run is killed.
+    """
+    if max_pending < 1:
+        raise ValueError(f'max_pending must be at least 1, not {max_pending}')
+    expected = fingerprint(actions)
+    for cache in getattr(source, 'cache', None), getattr(destination, 'cache', None):
+        if cache is not None and cache.fingerprint != expected:
+            raise ValueError(f'{cache.path} is a cache for different actions')
+    if journal is not None and journal.fingerprint != expected:
+        raise ValueError(f'{journal.path} is a journal for different actions')
+    source = _pushdown(source, actions)
+    skip = None
+    if journal is not None:
+        where = getattr(source, 'where', None)
+        if where is None:
+            skip = Select(journal.pending)
+        else:
+            source = where(journal.pending)
+    elements = source.elements()
+    if skip is not None:
+        elements = skip(elements)
+    blocks = has_blocks(source)
+    keep_blocks = has_blocks(destination)
+    if executor is None:
+        output = chain(elements, actions, tracker, blocks, keep_blocks)
+    else:
+        if tracker is not None:
+            raise TypeError('a tracker cannot be used with an executor')
+        output = _parallel(executor, elements, actions, ordered, max_pending, blocks, keep_blocks)
+    if journal is None:
+        destination.handle(output)
+        return
+    try:
+        destination.handle(journal.track(output))
+    except BaseException:
+        journal.close()
+        raise
+    journal.remove()
+
+
+def _is_async(action: Action | AsyncAction) -> TypeGuard[AsyncAction]:
+    return isasyncgenfunction(action) or isasyncgenfunction(getattr(action, '__call__', None))
+
+
+_DONE = object()
+
+
+async def _in_thread(
+    tracker: Tracker,
+    actions: Sequence[Action],
+    elements: AsyncIterable[Element[Any]],
+    max_pending: int,
+) -> AsyncIterator[Element[Any]]:
+    """
+    Run a chain of synchronous actions in a worker thread, feeding it from
+    and returning its results to the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = aiter(elements)
+    output: asyncio.Queue[Any] = asyncio.Queue()
+    capacity = Semaphore(max_pending)
+    stopped = Event()
+
+    async def next_element() -> Element[Any]:
+        return await anext(iterator)
+
+    def pull() -> Iterator[Element[Any]]:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(next_element(), loop).result()
+            except StopAsyncIteration:
+                return
+
+    def run() -> None:
         try:
-            yield from elements
-        except Exception as e:
-            breadcrumbs = [self.current_element]
-            current = self.current_element
-            while current := current.parent:  # type: ignore[assignment]
-                breadcrumbs.append(current)
-            breadcrumb_text = ' -> '.join(str(e) for e in reversed(breadcrumbs))
-            e.add_note(f'Performing {self.current_action} on {breadcrumb_text}')
-            raise
-
-
-def manipulate(source: Source, actions: Sequence[Action], destination: Destination) -> None:
+            chained = apply_actions(tracker, actions, pull(), blocks=False, keep_blocks=False)
+            for element in chained:
+                capacity.acquire()
+                if stopped.is_set():
+                    return
+                loop.call_soon_threadsafe(output.put_nowait, element)
+        finally:
+            loop.call_soon_threadsafe(output.put_nowait, _DONE)
+
+    task = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        while (element := await output.get()) is not _DONE:
+            capacity.release()
+            yield element
+    finally:
+        stopped.set()
+        capacity.release()
+        await task
+
+
+async def manipulate_async(
+    source: AsyncSource,
+    actions: Sequence[Action | AsyncAction],
+    destination: AsyncDestination,
+    max_pending: int = 100,
+) -> None:
+    """
+    Pass the elements from an asynchronous source through each of the actions
+    in turn and then on to an asynchronous destination.
+
+    Actions may be asynchronous generator functions, or have an asynchronous
+    generator as their ``__call__``, in which case they are run on the event loop.
+    Runs of synchronous actions are run in a worker thread, with no more than
+    ``max_pending`` of their results waiting to be consumed.
+    """
     tracker = Tracker()
-    elements = source.elements()
+    elements: AsyncIterable[Element[Any]] = source.elements()
+    pending: list[Action] = []
     for action in actions:
-        elements = action(tracker.before(action, elements))
-    destination.handle(tracker.after(elements))
+        if _is_async(action):
+            if pending:
+                elements = _in_thread(tracker, pending, elements, max_pending)
+                pending = []
+            elements = action(tracker.abefore(action, elements))
+        else:
+            pending.append(cast(Action, action))
+    if pending:
+        elements = _in_thread(tracker, pending, elements, max_pending)
+    await destination.handle(tracker.aafter(elements))
 
 
-__all__ = ['manipulate']
+__all__ = ['manipulate', 'manipulate_async', 'Tracker']
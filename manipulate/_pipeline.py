@@ -0,0 +1,235 @@
+"""
+Helpers shared by :func:`~manipulate.manipulate`, its destinations and
+other ways of running actions.
+"""
+from collections import deque
+from dataclasses import dataclass
+from inspect import isgeneratorfunction
+from itertools import filterfalse
+from types import FrameType
+from typing import (
+    Any, Iterable, Iterator, Sequence, AsyncIterable, AsyncIterator, ClassVar
+)
+
+from .actions import Action, AsyncAction, Fused, fuse, unbatch
+from .elements import Element, Start, End, File
+
+
+@dataclass
+class _Stage:
+    action: Action
+    last: deque[Element[Any]]
+    frame: FrameType | None = None
+    #: Whether the action returned an iterator that isn't a generator, such as a ``map``.
+    lazy: bool = False
+
+
+def _generates(action: Action) -> bool:
+    return isgeneratorfunction(action) or isgeneratorfunction(type(action).__call__)
+
+
+class Tracker:
+    """
+    Keeps track of the element most recently passed to each action so that, if
+    an exception occurs, a note can be added to it giving the action that was being
+    performed and the breadcrumbs of the element it was being performed on.
+
+    The most recent element is recorded without adding a Python-level generator
+    between actions, and the failing action is only worked out when an exception
+    occurs, by finding the innermost action generator in the traceback. That is
+    not trusted if an action upstream of it returned some other kind of iterator,
+    as that action won't appear in the traceback. In that case, or if no action
+    generator is found, the most downstream action to have received the element
+    most recently passed to any action is reported. That element is only recorded
+    from the first action that isn't a generator function onwards.
+    """
+
+    current_action: Action | AsyncAction
+    current_element: Element[Any]
+    #: Whether runs of :class:`~manipulate.actions.Transform` actions should be fused.
+    fuse: ClassVar[bool] = True
+
+    def __init__(self) -> None:
+        self._stages: list[_Stage] = []
+        self._recent: deque[Element[Any]] = deque(maxlen=1)
+        self._recording = False
+
+    def before(self, action: Action, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        last: deque[Element[Any]] = deque(maxlen=1)
+        self._stages.append(_Stage(action, last))
+        elements = filterfalse(last.append, elements)
+        self._recording = self._recording or not _generates(action)
+        if self._recording:
+            elements = filterfalse(self._recent.append, elements)
+        return elements
+
+    def apply(self, action: Action, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        """
+        Apply the action to the elements, tracking the elements that enter it.
+        """
+        stages = len(self._stages)
+        try:
+            output = action(self.before(action, elements))
+        except Exception as e:
+            # actions that don't return an iterator consume their elements here:
+            self.annotate(e)
+            raise
+        if len(self._stages) > stages:
+            stage = self._stages[-1]
+            stage.frame = getattr(output, 'gi_frame', None)
+            stage.lazy = stage.frame is None and iter(output) is output
+        return output
+
+    def _locate(self, exception: Exception) -> None:
+        frames = {id(stage.frame): stage for stage in self._stages if stage.frame is not None}
+        found = None
+        traceback = exception.__traceback__
+        while traceback is not None:
+            found = frames.get(id(traceback.tb_frame), found)
+            traceback = traceback.tb_next
+        if found is not None:
+            # an upstream action that returned some other iterator won't appear in the
+            # traceback, so may be the one that failed:
+            for stage in self._stages:
+                if stage is found:
+                    break
+                if stage.lazy:
+                    found = None
+                    break
+        if found is None and not hasattr(self, 'current_element'):
+            recent = self._recent
+            for stage in reversed(self._stages):
+                if stage.last and (not recent or stage.last[0] is recent[0]):
+                    found = stage
+                    break
+        if found is not None and found.last:
+            self.current_action = found.action
+            self.current_element = found.last[0]
+        action = getattr(self, 'current_action', None)
+        if isinstance(action, Fused) and action.failure is not None:
+            self.current_action, self.current_element = action.failure
+
+    async def abefore(
+        self, action: AsyncAction, elements: AsyncIterable[Element[Any]]
+    ) -> AsyncIterator[Element[Any]]:
+        async for element in elements:
+            self.current_action = action
+            self.current_element = element
+            yield element
+
+    def annotate(self, exception: Exception) -> None:
+        self._locate(exception)
+        if not hasattr(self, 'current_element'):
+            return
+        breadcrumbs = [self.current_element]
+        current = self.current_element
+        while current := current.parent:  # type: ignore[assignment]
+            breadcrumbs.append(current)
+        breadcrumb_text = ' -> '.join(str(e) for e in reversed(breadcrumbs))
+        note = f'Performing {self.current_action} on {breadcrumb_text}'
+        # the same exception may pass through more than one place that annotates it:
+        if note not in getattr(exception, '__notes__', ()):
+            exception.add_note(note)
+
+    def after(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        try:
+            yield from elements
+        except Exception as e:
+            self.annotate(e)
+            raise
+
+    async def aafter(self, elements: AsyncIterable[Element[Any]]) -> AsyncIterator[Element[Any]]:
+        try:
+            async for element in elements:
+                yield element
+        except Exception as e:
+            self.annotate(e)
+            raise
+
+
+def has_blocks(obj: object) -> bool:
+    return bool(getattr(obj, 'blocks', False))
+
+
+def apply_actions(
+    tracker: Tracker,
+    actions: Sequence[Action],
+    elements: Iterable[Element[Any]],
+    blocks: bool,
+    keep_blocks: bool,
+) -> Iterable[Element[Any]]:
+    """
+    Apply the actions to the elements, unbatching any blocks before an action
+    that does not accept them and, unless ``keep_blocks`` is true, at the end.
+    ``blocks`` indicates whether the elements may contain blocks.
+    """
+    for action in fuse(actions) if tracker.fuse else actions:
+        if blocks and not has_blocks(action):
+            elements = unbatch(elements)
+        elements = tracker.apply(action, elements)
+        blocks = has_blocks(action)
+    if blocks and not keep_blocks:
+        elements = unbatch(elements)
+    return elements
+
+
+def chain(
+    elements: Iterable[Element[Any]],
+    actions: Sequence[Action],
+    tracker: Tracker | None = None,
+    blocks: bool = False,
+    keep_blocks: bool = False,
+) -> Iterable[Element[Any]]:
+    tracker = Tracker() if tracker is None else tracker
+    return tracker.after(apply_actions(tracker, actions, elements, blocks, keep_blocks))
+
+
+class Spans:
+    """
+    Split a stream of elements into lists, one for each top-level
+    ``Start(File)`` to ``End(File)`` span and one for each element
+    outside any file. Elements are passed to :meth:`add` one at a time,
+    so that both synchronous and asynchronous streams can be split.
+    """
+
+    def __init__(self) -> None:
+        self.span: list[Element[Any]] = []
+        self.depth = 0
+
+    def add(self, element: Element[Any]) -> list[Element[Any]] | None:
+        """
+        Add an element, returning the span it completes, if any.
+        """
+        self.span.append(element)
+        match element:
+            case Start(File()):
+                self.depth += 1
+            case End(File()):
+                self.depth -= 1
+        if self.depth <= 0:
+            span = self.span
+            self.span = []
+            self.depth = 0
+            return span
+        return None
+
+    def rest(self) -> list[Element[Any]] | None:
+        """
+        Return the elements of any span that was never completed.
+        """
+        span = self.span
+        self.span = []
+        self.depth = 0
+        return span or None
+
+
+def spans(elements: Iterable[Element[Any]]) -> Iterator[list[Element[Any]]]:
+    """
+    Split a stream of elements into spans using :class:`Spans`.
+    """
+    splitter = Spans()
+    for element in elements:
+        if (span := splitter.add(element)) is not None:
+            yield span
+    if (span := splitter.rest()) is not None:
+        yield span
@@ -1,59 +1,538 @@
-from dataclasses import dataclass
-from typing import Iterable, Any, TypeAlias, Callable, Type, TypeVar, Generic, Mapping
+import re
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import (
+    Iterable, Any, TypeAlias, Callable, Type, TypeVar, Generic, Mapping, AsyncIterable, Sequence,
+    ClassVar,
+)
 
-from .elements import Element, Start, End, Text, File
+from .elements import Element, Start, End, Text, File, Block, RopeText, advance
 
 Action: TypeAlias = Callable[[Iterable[Element[Any]]], Iterable[Element[Any]]]
+AsyncAction: TypeAlias = Callable[[AsyncIterable[Element[Any]]], AsyncIterable[Element[Any]]]
 
 T = TypeVar("T", bound=Element[Any])
 
+Transformer: TypeAlias = Callable[[Element[Any]], Element[Any] | None]
+
+
+class Transform:
+    """
+    Base class for actions that transform or filter each element on its own,
+    returning either a replacement element or ``None`` to drop it.
+    Consecutive transforms can be fused into a single pass by :func:`fuse`.
+
+    Subclasses should implement :meth:`transform` or, if they need state that
+    lasts for a whole pass over the elements, :meth:`transformer`.
+    """
+
+    def transform(self, element: Element[Any]) -> Element[Any] | None:
+        raise NotImplementedError
+
+    def transformer(self) -> Transformer:
+        """
+        Return a callable to use for a single pass over the elements.
+        """
+        return self.transform
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        transform = self.transformer()
+        for element in elements:
+            result = transform(element)
+            if result is not None:
+                yield result
+
 
 @dataclass
-class Container(Generic[T]):
-    type: Type[T]
+class Fused:
+    """
+    A sequence of transforms applied in a single pass over the elements.
+    If one of them raises an exception, it and the element it was passed
+    are recorded as the :attr:`failure`.
+    """
+
+    transforms: Sequence[Transform]
+    failure: tuple[Transform, Element[Any]] | None = field(
+        init=False, default=None, repr=False, compare=False
+    )
 
     def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
-        current: T | None = None
-        value: Any
+        self.failure = None
+        transformers = [transform.transformer() for transform in self.transforms]
         for element in elements:
+            result: Element[Any] | None = element
+            try:
+                for transformer in transformers:
+                    result = transformer(element)
+                    if result is None:
+                        break
+                    element = result
+            except Exception:
+                self.failure = self.transforms[transformers.index(transformer)], element
+                raise
+            if result is not None:
+                yield result
+
+
+def fuse(actions: Sequence[Action]) -> list[Action]:
+    """
+    Combine each run of consecutive :class:`Transform` actions into a single
+    :class:`Fused` action. Other actions are left as they are.
+    """
+    fused: list[Action] = []
+    run: list[Transform] = []
+    for action in [*actions, None]:
+        if isinstance(action, Transform):
+            run.append(action)
+            continue
+        if len(run) > 1:
+            fused.append(Fused(run))
+        else:
+            fused.extend(run)
+        run = []
+        if action is not None:
+            fused.append(action)
+    return fused
+
+
+def unbatch(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+    """
+    Replace each :class:`~manipulate.elements.Block` with the elements it contains.
+    :func:`~manipulate.manipulate` does this before any action or destination
+    that does not have a true ``blocks`` attribute.
+    """
+    for element in elements:
+        if isinstance(element, Block):
+            yield from element.elements()
+        else:
+            yield element
+
+
+def _batchable(element: Element[Any]) -> bool:
+    match element:
+        case Start() | End() | Block() | RopeText():
+            return False
+        case Text(prefix=prefix):
+            return not prefix
+    return True
+
+
+@dataclass
+class Batch:
+    """
+    Combine runs of up to ``size`` consecutive elements of the same type and with
+    the same parent into :class:`~manipulate.elements.Block` elements.
+    :class:`~manipulate.elements.Start` and :class:`~manipulate.elements.End`
+    elements, text with a prefix and :class:`~manipulate.elements.RopeText`,
+    whose pieces would otherwise be joined, are passed on as they are.
+    """
+
+    size: int = 1024
+    blocks: ClassVar[bool] = True
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        batch: list[Element[Any]] = []
+        for element in elements:
+            if batch and (
+                len(batch) == self.size
+                or type(element) is not type(batch[0])
+                or element.parent is not batch[0].parent
+                or not _batchable(element)
+            ):
+                yield Block.of(batch)
+                batch = []
+            if _batchable(element):
+                batch.append(element)
+            else:
+                yield element
+        if batch:
+            yield Block.of(batch)
+
+
+@dataclass
+class Container(Transform, Generic[T]):
+    type: Type[T]
+    preserves_paths: ClassVar[bool] = True
+
+    def transformer(self) -> Transformer:
+        current: T | None = None
+        type_ = self.type
+
+        def transform(element: Element[Any]) -> Element[Any]:
+            nonlocal current
+            value: Any
             match element:
-                case Start(self.type(value)):
+                case Start(type_(value)):
                     if current is not None:
                         raise ValueError(f'attempt to open {value} before {current} was closed')
                     current = value
-                    yield element
-                case End(self.type(value)):
+                case End(type_(value)):
                     if value is not current:
                         raise ValueError(f'attempt to close {value} when {current} was open')
                     current = None
-                    yield element
-                case _:
-                    yield element
+            return element
+
+        return transform
+
+
+ClassifyRule: TypeAlias = Callable[[Path, bytes], Type[Text] | None]
 
 
 @dataclass
-class Classify:
+class Shebang:
     """
-    Classify the text within files as a particular format
+    A :class:`Classify` rule for files starting with a ``#!`` line, using the name of
+    the interpreter, including when run using ``env``. If the name isn't found, it is
+    looked up again without any version number, so ``python3.12`` can be ``python``.
     """
 
-    extensions: Mapping[str, Type[Text]]
+    interpreters: Mapping[str, Type[Text]]
 
-    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+    def __call__(self, path: Path, head: bytes) -> Type[Text] | None:
+        if not head.startswith(b'#!'):
+            return None
+        words = head[2:].split(b'\n', 1)[0].decode(errors='replace').split()
+        if words and words[0].rsplit('/', 1)[-1] == 'env':
+            words = [word for word in words[1:] if not word.startswith('-')]
+        if not words:
+            return None
+        name = words[0].rsplit('/', 1)[-1]
+        type_ = self.interpreters.get(name)
+        if type_ is None:
+            type_ = self.interpreters.get(name.rstrip('0123456789.'))
+        return type_
+
+
+@dataclass
+class Magic:
+    """
+    A :class:`Classify` rule for files whose content starts with one of the
+    supplied byte strings.
+    """
+
+    prefixes: Mapping[bytes, Type[Text]]
+
+    def __call__(self, path: Path, head: bytes) -> Type[Text] | None:
+        for prefix, type_ in self.prefixes.items():
+            if head.startswith(prefix):
+                return type_
+        return None
+
+
+@dataclass
+class Classify(Transform):
+    """
+    Classify the text within files as a particular format.
+
+    Files are classified by the suffix of their path using ``extensions``. Files with
+    other suffixes are passed to each of the ``rules`` in turn, along with the first
+    ``head_size`` bytes read from the file, until one returns a type. If none do, the
+    ``default`` is used if supplied. The results of the rules are kept for each path
+    and are reused while the file's inode, size and modification time are unchanged.
+    """
+
+    extensions: Mapping[str, Type[Text]] = field(default_factory=dict)
+    rules: Sequence[ClassifyRule] = ()
+    default: Type[Text] | None = None
+    head_size: int = 4096
+    _sniffed: dict[Path, tuple[tuple[int, int, int, int], Type[Text] | None]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    preserves_paths: ClassVar[bool] = True
+
+    def _sniff(self, path: Path) -> Type[Text] | None:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        key = stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+        sniffed = self._sniffed.get(path)
+        if sniffed is not None and sniffed[0] == key:
+            return sniffed[1]
+        with path.open('rb') as stream:
+            head = stream.read(self.head_size)
+        type_ = None
+        for rule in self.rules:
+            type_ = rule(path, head)
+            if type_ is not None:
+                break
+        self._sniffed[path] = key, type_
+        return type_
+
+    def _classify(self, path: Path) -> Type[Text]:
+        type_ = self.extensions.get(path.suffix)
+        if type_ is None and self.rules:
+            type_ = self._sniff(path)
+        if type_ is None:
+            type_ = self.default
+        if type_ is None:
+            if self.rules:
+                raise ValueError(f'Unable to classify {path}')
+            raise ValueError(f"Unable to classify extension: {path.suffix!r}")
+        return type_
+
+    def transformer(self) -> Transformer:
         type_: Type[Text] | None = None
-        for element in Container(File)(elements):
-            match element:
+        container = Container(File).transformer()
+
+        def transform(element: Element[Any]) -> Element[Any]:
+            nonlocal type_
+            match container(element):
                 case Start(File(path)):
-                    type_ = self.extensions.get(path.suffix)
-                    if type_ is None:
-                        raise ValueError(f"Unable to classify extension: {path.suffix!r}")
-                    yield element
+                    type_ = self._classify(path)
                 case Text(value, parent, line, column):
                     if type_ is None:
                         raise ValueError(f'{element} is not within a File()')
-                    yield type_(value, parent, line, column)
+                    return type_(value, parent, line, column)
                 case End(File(_)):
                     type_ = None
-                    yield element
-                case _:
-                    yield element
+            return element
+
+        return transform
+
+
+@dataclass
+class Select(Transform):
+    """
+    Drop each top-level file whose path the ``predicate`` returns ``False`` for,
+    along with all the elements within it. Elements outside any file are passed on.
+
+    The predicate is also provided as :attr:`path_predicate` so that
+    :func:`~manipulate.manipulate` can push it down into sources that support it,
+    so that the files it excludes are never read.
+    """
+
+    predicate: Callable[[Path], bool]
+    preserves_paths: ClassVar[bool] = True
+
+    @property
+    def path_predicate(self) -> Callable[[Path], bool]:
+        return self.predicate
+
+    def transformer(self) -> Transformer:
+        depth = 0
+        predicate = self.predicate
+
+        def transform(element: Element[Any]) -> Element[Any] | None:
+            nonlocal depth
+            if depth:
+                match element:
+                    case Start(File()):
+                        depth += 1
+                    case End(File()):
+                        depth -= 1
+                return None
+            match element:
+                case Start(File(path)) if not predicate(path):
+                    depth = 1
+                    return None
+            return element
+
+        return transform
+
+
+_SCOPED_FLAGS = {
+    re.ASCII: 'a', re.IGNORECASE: 'i', re.MULTILINE: 'm', re.DOTALL: 's', re.VERBOSE: 'x'
+}
+_GLOBAL_FLAGS = re.compile(r'(?:\(\?[aiLmsux]+\))+')
+_NUMBERED_REFERENCE = re.compile(r"""
+    # an escape, where three octal digits are a character rather than a group number:
+    \\(?:(?P<reference>[1-7](?![0-7]{2})|[89])|.)
+    # a character class, within which digits are never group numbers:
+    | \[\^?\]?(?:\\.|[^\]])*\]
+    # a conditional:
+    | \(\?\((?P<condition>\d)
+""", re.VERBOSE | re.DOTALL)
+
+
+def _scoped(pattern: re.Pattern[str]) -> str:
+    """
+    Return the source of the pattern with its flags applied inline, so that it can
+    be combined with others.
+    """
+    source = pattern.pattern
+    # flags set at the start of the pattern are in its flags, and can't be used within a group:
+    if leading := _GLOBAL_FLAGS.match(source):
+        source = source[leading.end():]
+    flags = ''.join(letter for flag, letter in _SCOPED_FLAGS.items() if pattern.flags & flag)
+    if not flags:
+        return source
+    # a newline ends any trailing comment in a verbose pattern:
+    end = '\n)' if pattern.flags & re.VERBOSE else ')'
+    return f'(?{flags}:{source}{end}'
+
+
+def _refers_by_number(pattern: re.Pattern[str]) -> bool:
+    """
+    Return ``True`` if the pattern contains a backreference or conditional that refers
+    to a group by number, which would refer to a different group once combined.
+    """
+    for match in _NUMBERED_REFERENCE.finditer(pattern.pattern):
+        if match['reference'] or match['condition']:
+            return True
+    return False
+
+
+def _trie(literals: Iterable[str]) -> str:
+    """
+    Return a regular expression matching the longest of the literals at any position,
+    with common prefixes factored out so that re need not try each literal in turn.
+    """
+    root: dict[str, Any] = {}
+    for literal in literals:
+        node = root
+        for character in literal:
+            node = node.setdefault(character, {})
+        node[''] = {}
+
+    def build(node: dict[str, Any]) -> str:
+        options = [
+            re.escape(character) + build(child) for character, child in node.items() if character
+        ]
+        if not options:
+            return ''
+        regex = options[0] if len(options) == 1 else f'(?:{"|".join(options)})'
+        if '' in node:
+            regex = f'(?:{regex})?'
+        return regex
+
+    return build(root)
+
+
+@dataclass
+class Replace:
+    """
+    Replace each of the keys of ``replacements`` with its value in the value of
+    every :class:`~manipulate.elements.Text`, in a single pass using a combined
+    regular expression. String keys are replaced literally while the values of
+    :class:`re.Pattern` keys may refer to the groups they match, as with
+    :meth:`re.Match.expand`. Where more than one key matches at the same position,
+    the longest string key is used, followed by the earliest pattern.
+
+    Patterns may not refer to groups by number, as their groups are numbered
+    differently once combined, and the names of their groups must be distinct.
+
+    Consecutive texts of the same type with the same parent and prefix, such as
+    the chunks of a file, are treated as one, so matches spanning them are found.
+    Matches, along with any lookahead, are assumed to be no longer than
+    ``max_length`` characters, which must be given if there are patterns and
+    otherwise defaults to the length of the longest string key. The text before
+    each chunk is searched along with it, so that anchors, word boundaries and
+    lookbehinds behave as they would in the whole text. The line and column of
+    each text are those at which it starts once replacements have been made.
+    """
+
+    replacements: Mapping[str | re.Pattern[str], str]
+    max_length: int | None = None
+    _regex: re.Pattern[str] | None = field(init=False, repr=False, compare=False)
+    _literals: dict[str, str] = field(init=False, repr=False, compare=False)
+    _patterns: dict[int, tuple[re.Pattern[str], str]] = field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        self._literals = {}
+        self._patterns = {}
+        parts = []
+        group = 1
+        names: set[str] = set()
+        for pattern, replacement in self.replacements.items():
+            if isinstance(pattern, str):
+                self._literals[pattern] = replacement
+            else:
+                if _refers_by_number(pattern):
+                    raise ValueError(
+                        f'{pattern.pattern!r} refers to a group by number, use a named group'
+                    )
+                for name in pattern.groupindex:
+                    if name in names:
+                        raise ValueError(f'group {name!r} is used in more than one pattern')
+                    names.add(name)
+                parts.append(f'({_scoped(pattern)})')
+                self._patterns[group] = (pattern, replacement)
+                group += 1 + pattern.groups
+        if self._literals:
+            parts.insert(0, f'(?:{_trie(self._literals)})')
+        self._regex = re.compile('|'.join(parts)) if parts else None
+        if self.max_length is None:
+            if self._patterns:
+                raise ValueError('max_length must be given when there are patterns')
+            self.max_length = max((len(literal) for literal in self._literals), default=0)
+
+    def _substitute(self, match: re.Match[str]) -> str:
+        if match.lastindex is None:
+            return self._literals[match.group()]
+        pattern, replacement = self._patterns[match.lastindex]
+        if '\\' not in replacement:
+            return replacement
+        own = pattern.match(match.string, match.start())
+        assert own is not None
+        return own.expand(replacement)
+
+    def _rewrite(
+        self, regex: re.Pattern[str], text: str, start: int, final: bool
+    ) -> tuple[str, int]:
+        """
+        Return the text from ``start`` rewritten and how much of the supplied text
+        it covers, with the text before ``start`` only being there as context.
+        Unless ``final`` is true, matches starting too close to the end of the text
+        to be complete are left to be found once more text is available.
+        """
+        assert self.max_length is not None
+        safe = len(text) if final else len(text) - max(self.max_length - 1, 0)
+        parts = []
+        position = start
+        for match in regex.finditer(text, start):
+            if not final and match.start() >= safe:
+                break
+            parts.append(text[position:match.start()])
+            parts.append(self._substitute(match))
+            position = match.end()
+        consumed = max(position, safe)
+        parts.append(text[position:consumed])
+        return ''.join(parts), consumed
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        regex = self._regex
+        if regex is None:
+            yield from elements
+            return
+        assert self.max_length is not None
+        held: Text | None = None
+        context = carry = ''
+        continues = False
+        line: int | None = None
+        column: int | None = None
+        for element in elements:
+            if held is not None:
+                continues = (
+                    type(element) is type(held)
+                    and element.parent is held.parent
+                    and element.prefix == held.prefix
+                )
+                text = context + carry + held.value
+                start = len(context)
+                rewritten, consumed = self._rewrite(regex, text, start, final=not continues)
+                carry = text[consumed:]
+                if continues:
+                    kept = max(consumed - start, self.max_length)
+                    context = text[max(consumed - kept, 0):consumed]
+                else:
+                    context = ''
+                if rewritten:
+                    yield replace(held, value=rewritten, line=line, column=column)
+                    if line is not None and column is not None:
+                        line, column = advance(rewritten, line, column)
+                held = None
+            if isinstance(element, Text):
+                if not continues:
+                    line, column = element.line, element.column
+                held = element
+            else:
+                yield element
+        if held is not None:
+            rewritten, _ = self._rewrite(
+                regex, context + carry + held.value, len(context), final=True
+            )
+            if rewritten:
+                yield replace(held, value=rewritten, line=line, column=column)
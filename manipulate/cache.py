@@ -0,0 +1,214 @@
+import json
+import os
+import pickle
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from hashlib import sha256, file_digest
+from pathlib import Path
+from threading import Lock
+from types import FunctionType, BuiltinFunctionType
+from typing import Sequence, Any, Callable, Generic, TypeVar, cast
+from uuid import uuid4
+
+from .actions import Action
+from .elements import Text
+
+
+def _describe(obj: Callable[..., Any]) -> str:
+    if isinstance(obj, (FunctionType, BuiltinFunctionType, type)):
+        return f'{obj.__module__}.{obj.__qualname__}'
+    type_ = type(obj)
+    return f'{type_.__module__}.{type_.__qualname__}:{obj!r}'
+
+
+def fingerprint(actions: Sequence[Action]) -> str:
+    """
+    Return a fingerprint for a sequence of actions. This is based on the
+    name of each function or the type and :func:`repr` of each callable,
+    so actions with a stable :func:`repr`, such as dataclasses, should be used.
+    """
+    digest = sha256()
+    for action in actions:
+        digest.update(_describe(action).encode() + b'\n')
+    return digest.hexdigest()
+
+
+@dataclass
+class Cache:
+    """
+    A record, persisted to the file at ``path``, of the state of each source file
+    once its output has been written. When the ``actions`` are unchanged, files
+    that are also unchanged can be skipped on later runs.
+
+    By default, a file is considered unchanged if its modification time and size
+    are unchanged. If ``hash_content`` is true, a hash of its content is used instead.
+    """
+
+    path: Path
+    actions: Sequence[Action] = field(repr=False)
+    hash_content: bool = False
+    fingerprint: str = field(init=False, repr=False, compare=False)
+    entries: dict[str, Any] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.fingerprint = fingerprint(self.actions)
+        self.entries = {}
+        try:
+            data = json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get('fingerprint') == self.fingerprint:
+            self.entries = data['files']
+
+    def _state(self, path: Path) -> Any:
+        if self.hash_content:
+            with path.open('rb') as stream:
+                return file_digest(stream, 'sha256').hexdigest()
+        stat = path.stat()
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def unchanged(self, path: Path) -> bool:
+        """
+        Return ``True`` if the file at the supplied path has not changed since
+        it was last recorded.
+        """
+        recorded = self.entries.get(str(path))
+        if recorded is None:
+            return False
+        try:
+            return bool(self._state(path) == recorded)
+        except FileNotFoundError:
+            return False
+
+    def record(self, path: Path) -> None:
+        """
+        Record the current state of the file at the supplied path.
+        """
+        self.entries[str(path)] = self._state(path)
+
+    def save(self) -> None:
+        temp = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+        temp.write_text(json.dumps({'fingerprint': self.fingerprint, 'files': self.entries}))
+        os.replace(temp, self.path)
+
+
+R = TypeVar('R')
+
+
+@dataclass
+class ParseCache(Generic[R]):
+    """
+    The results of calling ``parser`` on the values of :class:`~manipulate.elements.Text`
+    elements, keyed by a hash of the value and the type of the element, so that
+    actions sharing a cache parse each distinct text of a given type only once.
+    Results are shared between callers and so must not be modified.
+
+    Up to ``size`` results are kept in memory, discarding the least recently used.
+    If ``path`` is supplied, results are also pickled to files in that directory
+    and are loaded from there when not in memory, including on later runs. When the
+    cache is created, the least recently used files beyond ``max_files`` are removed.
+    Results that can't be pickled are only kept in memory.
+
+    Results on disk are keyed by the module and qualified name of the parser, or the
+    type and :func:`repr` of a callable object, so they are not invalidated when the
+    parser's code changes and two lambdas in the same module share them. Supply a
+    different ``version`` whenever the parser changes in a way that alters its results.
+    """
+
+    parser: Callable[[str], R]
+    size: int = 128
+    path: Path | None = None
+    max_files: int | None = None
+    version: str = ''
+    hits: int = field(init=False, default=0, repr=False, compare=False)
+    misses: int = field(init=False, default=0, repr=False, compare=False)
+    _results: OrderedDict[str, R] = field(
+        init=False, default_factory=OrderedDict, repr=False, compare=False
+    )
+    _lock: Lock = field(init=False, default_factory=Lock, repr=False, compare=False)
+    _parser: bytes = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._parser = f'{_describe(self.parser)}\n{self.version}'.encode()
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            if self.max_files is not None:
+                self._prune(self.max_files)
+
+    def __getstate__(self) -> dict[str, Any]:
+        # so that actions using a cache can be sent to a process pool:
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_results'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state, _lock=Lock())
+
+    def _prune(self, max_files: int) -> None:
+        assert self.path is not None
+        files = sorted(self.path.glob('*.pickle'), key=lambda path: path.stat().st_mtime_ns)
+        for path in files[:max(len(files) - max_files, 0)]:
+            path.unlink(missing_ok=True)
+
+    def _key(self, text: Text) -> str:
+        type_ = type(text)
+        digest = sha256(self._parser)
+        digest.update(f'\n{type_.__module__}.{type_.__qualname__}\n'.encode())
+        digest.update(text.value.encode(errors='surrogatepass'))
+        return digest.hexdigest()
+
+    def _load(self, key: str) -> tuple[bool, Any]:
+        assert self.path is not None
+        path = self.path / f'{key}.pickle'
+        try:
+            with path.open('rb') as stream:
+                result = pickle.load(stream)
+        except Exception:
+            # missing or unreadable, perhaps having been written by another version of Python:
+            return False, None
+        os.utime(path)
+        return True, result
+
+    def _store(self, key: str, result: R) -> None:
+        assert self.path is not None
+        path = self.path / f'{key}.pickle'
+        temp = path.with_name(f'.{path.name}.{uuid4().hex}.tmp')
+        try:
+            with temp.open('xb') as stream:
+                pickle.dump(result, stream, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # the result can't be pickled, so is only kept in memory
+            pass
+        finally:
+            temp.unlink(missing_ok=True)
+
+    def _remember(self, key: str, result: R) -> None:
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+    def get(self, text: Text) -> R:
+        """
+        Return the result of parsing the value of the supplied text.
+        """
+        key = self._key(text)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return self._results[key]
+        if self.path is not None:
+            found, result = self._load(key)
+            if found:
+                self.hits += 1
+                self._remember(key, result)
+                return cast(R, result)
+        self.misses += 1
+        result = self.parser(text.value)
+        self._remember(key, result)
+        if self.path is not None:
+            self._store(key, result)
+        return result
@@ -0,0 +1,257 @@
+"""
+A compact binary format for streams of elements, so that the output of expensive
+stages can be saved and reloaded.
+
+A checkpoint is a header followed by records, each starting with a byte giving
+its kind. Element types are recorded once, by name. Elements referred to by other
+elements, such as parents, are recorded once and then referred to by number.
+Paths and short strings are interned in a fixed number of numbered slots, so
+repeated values are usually recorded once. When all the slots are taken, the
+slot of the least recently used value is redefined.
+
+Reading a checkpoint imports the modules named in it and unpickles values that
+can't be recorded otherwise, so only checkpoints from trusted sources should be read.
+"""
+import pickle
+from collections import OrderedDict
+from dataclasses import fields
+from importlib import import_module
+from pathlib import Path
+from struct import Struct
+from typing import Any, IO, Iterator
+
+from .elements import Element
+
+MAGIC = b'MANIPULATE-CHECKPOINT\x03'
+
+#: Strings no longer than this are interned.
+INTERN_LENGTH = 32
+#: The number of interned values a :class:`Writer` holds by default.
+INTERN_SLOTS = 4096
+
+_TYPE = 1
+_DEFINE = 2
+_ELEMENT = 3
+_REFERENCE = 4
+
+_NONE = 0
+_STR = 1
+_BYTES = 2
+_PATH = 3
+_INT = 4
+_INTERNED = 5
+_INTERN = 6
+_NESTED = 7
+_PICKLED = 8
+
+_header = Struct('<HIBII')
+
+_HAS_LINE = 1
+_HAS_COLUMN = 2
+_MAX_POSITION = 2**32 - 1
+_size = Struct('<I')
+_int = Struct('<q')
+
+_BASE_FIELDS = {'value', 'parent', 'line', 'column'}
+
+
+def _extra_fields(type_: type[Element[Any]]) -> tuple[str, ...]:
+    return tuple(
+        field.name for field in fields(type_) if field.init and field.name not in _BASE_FIELDS
+    )
+
+
+def _import(name: str) -> type[Element[Any]]:
+    module_name, qualname = name.split(':')
+    obj: Any = import_module(module_name)
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    return obj  # type: ignore[no-any-return]
+
+
+class Writer:
+    """
+    Write elements to a binary stream in the checkpoint format, interning
+    up to ``intern_slots`` values at once.
+    """
+
+    def __init__(self, stream: IO[bytes], intern_slots: int = INTERN_SLOTS) -> None:
+        if intern_slots < 1:
+            raise ValueError(f'intern_slots must be at least 1, not {intern_slots}')
+        self.stream = stream
+        self.intern_slots = intern_slots
+        self.types: dict[type[Element[Any]], tuple[int, tuple[str, ...]]] = {}
+        # elements are kept so that their ids can't be reused:
+        self.defined: dict[int, tuple[int, Element[Any]]] = {}
+        # least recently used first:
+        self.interned: OrderedDict[Any, int] = OrderedDict()
+        stream.write(MAGIC)
+
+    def _type(self, type_: type[Element[Any]]) -> tuple[int, tuple[str, ...]]:
+        known = self.types.get(type_)
+        if known is None:
+            name = f'{type_.__module__}:{type_.__qualname__}'.encode()
+            self.stream.write(bytes((_TYPE,)) + _size.pack(len(name)) + name)
+            known = self.types[type_] = len(self.types), _extra_fields(type_)
+        return known
+
+    def _reference(self, element: Element[Any]) -> int:
+        known = self.defined.get(id(element))
+        if known is None:
+            self._record(_DEFINE, element)
+            number = len(self.defined) + 1
+            self.defined[id(element)] = number, element
+            return number
+        return known[0]
+
+    def _value(self, value: Any, parts: list[bytes]) -> None:
+        if value is None:
+            parts.append(bytes((_NONE,)))
+        elif isinstance(value, (str, Path)) and (
+            isinstance(value, Path) or len(value) <= INTERN_LENGTH
+        ):
+            key = (type(value), value)
+            interned = self.interned
+            number = interned.get(key)
+            if number is None:
+                if len(interned) < self.intern_slots:
+                    number = len(interned)
+                else:
+                    _, number = interned.popitem(last=False)
+                interned[key] = number
+                parts.append(bytes((_INTERN,)) + _size.pack(number))
+                self._value_uninterned(value, parts)
+            else:
+                interned.move_to_end(key)
+                parts.append(bytes((_INTERNED,)) + _size.pack(number))
+        else:
+            self._value_uninterned(value, parts)
+
+    def _value_uninterned(self, value: Any, parts: list[bytes]) -> None:
+        if isinstance(value, str):
+            encoded = value.encode(errors='surrogatepass')
+            parts.append(bytes((_STR,)) + _size.pack(len(encoded)) + encoded)
+        elif isinstance(value, Path):
+            encoded = str(value).encode(errors='surrogateescape')
+            parts.append(bytes((_PATH,)) + _size.pack(len(encoded)) + encoded)
+        elif isinstance(value, (bytes, memoryview)):
+            parts.append(bytes((_BYTES,)) + _size.pack(len(value)) + bytes(value))
+        elif type(value) is int and -2**63 <= value < 2**63:
+            parts.append(bytes((_INT,)) + _int.pack(value))
+        elif isinstance(value, Element):
+            parts.append(bytes((_NESTED,)) + _size.pack(self._reference(value)))
+        else:
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            parts.append(bytes((_PICKLED,)) + _size.pack(len(pickled)) + pickled)
+
+    def _record(self, kind: int, element: Element[Any]) -> None:
+        flags = 0
+        for name, flag in ('line', _HAS_LINE), ('column', _HAS_COLUMN):
+            position = getattr(element, name)
+            if position is not None:
+                if not 0 <= position <= _MAX_POSITION:
+                    raise ValueError(
+                        f'{name} of {element} must be between 0 and {_MAX_POSITION}'
+                    )
+                flags |= flag
+        type_number, extra = self._type(type(element))
+        parent = 0 if element.parent is None else self._reference(element.parent)
+        values = [element.value, *(getattr(element, name) for name in extra)]
+        # define nested elements first, so that values are interned in the order written:
+        for value in values:
+            if isinstance(value, Element):
+                self._reference(value)
+        parts = [
+            bytes((kind,)),
+            _header.pack(type_number, parent, flags, element.line or 0, element.column or 0),
+        ]
+        for value in values:
+            self._value(value, parts)
+        self.stream.write(b''.join(parts))
+
+    def write(self, element: Element[Any]) -> None:
+        known = self.defined.get(id(element))
+        if known is None:
+            self._record(_ELEMENT, element)
+        else:
+            self.stream.write(bytes((_REFERENCE,)) + _size.pack(known[0]))
+
+
+class Reader:
+    """
+    Read elements from a binary stream in the checkpoint format.
+    """
+
+    def __init__(self, stream: IO[bytes]) -> None:
+        self.stream = stream
+        self.types: list[tuple[type[Element[Any]], tuple[str, ...]]] = []
+        self.defined: list[Element[Any]] = []
+        self.interned: list[Any] = []
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a checkpoint')
+
+    def _read(self, size: int) -> bytes:
+        data = self.stream.read(size)
+        if len(data) != size:
+            raise ValueError('checkpoint is truncated')
+        return data
+
+    def _sized(self) -> bytes:
+        size, = _size.unpack(self._read(_size.size))
+        return self._read(size)
+
+    def _value(self) -> Any:
+        tag = self._read(1)[0]
+        if tag == _NONE:
+            return None
+        if tag == _STR:
+            return self._sized().decode(errors='surrogatepass')
+        if tag == _PATH:
+            return Path(self._sized().decode(errors='surrogateescape'))
+        if tag == _BYTES:
+            return self._sized()
+        if tag == _INT:
+            return _int.unpack(self._read(_int.size))[0]
+        if tag == _INTERN:
+            number, = _size.unpack(self._read(_size.size))
+            value = self._value()
+            if number == len(self.interned):
+                self.interned.append(value)
+            else:
+                self.interned[number] = value
+            return value
+        if tag == _INTERNED:
+            return self.interned[_size.unpack(self._read(_size.size))[0]]
+        if tag == _NESTED:
+            return self.defined[_size.unpack(self._read(_size.size))[0] - 1]
+        if tag == _PICKLED:
+            return pickle.loads(self._sized())
+        raise ValueError(f'unknown value tag in checkpoint: {tag}')
+
+    def _element(self) -> Element[Any]:
+        type_number, parent, flags, line, column = _header.unpack(self._read(_header.size))
+        type_, extra = self.types[type_number]
+        value = self._value()
+        extras = [self._value() for _ in extra]
+        element: Element[Any] = type_(
+            value,
+            None if not parent else self.defined[parent - 1],
+            line if flags & _HAS_LINE else None,
+            column if flags & _HAS_COLUMN else None,
+            *extras,
+        )
+        return element
+
+    def __iter__(self) -> Iterator[Element[Any]]:
+        while kind := self.stream.read(1):
+            if kind[0] == _TYPE:
+                type_ = _import(self._sized().decode())
+                self.types.append((type_, _extra_fields(type_)))
+            elif kind[0] == _DEFINE:
+                self.defined.append(self._element())
+            elif kind[0] == _ELEMENT:
+                yield self._element()
+            elif kind[0] == _REFERENCE:
+                yield self.defined[_size.unpack(self._read(_size.size))[0] - 1]
+            else:
+                raise ValueError(f'unknown record kind in checkpoint: {kind[0]}')
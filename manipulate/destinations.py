@@ -1,50 +1,311 @@
-from dataclasses import dataclass
+import asyncio
+import os
+import pickle
+import shutil
+import sys
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from filecmp import cmp
+from uuid import uuid4
 from pathlib import Path
-from typing import Protocol, Iterable, Any, TextIO
+from tempfile import mkstemp
+from threading import Lock, Semaphore
+from typing import (
+    Protocol, Iterable, Any, IO, ClassVar, Type, AsyncIterable, Iterator, Callable
+)
 
+from ._pipeline import Spans
 from .actions import Container
-from .elements import Element, Start, File, Text, End
+from .cache import Cache
+from .checkpoint import Writer
+from .elements import Element, Start, File, Text, End, Bytes, Block, RopeText
 
 
 class Destination(Protocol):
     def handle(self, elements: Iterable[Element[Any]]) -> None: ...
 
 
+class AsyncDestination(Protocol):
+    async def handle(self, elements: AsyncIterable[Element[Any]]) -> None: ...
+
+
 @dataclass
 class Files:
+    """
+    Write files to the paths of the :class:`~manipulate.elements.File` elements
+    received, with relative paths being written within the directory at ``path``.
+
+    If a :class:`~manipulate.cache.Cache` is supplied, the state of the file at the
+    path of each :class:`~manipulate.elements.File` element is recorded once it has
+    been written and the cache is saved when handling is complete.
+
+    If ``atomic`` is true, each file is written to a temporary file in the same
+    directory which then replaces the target using :func:`os.replace`, so the
+    target is never seen partially written and is left untouched on error.
+    If ``skip_unchanged`` is true, files are also written in this way but a
+    target whose content would be unchanged is not replaced, leaving its
+    modification time as it was.
+
+    If ``writers`` is specified, the content of each file is collected in memory
+    and, once the file is complete, written by one of that many writer threads
+    while the pipeline carries on. No more than ``max_pending`` files will be
+    waiting to be written at once. All files have been written by the time
+    :meth:`handle` returns.
+
+    :class:`~manipulate.elements.Block` elements of the content type are
+    written without being unbatched, and the pieces of
+    :class:`~manipulate.elements.RopeText` elements are written without being joined.
+    """
+
     path: Path | None = None
+    cache: Cache | None = None
+    atomic: bool = False
+    skip_unchanged: bool = False
+    writers: int = 0
+    max_pending: int = 16
+
+    content: ClassVar[Type[Element[Any]]] = Text
+    mode: ClassVar[str] = 'w'
+    blocks: ClassVar[bool] = True
 
     def __post_init__(self) -> None:
         if not (self.path is None or self.path.is_dir()):
             raise TypeError(f'not a directory: {self.path}')
+        if self.writers < 0:
+            raise ValueError(f'writers must not be negative, not {self.writers}')
+        if self.max_pending < 1:
+            raise ValueError(f'max_pending must be at least 1, not {self.max_pending}')
+
+    def _path_to_open(self, path: Path) -> Path:
+        if path.is_absolute():
+            return path
+        if self.path is None:
+            raise ValueError(f'no directory for {path}')
+        return self.path / path
+
+    def _temp_path(self, target: Path) -> Path | None:
+        if self.atomic or self.skip_unchanged:
+            return target.with_name(f'.{target.name}.{uuid4().hex}.tmp')
+        return None
+
+    def _commit(self, target: Path, temp: Path) -> None:
+        if target.exists():
+            if self.skip_unchanged and cmp(temp, target, shallow=False):
+                temp.unlink()
+                return
+            shutil.copymode(target, temp)
+        os.replace(temp, target)
+
+    def _write(self, path: Path, values: list[Any], record: Lock) -> None:
+        target = self._path_to_open(path)
+        temp = self._temp_path(target)
+        try:
+            if temp is None:
+                stream = target.open(self.mode)
+            else:
+                stream = temp.open(self.mode.replace('w', 'x'))
+            with stream:
+                stream.writelines(values)
+            if temp is not None:
+                self._commit(target, temp)
+                temp = None
+            if self.cache is not None:
+                with record:
+                    self.cache.record(path)
+        except Exception as exception:
+            exception.add_note(f'Writing {File(path)}')
+            raise
+        finally:
+            if temp is not None:
+                temp.unlink(missing_ok=True)
+
+    def _handle_behind(self, elements: Iterable[Element[Any]]) -> None:
+        capacity = Semaphore(self.max_pending)
+        record = Lock()
+        writes: set[Future[None]] = set()
+        errors: list[BaseException] = []
+        current: Path | None = None
+        values: list[Any] = []
+
+        def done(write: Future[None]) -> None:
+            writes.discard(write)
+            capacity.release()
+            if not write.cancelled() and (exception := write.exception()) is not None:
+                errors.append(exception)
+
+        def submit(path: Path, values: list[Any]) -> None:
+            capacity.acquire()
+            if errors:
+                capacity.release()
+                raise errors[0]
+            write = executor.submit(self._write, path, values, record)
+            writes.add(write)
+            write.add_done_callback(done)
+
+        executor = ThreadPoolExecutor(self.writers)
+        try:
+            for element in Container(File)(elements):
+                match element:
+                    case Start(File(path)):
+                        current = path
+                        values = []
+                    case RopeText() as rope if issubclass(type(rope), self.content):
+                        if current is None:
+                            raise ValueError(f'no path specified to write {element}')
+                        values.extend(rope.pieces())
+                    case self.content(value):
+                        if current is None:
+                            raise ValueError(f'no path specified to write {element}')
+                        values.append(value)
+                    case Block(block_values, type=type_) if issubclass(type_, self.content):
+                        if current is None:
+                            raise ValueError(f'no path specified to write {element}')
+                        values.extend(block_values)
+                    case End(File(_)):
+                        assert current is not None
+                        submit(current, values)
+                        current = None
+                    case _:
+                        raise TypeError(f"{type(self).__qualname__} can't handle {element}")
+        finally:
+            executor.shutdown(wait=True, cancel_futures=bool(errors))
+            if self.cache is not None:
+                self.cache.save()
+        if errors:
+            raise errors[0]
 
     def handle(self, elements: Iterable[Element[Any]]) -> None:
-        stream: TextIO | None = None
+        if self.writers:
+            self._handle_behind(elements)
+            return
+        stream: IO[Any] | None = None
+        temp: Path | None = None
         try:
             for element in Container(File)(elements):
                 match element:
-                    case Start(File(start_path)):
-                        path = start_path
-                        if path.is_absolute():
-                            path_to_open = path
+                    case Start(File(path)):
+                        target = self._path_to_open(path)
+                        temp = self._temp_path(target)
+                        if temp is None:
+                            stream = target.open(self.mode)
                         else:
-                            if self.path is None:
-                                raise ValueError(f'no directory for {path}')
-                            path_to_open = self.path / path
-                        stream = path_to_open.open('w')
-                    case Text(text):
+                            stream = temp.open(self.mode.replace('w', 'x'))
+                        current = path
+                    case RopeText() as rope if issubclass(type(rope), self.content):
+                        if stream is None:
+                            raise ValueError(f'no path specified to write {element}')
+                        stream.writelines(rope.pieces())
+                    case self.content(text):
                         if stream is None:
                             raise ValueError(f'no path specified to write {element}')
                         stream.write(text)
+                    case Block(texts, type=type_) if issubclass(type_, self.content):
+                        if stream is None:
+                            raise ValueError(f'no path specified to write {element}')
+                        stream.writelines(texts)
                     case End(File(_)):
                         assert stream is not None
                         stream.close()
                         stream = None
+                        if temp is not None:
+                            self._commit(target, temp)
+                            temp = None
+                        if self.cache is not None:
+                            self.cache.record(current)
                     case _:
                         raise TypeError(f"{type(self).__qualname__} can't handle {element}")
         finally:
             if stream is not None:
                 stream.close()
+            if temp is not None:
+                temp.unlink(missing_ok=True)
+            if self.cache is not None:
+                self.cache.save()
+
+
+class BinaryFiles(Files):
+    """
+    Write :class:`~manipulate.elements.Bytes` elements to files. Values are
+    written as they are received, so :class:`memoryview` slices such as those
+    from :class:`~manipulate.sources.MappedFiles` are never copied or joined.
+    """
+
+    content = Bytes
+    mode = 'wb'
+
+
+@dataclass
+class AsyncFiles:
+    """
+    Write files in worker threads, with up to ``concurrency`` files being
+    written at once. Each file is collected in memory and then written in
+    the same way as :class:`Files`.
+    """
+
+    path: Path | None = None
+    concurrency: int = 8
+    files: Files = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.concurrency < 1:
+            raise ValueError(f'concurrency must be at least 1, not {self.concurrency}')
+        self.files = Files(self.path)
+
+    async def handle(self, elements: AsyncIterable[Element[Any]]) -> None:
+        capacity = asyncio.Semaphore(self.concurrency)
+        writes: set[asyncio.Task[None]] = set()
+        errors: list[BaseException] = []
+
+        def done(task: asyncio.Task[None]) -> None:
+            writes.discard(task)
+            capacity.release()
+            if not task.cancelled() and (exception := task.exception()) is not None:
+                errors.append(exception)
+
+        async def write(span: list[Element[Any]]) -> None:
+            await capacity.acquire()
+            if errors:
+                capacity.release()
+                raise errors[0]
+            task = asyncio.create_task(asyncio.to_thread(self.files.handle, span))
+            writes.add(task)
+            task.add_done_callback(done)
+
+        spans = Spans()
+        try:
+            async for element in elements:
+                if (span := spans.add(element)) is not None:
+                    await write(span)
+            if (span := spans.rest()) is not None:
+                await write(span)
+        finally:
+            if writes:
+                await asyncio.wait(writes)
+        if errors:
+            raise errors[0]
+
+
+@dataclass
+class Checkpoint:
+    """
+    Record the elements received in a checkpoint file at ``path``, which can be
+    read back using a :class:`~manipulate.sources.Checkpoint`. The file is written
+    to a temporary file and only replaces ``path`` once all elements are recorded.
+    """
+
+    path: Path
+
+    def handle(self, elements: Iterable[Element[Any]]) -> None:
+        temp = self.path.with_name(f'.{self.path.name}.{uuid4().hex}.tmp')
+        try:
+            with temp.open('xb') as stream:
+                writer = Writer(stream)
+                for element in elements:
+                    writer.write(element)
+            os.replace(temp, self.path)
+        finally:
+            temp.unlink(missing_ok=True)
 
 
 class Memory:
@@ -52,3 +313,118 @@ class Memory:
 
     def handle(self, elements: Iterable[Element[Any]]) -> None:
         self.elements = list(elements)
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickles elements without the elements they refer to, such as their parents,
+    which are instead kept in ``nested`` and referred to by index.
+    """
+
+    def __init__(self, file: IO[bytes], nested: list[Element[Any]]) -> None:
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.nested = nested
+        self.indexes = {id(element): i for i, element in enumerate(nested)}
+        self.top: Element[Any] | None = None
+
+    def persistent_id(self, obj: Any) -> int | None:
+        if obj is self.top or not isinstance(obj, Element):
+            return None
+        index = self.indexes.get(id(obj))
+        if index is None:
+            index = self.indexes[id(obj)] = len(self.nested)
+            self.nested.append(obj)
+        return index
+
+    def dump_element(self, element: Element[Any]) -> None:
+        self.top = element
+        self.dump(element)
+        self.clear_memo()
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def __init__(self, file: IO[bytes], nested: list[Element[Any]]) -> None:
+        super().__init__(file)
+        self.nested = nested
+
+    def persistent_load(self, pid: Any) -> Element[Any]:
+        return self.nested[int(pid)]
+
+
+@dataclass
+class Spool:
+    """
+    Collect elements in memory until there are ``max_elements`` of them or, if
+    ``max_bytes`` is specified, their approximate size, as given by
+    :func:`sys.getsizeof`, reaches it. Further elements are pickled to a temporary
+    file in ``directory``, or the default temporary directory, which is removed when
+    the spool is discarded or :meth:`close` is called.
+
+    Iterating over the spool provides all the elements in the order they were
+    received. Elements referred to by spilled elements, such as their parents, are
+    kept in memory so that they are provided as the same objects.
+    """
+
+    max_elements: int | None = 100_000
+    max_bytes: int | None = None
+    directory: Path | None = None
+    #: The elements held in memory.
+    elements: list[Element[Any]] = field(init=False, default_factory=list, repr=False)
+    #: The number of elements spilled to disk.
+    spilled: int = field(init=False, default=0, repr=False)
+    _nested: list[Element[Any]] = field(init=False, default_factory=list, repr=False)
+    _path: Path | None = field(init=False, default=None, repr=False)
+    _remove: Callable[[], Any] | None = field(init=False, default=None, repr=False)
+
+    def _full(self, size: int) -> bool:
+        if self.max_elements is not None and len(self.elements) >= self.max_elements:
+            return True
+        return self.max_bytes is not None and size >= self.max_bytes
+
+    def handle(self, elements: Iterable[Element[Any]]) -> None:
+        self.close()
+        self.elements = []
+        self._nested = []
+        size = 0
+        iterator = iter(elements)
+        for element in iterator:
+            self.elements.append(element)
+            if self.max_bytes is not None:
+                size += sys.getsizeof(element) + sys.getsizeof(element.value)
+            if self._full(size):
+                break
+        else:
+            return
+        handle, path = mkstemp(prefix='manipulate-', suffix='.spool', dir=self.directory)
+        self._path = Path(path)
+        self._remove = weakref.finalize(self, os.unlink, path)
+        with open(handle, 'wb') as stream:
+            pickler = _Pickler(stream, self._nested)
+            for element in iterator:
+                pickler.dump_element(element)
+                self.spilled += 1
+
+    def __iter__(self) -> Iterator[Element[Any]]:
+        yield from self.elements
+        if self._path is None:
+            return
+        with self._path.open('rb') as stream:
+            unpickler = _Unpickler(stream, self._nested)
+            for _ in range(self.spilled):
+                yield unpickler.load()
+
+    def __len__(self) -> int:
+        return len(self.elements) + self.spilled
+
+    def close(self) -> None:
+        """
+        Remove any temporary file and discard the elements held.
+        """
+        if self._remove is not None:
+            self._remove()
+            self._remove = None
+        self._path = None
+        self.elements = []
+        self._nested = []
+        self.spilled = 0
@@ -1,12 +1,14 @@
-from dataclasses import dataclass
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field, replace
+from itertools import accumulate
 from pathlib import Path
-from typing import TypeVar, Generic, Any
+from typing import TypeVar, Generic, Any, Iterator, Sequence, Type, Self
 
 
 T = TypeVar('T')
 
 
-@dataclass
+@dataclass(slots=True)
 class Element(Generic[T]):
     value: T
     parent: 'Element[Any] | None' = None
@@ -26,37 +28,279 @@ class Element(Generic[T]):
 
 
 class Start(Element[T]):
-    pass
+    __slots__ = ()
 
 
 class End(Element[T]):
-    pass
+    __slots__ = ()
 
 
 class File(Element[Path]):
-    pass
+    __slots__ = ()
 
 
-class Bytes(Element[bytes]):
-    pass
+class Bytes(Element[bytes | memoryview]):
+    __slots__ = ()
 
 
 MAX_TEXT_STR_SIZE = 50
 TEXT_STR_ABBREVIATED_SIZE = int(MAX_TEXT_STR_SIZE / 2)
 
 
-@dataclass
+@dataclass(slots=True)
 class Text(Element[str]):
     """
     A textual element. If it is embedded within another textual element or file,
     it may have a prefix specified, if that prefix occurs before every line making
     up this element.
+
+    The offsets of the newlines in the value are found the first time a position
+    within it is needed and kept, so that later lookups don't rescan the text.
     """
 
     prefix: str = ''
+    _newlines: tuple[str, list[int]] | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def newlines(self) -> list[int]:
+        """
+        The offsets of the newlines in the value.
+        """
+        value = self.value
+        if self._newlines is None or self._newlines[0] is not value:
+            offsets = []
+            offset = value.find('\n')
+            while offset != -1:
+                offsets.append(offset)
+                offset = value.find('\n', offset + 1)
+            self._newlines = value, offsets
+        return self._newlines[1]
+
+    def _start(self) -> tuple[int, int]:
+        if self.line is None or self.column is None:
+            raise ValueError(f'{self} has no line and column')
+        return self.line, self.column
+
+    def position(self, offset: int) -> tuple[int, int]:
+        """
+        Return the line and column of the character at the supplied offset
+        within the value.
+        """
+        if not 0 <= offset <= len(self.value):
+            raise ValueError(f'offset {offset} is not within {self}')
+        line, column = self._start()
+        newlines = self.newlines()
+        count = bisect_left(newlines, offset)
+        if count:
+            return line + count, offset - newlines[count - 1]
+        return line, column + offset
+
+    def offset(self, line: int, column: int) -> int:
+        """
+        Return the offset within the value of the character at the supplied
+        line and column.
+        """
+        start_line, start_column = self._start()
+        newlines = self.newlines()
+        count = line - start_line
+        if 0 <= count <= len(newlines):
+            if count:
+                start = newlines[count - 1] + 1
+                offset = start + column - 1
+            else:
+                start = 0
+                offset = column - start_column
+            end = newlines[count] if count < len(newlines) else len(self.value)
+            if start <= offset <= end:
+                return offset
+        raise ValueError(f'line {line}, column {column} is not within {self}')
+
+    def slice(self, start: int, stop: int | None = None) -> Self:
+        """
+        Return a copy of this element containing only the supplied slice of the value,
+        with its line and column, if known, set to where that slice starts.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self.value))
+        value = self.value[start:stop]
+        if self.line is None or self.column is None:
+            return replace(self, value=value)
+        line, column = self.position(start)
+        result = replace(self, value=value, line=line, column=column)
+        newlines = self.newlines()
+        first = bisect_left(newlines, start)
+        last = bisect_left(newlines, max(start, stop), first)
+        result._newlines = value, [offset - start for offset in newlines[first:last]]
+        return result
 
     def _value_repr(self) -> str:
         text = self.value
         if len(text) > MAX_TEXT_STR_SIZE:
             text = text[:TEXT_STR_ABBREVIATED_SIZE] + '...' + text[-TEXT_STR_ABBREVIATED_SIZE:]
         return repr(text)
+
+
+# the slot holding the value of each element:
+_value: Any = Element.__dict__['value']
+
+
+@dataclass(frozen=True, slots=True)
+class _Pieces:
+    # each span is a string along with the start and end of the part of it used:
+    spans: tuple[tuple[str, int, int], ...]
+    lengths: tuple[int, ...]
+
+    def __iter__(self) -> Iterator[str]:
+        for text, start, end in self.spans:
+            yield text if end - start == len(text) else text[start:end]
+
+
+class RopeText(Text):
+    """
+    Text whose value may be held as a table of pieces, each a span of an existing
+    string, so that :meth:`splice` can make an edit by sharing the unchanged pieces
+    rather than copying the whole value. The pieces are joined into a single string
+    the first time :attr:`value` is used, including when pattern matching, while
+    :class:`~manipulate.destinations.Files` writes them one by one from :meth:`pieces`.
+    """
+
+    __slots__ = ()
+
+    @property
+    def value(self) -> str:
+        value = _value.__get__(self)
+        if isinstance(value, _Pieces):
+            value = ''.join(value)
+            _value.__set__(self, value)
+        return value  # type: ignore[no-any-return]
+
+    @value.setter
+    def value(self, value: str) -> None:
+        _value.__set__(self, value)
+
+    def _pieces(self) -> _Pieces:
+        value = _value.__get__(self)
+        if isinstance(value, _Pieces):
+            return value
+        if value:
+            return _Pieces(((value, 0, len(value)),), (len(value),))
+        return _Pieces((), ())
+
+    def pieces(self) -> Iterator[str]:
+        """
+        Provide the value as a sequence of strings, without joining them.
+        """
+        return iter(self._pieces())
+
+    def splice(self, start: int, stop: int, text: str = '') -> Self:
+        """
+        Return a copy of this element with the characters of the value from ``start``
+        to ``stop`` replaced by ``text``. The line and column are unchanged.
+        """
+        pieces = self._pieces()
+        spans, lengths = pieces.spans, pieces.lengths
+        ends = list(accumulate(lengths))
+        start, stop, _ = slice(start, stop).indices(ends[-1] if ends else 0)
+        stop = max(start, stop)
+        # the pieces containing the characters either side of the splice:
+        first = bisect_right(ends, start)
+        last = bisect_left(ends, stop)
+        middle = []
+        if first < len(spans):
+            string, span_start, span_end = spans[first]
+            head_end = span_end - (ends[first] - start)
+            if head_end > span_start:
+                middle.append((string, span_start, head_end))
+        if text:
+            middle.append((text, 0, len(text)))
+        if last < len(spans):
+            string, span_start, span_end = spans[last]
+            tail_start = span_end - (ends[last] - stop)
+            if tail_start < span_end:
+                middle.append((string, tail_start, span_end))
+        result = replace(self, value='')
+        _value.__set__(result, _Pieces(
+            spans[:first] + tuple(middle) + spans[last + 1:],
+            lengths[:first] + tuple(end - start for _, start, end in middle) + lengths[last + 1:],
+        ))
+        return result
+
+    def insert(self, offset: int, text: str) -> Self:
+        """
+        Return a copy of this element with ``text`` inserted at ``offset``.
+        """
+        return self.splice(offset, offset, text)
+
+    def delete(self, start: int, stop: int) -> Self:
+        """
+        Return a copy of this element without the characters from ``start`` to ``stop``.
+        """
+        return self.splice(start, stop)
+
+    def _value_repr(self) -> str:
+        value = _value.__get__(self)
+        if not isinstance(value, _Pieces) or sum(value.lengths) <= MAX_TEXT_STR_SIZE:
+            return Text._value_repr(self)
+        head = tail = ''
+        for piece in value:
+            head += piece[:TEXT_STR_ABBREVIATED_SIZE - len(head)]
+            if len(head) == TEXT_STR_ABBREVIATED_SIZE:
+                break
+        for string, start, end in reversed(value.spans):
+            needed = TEXT_STR_ABBREVIATED_SIZE - len(tail)
+            tail = string[max(end - needed, start):end] + tail
+            if len(tail) == TEXT_STR_ABBREVIATED_SIZE:
+                break
+        return repr(head + '...' + tail)
+
+
+@dataclass(slots=True)
+class Block(Element[list[T]]):
+    """
+    A batch of elements of the same ``type`` and with the same parent, stored as
+    columns so that actions can work on whole blocks at a time. The values of the
+    elements are the block's ``value``, with their lines and columns in ``lines``
+    and ``columns``. The elements must have no fields other than those of
+    :class:`Element`, or have defaults for them.
+    """
+
+    type: Type[Element[T]] = Element
+    lines: list[int | None] = field(default_factory=list)
+    columns: list[int | None] = field(default_factory=list)
+
+    @classmethod
+    def of(cls, elements: Sequence[Element[T]]) -> 'Block[T]':
+        """
+        Create a block from a non-empty sequence of elements.
+        """
+        first = elements[0]
+        return cls(
+            [element.value for element in elements],
+            parent=first.parent,
+            type=type(first),
+            lines=[element.line for element in elements],
+            columns=[element.column for element in elements],
+        )
+
+    def elements(self) -> Iterator[Element[T]]:
+        type_ = self.type
+        parent = self.parent
+        for value, line, column in zip(self.value, self.lines, self.columns):
+            yield type_(value, parent, line, column)
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def _value_repr(self) -> str:
+        return f'{len(self.value)} x {self.type.__qualname__}'
+
+
+def advance(text: str, line: int, column: int) -> tuple[int, int]:
+    """
+    Return the line and column that follow the supplied text, if it started
+    at the supplied line and column.
+    """
+    newlines = text.count('\n')
+    if newlines:
+        return line + newlines, len(text) - text.rfind('\n')
+    return line, column + len(text)
@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+from queue import Queue
+from threading import Thread
+from typing import Any, Iterable, Iterator, Sequence
+
+from ._pipeline import has_blocks, chain
+from .actions import Action
+from .destinations import Destination
+from .elements import Element
+
+#: The number of elements passed to a branch at once.
+BATCH_SIZE = 100
+
+_DONE = object()
+_ABORT = object()
+
+
+class Aborted(Exception):
+    """
+    Raised within a branch when the elements being fanned out could not all
+    be provided, so that its destination does not treat them as complete.
+    """
+
+
+@dataclass
+class Branch:
+    """
+    A sequence of actions and the destination for the elements they produce.
+    """
+
+    actions: Sequence[Action]
+    destination: Destination
+
+
+@dataclass
+class FanOut:
+    """
+    A destination that passes each element it receives through the actions of each
+    of its branches and on to that branch's destination, so that several chains of
+    actions can share a single pass over a source.
+
+    Each branch runs in its own thread. No more than around ``max_pending``
+    elements are buffered for each branch, so a slow branch holds up the others
+    rather than elements accumulating in memory. The same elements are passed to
+    every branch, so actions must not modify them.
+    """
+
+    branches: Sequence[Branch]
+    max_pending: int = 10_000
+
+    def handle(self, elements: Iterable[Element[Any]]) -> None:
+        size = max(1, self.max_pending // BATCH_SIZE)
+        queues: list[Queue[Any]] = [Queue(size) for _ in self.branches]
+        errors: list[BaseException] = []
+
+        def run(branch: Branch, queue: Queue[Any]) -> None:
+            finished = False
+
+            def pull() -> Iterator[Element[Any]]:
+                nonlocal finished
+                while True:
+                    batch = queue.get()
+                    if batch is _DONE:
+                        finished = True
+                        return
+                    if batch is _ABORT:
+                        finished = True
+                        raise Aborted()
+                    yield from batch
+
+            try:
+                branch.destination.handle(
+                    chain(pull(), branch.actions, keep_blocks=has_blocks(branch.destination))
+                )
+            except Aborted:
+                pass
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                # keep taking elements so that a branch that stopped early
+                # can't block the others:
+                while not finished:
+                    finished = queue.get() in (_DONE, _ABORT)
+
+        threads = [
+            Thread(target=run, args=(branch, queue), daemon=True)
+            for branch, queue in zip(self.branches, queues)
+        ]
+        for thread in threads:
+            thread.start()
+        end = _ABORT
+        try:
+            batch: list[Element[Any]] = []
+            for element in elements:
+                batch.append(element)
+                if len(batch) == BATCH_SIZE:
+                    if errors:
+                        break
+                    for queue in queues:
+                        queue.put(batch)
+                    batch = []
+            else:
+                if batch:
+                    for queue in queues:
+                        queue.put(batch)
+                end = _DONE
+        finally:
+            for queue in queues:
+                queue.put(end)
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,114 @@
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Sequence, Any, IO, Iterable, Iterator
+
+from .actions import Action
+from .cache import fingerprint
+from .elements import Element, Start, End, File
+
+
+@dataclass
+class Journal:
+    """
+    A record, appended to the file at ``path``, of the files a run of
+    :func:`~manipulate.manipulate` has completed, so that a run which fails or
+    is killed can be resumed by skipping them.
+
+    The journal is tied to the fingerprint of the ``actions``, and its entries are
+    discarded if the actions have changed. Each entry is flushed as it is recorded
+    and the file is synced to disk at most every ``sync_interval`` seconds and when
+    the journal is closed.
+    """
+
+    path: Path
+    actions: Sequence[Action] = field(repr=False)
+    sync_interval: float = 1.0
+    fingerprint: str = field(init=False, repr=False, compare=False)
+    completed: set[str] = field(init=False, repr=False, compare=False)
+    _stream: IO[str] | None = field(init=False, default=None, repr=False, compare=False)
+    _synced: float = field(init=False, default=0, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.fingerprint = fingerprint(self.actions)
+        self.completed = set()
+        try:
+            lines = self.path.read_text().splitlines()
+        except FileNotFoundError:
+            return
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return
+        if header.get('fingerprint') != self.fingerprint:
+            return
+        for line in lines[1:]:
+            try:
+                self.completed.add(json.loads(line))
+            except ValueError:
+                # the last entry may be partial if the run was killed while writing it:
+                break
+
+    def pending(self, path: Path) -> bool:
+        """
+        Return ``True`` if the file at the supplied path has not been completed.
+        """
+        return str(path) not in self.completed
+
+    def _open(self) -> IO[str]:
+        # rewrite any existing entries so that a partial last entry is dropped:
+        temp = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+        lines = [json.dumps({'fingerprint': self.fingerprint})]
+        lines.extend(json.dumps(path) for path in sorted(self.completed))
+        temp.write_text(''.join(line + '\n' for line in lines))
+        os.replace(temp, self.path)
+        self._synced = time.monotonic()
+        return self.path.open('a')
+
+    def record(self, path: Path) -> None:
+        """
+        Record the file at the supplied path as completed.
+        """
+        stream = self._stream
+        if stream is None:
+            stream = self._stream = self._open()
+        self.completed.add(str(path))
+        stream.write(json.dumps(str(path)) + '\n')
+        stream.flush()
+        now = time.monotonic()
+        if now - self._synced >= self.sync_interval:
+            os.fsync(stream.fileno())
+            self._synced = now
+
+    def track(self, elements: Iterable[Element[Any]]) -> Iterator[Element[Any]]:
+        """
+        Pass on the elements, recording each top-level file once the element
+        after its :class:`~manipulate.elements.End` has been asked for.
+        """
+        depth = 0
+        for element in elements:
+            yield element
+            match element:
+                case Start(File()):
+                    depth += 1
+                case End(File(path)):
+                    depth -= 1
+                    if not depth:
+                        self.record(path)
+
+    def close(self) -> None:
+        if self._stream is not None:
+            self._stream.flush()
+            os.fsync(self._stream.fileno())
+            self._stream.close()
+            self._stream = None
+
+    def remove(self) -> None:
+        """
+        Close the journal and remove its file, once a run has completed.
+        """
+        self.close()
+        self.path.unlink(missing_ok=True)
+        self.completed = set()
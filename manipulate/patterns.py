@@ -0,0 +1,114 @@
+import re
+from dataclasses import dataclass
+from typing import Iterable
+
+
+def translate(glob: str) -> str:
+    """
+    Translate a ``.gitignore``-style glob into a regular expression
+    matching ``/``-separated relative paths.
+    """
+    parts = []
+    i = 0
+    n = len(glob)
+    while i < n:
+        if glob.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif glob.startswith('/**', i) and i + 3 == n:
+            parts.append('/.*')
+            i += 3
+        elif glob.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif glob[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif glob[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif glob[i] == '[' and (end := glob.find(']', i + 2)) != -1:
+            content = glob[i + 1:end]
+            if content[0] in '!^':
+                content = '^' + content[1:]
+            parts.append('[' + content.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif glob[i] == '\\' and i + 1 < n:
+            parts.append(re.escape(glob[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(glob[i]))
+            i += 1
+    return ''.join(parts)
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    A single ``.gitignore``-style pattern, relative to the directory at ``base``,
+    which is itself a ``/``-separated path relative to the root being walked.
+    """
+
+    pattern: re.Pattern[str]
+    negate: bool = False
+    directory_only: bool = False
+    base: str = ''
+
+    @classmethod
+    def parse(cls, line: str, base: str = '') -> 'Rule | None':
+        """
+        Parse a line from a ``.gitignore`` file, returning ``None`` if it is
+        blank or a comment.
+        """
+        line = line.rstrip('\n')
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        if not line or line.startswith('#'):
+            return None
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        elif line.startswith('\\'):
+            line = line[1:]
+        directory_only = line.endswith('/')
+        line = line.rstrip('/')
+        if '/' in line:
+            regex = translate(line.lstrip('/'))
+        else:
+            regex = '(?:.*/)?' + translate(line)
+        return cls(re.compile(regex + '$'), negate, directory_only, base)
+
+    def matches(self, path: str, directory: bool = False) -> bool:
+        if self.directory_only and not directory:
+            return False
+        if self.base:
+            if not path.startswith(self.base + '/'):
+                return False
+            path = path[len(self.base) + 1:]
+        return self.pattern.match(path) is not None
+
+
+def parse(lines: Iterable[str], base: str = '') -> tuple[Rule, ...]:
+    """
+    Parse ``.gitignore``-style lines into a tuple of rules.
+    """
+    return tuple(rule for line in lines if (rule := Rule.parse(line, base)) is not None)
+
+
+def matched(rules: Iterable[Rule], path: str, directory: bool = False) -> bool | None:
+    """
+    Return ``True`` if the last of the rules to match the path is not negated,
+    ``False`` if it is, or ``None`` if none of the rules match the path.
+    """
+    result = None
+    for rule in rules:
+        if rule.matches(path, directory):
+            result = not rule.negate
+    return result
+
+
+def ignored(rules: Iterable[Rule], path: str, directory: bool = False) -> bool:
+    """
+    Return ``True`` if the last of the rules to match the path is not negated.
+    """
+    return matched(rules, path, directory) is True
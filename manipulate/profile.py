@@ -0,0 +1,155 @@
+import heapq
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, ClassVar, Iterable, Iterator
+
+from ._pipeline import Tracker
+from .actions import Action
+from .elements import Element, Start, End, File
+
+
+@dataclass
+class ActionProfile:
+    action: Action
+    #: Wall time spent inside the action, excluding time spent in upstream actions
+    #: and the source.
+    seconds: float
+    elements_in: int
+    elements_out: int
+
+
+@dataclass
+class FileProfile:
+    path: Path
+    seconds: float
+
+
+@dataclass
+class Report:
+    #: Wall time spent inside the source.
+    source_seconds: float
+    actions: list[ActionProfile]
+    #: The slowest files, slowest first.
+    files: list[FileProfile]
+
+    def __str__(self) -> str:
+        lines = [f'{"seconds":>10} {"in":>10} {"out":>10}  action']
+        lines.append(f'{self.source_seconds:10.3f} {"":>10} {"":>10}  (source)')
+        for profile in self.actions:
+            lines.append(
+                f'{profile.seconds:10.3f} {profile.elements_in:10} '
+                f'{profile.elements_out:10}  {profile.action}'
+            )
+        if self.files:
+            lines.append('')
+            lines.append(f'{"seconds":>10}  file')
+            for file in self.files:
+                lines.append(f'{file.seconds:10.3f}  {file.path}')
+        return '\n'.join(lines)
+
+
+@dataclass
+class _Timing:
+    action: Action | None
+    #: Wall time spent pulling elements from upstream, inclusive of everything upstream.
+    seconds: float = 0
+    count: int = 0
+
+
+@dataclass
+class Profile(Tracker):
+    """
+    A :class:`~manipulate.Tracker` that also records the time spent in each action,
+    the number of elements entering and leaving each action and the slowest files.
+
+    Once the elements have all been handled, the :class:`Report` is available
+    as :attr:`report` and is passed to the ``callback``, if supplied.
+
+    :class:`~manipulate.actions.Transform` actions are not fused when profiling,
+    so that each is reported on its own.
+    """
+
+    callback: Callable[[Report], None] | None = None
+    #: The number of slowest files to report.
+    slowest: int = 10
+    report: Report | None = field(init=False, default=None)
+    _timings: list[_Timing] = field(init=False, default_factory=list, repr=False)
+    fuse: ClassVar[bool] = False
+
+    def __post_init__(self) -> None:
+        super().__init__()
+
+    def _timed(self, timing: _Timing, elements: Iterable[Element[Any]]) -> Iterator[Element[Any]]:
+        iterator = iter(elements)
+        clock = perf_counter
+        action = timing.action
+        while True:
+            start = clock()
+            try:
+                element = next(iterator)
+            except StopIteration:
+                timing.seconds += clock() - start
+                return
+            timing.seconds += clock() - start
+            timing.count += 1
+            if action is not None:
+                self.current_action = action
+                self.current_element = element
+            yield element
+
+    def before(self, action: Action, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        timing = _Timing(action)
+        self._timings.append(timing)
+        return self._timed(timing, elements)
+
+    def after(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        timing = _Timing(None)
+        slowest: list[tuple[float, Path]] = []
+        current: Path | None = None
+        current_seconds = 0.0
+        clock = perf_counter
+        try:
+            last = clock()
+            for element in super().after(self._timed(timing, elements)):
+                now = clock()
+                match element:
+                    case Start(File(path)):
+                        current = path
+                        current_seconds = now - last
+                    case End(File(_)) if current is not None:
+                        current_seconds += now - last
+                        entry = (current_seconds, current)
+                        if len(slowest) < self.slowest:
+                            heapq.heappush(slowest, entry)
+                        else:
+                            heapq.heappushpop(slowest, entry)
+                        current = None
+                    case _ if current is not None:
+                        current_seconds += now - last
+                last = now
+                yield element
+        finally:
+            self._report(timing, slowest)
+
+    def _report(self, final: _Timing, slowest: list[tuple[float, Path]]) -> None:
+        timings = [*self._timings, final]
+        self._timings = []
+        actions = []
+        for upstream, downstream in zip(timings, timings[1:]):
+            assert upstream.action is not None
+            actions.append(
+                ActionProfile(
+                    action=upstream.action,
+                    seconds=downstream.seconds - upstream.seconds,
+                    elements_in=upstream.count,
+                    elements_out=downstream.count,
+                )
+            )
+        self.report = Report(
+            source_seconds=timings[0].seconds,
+            actions=actions,
+            files=[FileProfile(path, seconds) for seconds, path in sorted(slowest, reverse=True)],
+        )
+        if self.callback is not None:
+            self.callback(self.report)
@@ -1,23 +1,366 @@
-from dataclasses import dataclass
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import islice
+from mmap import mmap, ACCESS_READ
 from pathlib import Path
-from typing import Protocol, Iterable, Any, IO
+from queue import SimpleQueue
+from threading import Event, Lock
+from typing import (
+    Protocol, Iterable, Any, IO, Iterator, AsyncIterable, AsyncIterator, Sequence, Callable
+)
 
-from .elements import Element, Start, File, Text, End
+from .cache import Cache
+from .checkpoint import Reader
+from .patterns import Rule, parse, ignored, matched
+from .elements import Element, Start, File, Text, End, Bytes, Block, advance
 
 
 class Source(Protocol):
     def elements(self) -> Iterable[Element[Any]]: ...
 
 
+class AsyncSource(Protocol):
+    def elements(self) -> AsyncIterable[Element[Any]]: ...
+
+
+@dataclass
+class Tree:
+    """
+    The paths of files found by walking the directories at the supplied roots
+    concurrently, with ``workers`` threads. Paths are provided while the walk is
+    still in progress and so are not in any particular order. A :class:`Tree`
+    can be passed as the paths of :class:`Files`.
+
+    ``include`` and ``exclude`` are ``.gitignore``-style patterns matched against
+    paths relative to each root. If ``include`` is supplied, only files matching
+    one of its patterns, or within a directory that does, are provided. Directories
+    and files matching ``exclude``, or the rules in any ``ignore_file`` found while
+    walking, are skipped. Roots that are files are matched against these patterns
+    by name. ``exclude`` defaults to ``.git/``, so that pattern needs to be
+    supplied along with any others if ``.git`` directories are still to be skipped.
+    """
+
+    roots: Sequence[Path]
+    include: Sequence[str] = ()
+    exclude: Sequence[str] = ('.git/',)
+    ignore_file: str | None = '.gitignore'
+    workers: int = 8
+
+    def _rules(self, directory: Path, relative: str) -> tuple[Rule, ...]:
+        if self.ignore_file is None:
+            return ()
+        try:
+            with open(directory / self.ignore_file) as stream:
+                return parse(stream, relative)
+        except FileNotFoundError:
+            return ()
+
+    def __iter__(self) -> Iterator[Path]:
+        include = parse(self.include)
+        results: SimpleQueue[Path | BaseException | None] = SimpleQueue()
+        lock = Lock()
+        stopped = Event()
+        pending = 0
+
+        def submit(
+            directory: Path, relative: str, rules: tuple[Rule, ...], included: bool
+        ) -> None:
+            nonlocal pending
+            with lock:
+                pending += 1
+            executor.submit(scan, directory, relative, rules, included)
+
+        def scan(
+            directory: Path, relative: str, rules: tuple[Rule, ...], included: bool
+        ) -> None:
+            nonlocal pending
+            try:
+                if stopped.is_set():
+                    return
+                rules += self._rules(directory, relative)
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        path = f'{relative}/{entry.name}' if relative else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if not ignored(rules, path, directory=True):
+                                # files within a directory are included if it is,
+                                # unless a pattern matching them says otherwise:
+                                match = matched(include, path, directory=True)
+                                inherited = included if match is None else match
+                                submit(Path(entry.path), path, rules, inherited)
+                        elif entry.is_file() and not ignored(rules, path):
+                            match = matched(include, path)
+                            if match or (match is None and included):
+                                results.put(Path(entry.path))
+            except BaseException as e:
+                results.put(e)
+            finally:
+                with lock:
+                    pending -= 1
+                    finished = not pending
+                if finished:
+                    results.put(None)
+
+        exclude = parse(self.exclude)
+        executor = ThreadPoolExecutor(self.workers)
+        try:
+            directories = []
+            for root in self.roots:
+                if root.is_dir():
+                    directories.append(root)
+                elif not ignored(exclude, root.name) and (
+                    not include or ignored(include, root.name)
+                ):
+                    yield root
+            if not directories:
+                return
+            # count all the roots up front so the walk can't appear finished early:
+            pending = len(directories)
+            for root in directories:
+                executor.submit(scan, root, '', exclude, not include)
+            while (result := results.get()) is not None:
+                if isinstance(result, BaseException):
+                    raise result
+                yield result
+        finally:
+            stopped.set()
+            executor.shutdown(cancel_futures=True)
+
+
 @dataclass
 class Files:
+    """
+    The contents of the files at the supplied paths.
+
+    If ``chunk_size`` is specified, each file is streamed as a sequence of
+    :class:`~manipulate.elements.Text` elements, each containing no more than
+    that many characters. Chunks are split on line boundaries unless a single
+    line is longer than ``chunk_size``. Empty files produce no chunks.
+
+    If a :class:`~manipulate.cache.Cache` is supplied, files it records as
+    unchanged are skipped.
+
+    If ``prefetch`` is specified, up to that many files are read ahead in worker
+    threads while earlier files are being processed. If ``prefetch_bytes`` is also
+    specified, files are only read ahead while the total size of those not yet
+    provided is below it, so at least one file is always read ahead.
+
+    If ``block_size`` is specified along with ``chunk_size``, the chunks of each
+    file are provided in :class:`~manipulate.elements.Block` elements of up to
+    that many chunks.
+
+    If a ``predicate`` is supplied, only the files whose paths it returns ``True``
+    for are read.
+    """
+
+    paths: Iterable[Path]
+    chunk_size: int | None = None
+    cache: Cache | None = None
+    prefetch: int = 0
+    prefetch_bytes: int | None = None
+    block_size: int | None = None
+    predicate: Callable[[Path], bool] | None = None
+
+    def __post_init__(self) -> None:
+        if self.chunk_size is not None and self.chunk_size < 1:
+            raise ValueError(f'chunk_size must be positive, not {self.chunk_size}')
+        if self.prefetch < 0:
+            raise ValueError(f'prefetch must not be negative, not {self.prefetch}')
+        if self.prefetch and self.chunk_size is not None:
+            raise ValueError('prefetch cannot be used with chunk_size')
+        if self.prefetch_bytes is not None and not self.prefetch:
+            raise ValueError('prefetch_bytes can only be used with prefetch')
+        if self.block_size is not None:
+            if self.chunk_size is None:
+                raise ValueError('block_size can only be used with chunk_size')
+            if self.block_size < 1:
+                raise ValueError(f'block_size must be positive, not {self.block_size}')
+
+    @property
+    def blocks(self) -> bool:
+        return self.block_size is not None
+
+    def _chunks(self, path: Path, file: File) -> Iterator[Text]:
+        assert self.chunk_size is not None
+        line = column = 1
+        pending: list[str] = []
+        size = 0
+        with path.open() as stream:
+            while text := stream.readline(self.chunk_size):
+                if pending and size + len(text) > self.chunk_size:
+                    chunk = ''.join(pending)
+                    yield Text(chunk, parent=file, line=line, column=column)
+                    line, column = advance(chunk, line, column)
+                    pending = []
+                    size = 0
+                pending.append(text)
+                size += len(text)
+        if pending:
+            yield Text(''.join(pending), parent=file, line=line, column=column)
+
+    def where(self, predicate: Callable[[Path], bool]) -> 'Files':
+        """
+        Return a copy of this source that only reads the files whose paths
+        both the supplied predicate and any existing one return ``True`` for.
+        """
+        existing = self.predicate
+        if existing is None:
+            return replace(self, predicate=predicate)
+
+        def combined(path: Path) -> bool:
+            return existing(path) and predicate(path)
+
+        return replace(self, predicate=combined)
+
+    def _paths(self) -> Iterator[Path]:
+        for path in self.paths:
+            if self.predicate is not None and not self.predicate(path):
+                continue
+            if self.cache is None or not self.cache.unchanged(path):
+                yield path
+
+    def _prefetched(self, paths: Iterator[Path]) -> Iterator[tuple[Path, str]]:
+        reads: deque[tuple[Path, int, Future[str]]] = deque()
+        budget = self.prefetch_bytes
+        size = 0
+
+        def schedule() -> None:
+            nonlocal size
+            while len(reads) < self.prefetch and (budget is None or size < budget or not reads):
+                path = next(paths, None)
+                if path is None:
+                    return
+                try:
+                    path_size = path.stat().st_size
+                except OSError:
+                    # left for the read to report
+                    path_size = 0
+                reads.append((path, path_size, executor.submit(path.read_text)))
+                size += path_size
+
+        executor = ThreadPoolExecutor(self.prefetch)
+        try:
+            schedule()
+            while reads:
+                path, path_size, read = reads.popleft()
+                text = read.result()
+                size -= path_size
+                schedule()
+                yield path, text
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def elements(self) -> Iterable[Start[File] | Text | Block[str] | End[File]]:
+        if self.prefetch:
+            for path, text in self._prefetched(self._paths()):
+                file = File(path)
+                yield Start(file)
+                yield Text(text, parent=file, line=1, column=1)
+                yield End(file)
+            return
+        for path in self._paths():
+            file = File(path)
+            yield Start(file)
+            if self.chunk_size is None:
+                yield Text(path.read_text(), parent=file, line=1, column=1)
+            elif self.block_size is None:
+                yield from self._chunks(path, file)
+            else:
+                chunks = self._chunks(path, file)
+                while chunk_block := list(islice(chunks, self.block_size)):
+                    yield Block.of(chunk_block)
+            yield End(file)
+
+    def __str__(self) -> str:
+        return type(self).__qualname__
+
+
+@dataclass
+class AsyncFiles:
+    """
+    The contents of the files at the supplied paths, read in worker threads
+    with up to ``concurrency`` files being read ahead at once.
+    """
+
     paths: list[Path]
+    concurrency: int = 8
+
+    def __post_init__(self) -> None:
+        if self.concurrency < 1:
+            raise ValueError(f'concurrency must be at least 1, not {self.concurrency}')
+
+    async def elements(self) -> AsyncIterator[Start[File] | Text | End[File]]:
+        reads: deque[tuple[Path, asyncio.Task[str]]] = deque()
+        paths = iter(self.paths)
+
+        def schedule() -> None:
+            for path in islice(paths, self.concurrency - len(reads)):
+                reads.append((path, asyncio.ensure_future(asyncio.to_thread(path.read_text))))
+
+        try:
+            schedule()
+            while reads:
+                path, read = reads.popleft()
+                text = await read
+                schedule()
+                file = File(path)
+                yield Start(file)
+                yield Text(text, parent=file, line=1, column=1)
+                yield End(file)
+        finally:
+            for _, read in reads:
+                read.cancel()
+
+    def __str__(self) -> str:
+        return type(self).__qualname__
+
 
-    def elements(self) -> Iterable[Start[File] | Text | End[File]]:
+@dataclass
+class MappedFiles:
+    """
+    The contents of the files at the supplied paths, memory mapped and provided
+    as :class:`~manipulate.elements.Bytes` elements whose values are
+    :class:`memoryview` slices of the mapping rather than copies.
+
+    If ``chunk_size`` is specified, each file is provided as a sequence of
+    slices of no more than that many bytes. Empty files produce no slices.
+    """
+
+    paths: list[Path]
+    chunk_size: int | None = None
+
+    def __post_init__(self) -> None:
+        if self.chunk_size is not None and self.chunk_size < 1:
+            raise ValueError(f'chunk_size must be positive, not {self.chunk_size}')
+
+    def _slices(self, path: Path, file: File) -> Iterator[Bytes]:
+        with path.open('rb') as stream:
+            size = os.fstat(stream.fileno()).st_size
+            if not size:
+                return
+            mapping = mmap(stream.fileno(), 0, access=ACCESS_READ)
+        view = memoryview(mapping)
+        chunk_size = self.chunk_size or size
+        try:
+            for offset in range(0, size, chunk_size):
+                yield Bytes(view[offset:offset + chunk_size], parent=file)
+        finally:
+            view.release()
+            try:
+                mapping.close()
+            except BufferError:
+                # Slices are still referenced downstream, so the mapping
+                # will be closed when the last of them is released.
+                pass
+
+    def elements(self) -> Iterable[Start[File] | Bytes | End[File]]:
         for path in self.paths:
             file = File(path)
             yield Start(file)
-            yield Text(path.read_text(), parent=file, line=1, column=1)
+            yield from self._slices(path, file)
             yield End(file)
 
     def __str__(self) -> str:
@@ -35,6 +378,23 @@ class Stream:
         return type(self).__qualname__
 
 
+@dataclass
+class Checkpoint:
+    """
+    The elements recorded in the checkpoint file at ``path`` by a
+    :class:`~manipulate.destinations.Checkpoint`.
+    """
+
+    path: Path
+
+    def elements(self) -> Iterator[Element[Any]]:
+        with self.path.open('rb') as stream:
+            yield from Reader(stream)
+
+    def __str__(self) -> str:
+        return type(self).__qualname__
+
+
 class Memory:
     def __init__(self, *elements: Element[Any]) -> None:
         self._elements = elements
@@ -0,0 +1,25 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Any
+
+from manipulate.elements import Element, Text, Start, End, File
+
+
+@dataclass
+class Upper:
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            match element:
+                case Text(value, parent, line, column):
+                    yield Text(value.upper(), parent, line, column)
+                case _:
+                    yield element
+
+
+def files(*names: str) -> list[Element[Any]]:
+    elements: list[Element[Any]] = []
+    for name in names:
+        file = File(Path(name))
+        elements.extend((Start(file), Text(name, parent=file), End(file)))
+    return elements
@@ -1,10 +1,14 @@
+import re
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Iterable, Any
 
 from testfixtures import compare, generator, ShouldRaise
 
-from manipulate.actions import Classify
-from manipulate.elements import Text, Start, Element, End, File
+from manipulate.actions import (
+    Classify, Container, Transform, Fused, fuse, Batch, unbatch, Replace, Shebang, Magic, Select
+)
+from manipulate.elements import Text, Start, Element, End, File, Block, RopeText, advance
 
 
 def should_raise_on_iter(elements: Iterable[Element[Any]], expected: Exception) -> None:
@@ -79,3 +83,509 @@ class TestClassify:
     def test_pass_through_others(self) -> None:
         classify = Classify({})
         compare(classify([Element(1)]), expected=generator(Element(1)))
+
+
+class ShellText(Text):
+    __slots__ = ()
+
+
+class XMLText(Text):
+    __slots__ = ()
+
+
+def classified(classify: Classify, path: Path) -> type[Element[Any]]:
+    file = File(path)
+    return type(list(classify([Start(file), Text('x', parent=file), End(file)]))[1])
+
+
+class TestClassifyContent:
+
+    def test_extension_first(self, tmp_path: Path) -> None:
+        path = tmp_path / 'script.bar'
+        path.write_text('#!/bin/sh\n')
+        classify = Classify({'.bar': SampleText}, rules=[Shebang({'sh': ShellText})])
+        compare(classified(classify, path), expected=SampleText)
+
+    def test_shebang(self, tmp_path: Path) -> None:
+        path = tmp_path / 'script'
+        path.write_text('#!/bin/sh\necho hi\n')
+        classify = Classify(rules=[Shebang({'sh': ShellText})])
+        compare(classified(classify, path), expected=ShellText)
+
+    def test_shebang_env(self, tmp_path: Path) -> None:
+        path = tmp_path / 'script'
+        path.write_text('#!/usr/bin/env -S python3.12 -u\n')
+        classify = Classify(rules=[Shebang({'python': SampleText})])
+        compare(classified(classify, path), expected=SampleText)
+
+    def test_shebang_exact_name_first(self) -> None:
+        rule = Shebang({'python': SampleText, 'python2': ShellText})
+        compare(rule(Path('x'), b'#!/usr/bin/python2\n'), expected=ShellText)
+
+    def test_shebang_no_match(self) -> None:
+        rule = Shebang({'sh': ShellText})
+        compare(rule(Path('x'), b'#!/bin/bash'), expected=None)
+        compare(rule(Path('x'), b'#!'), expected=None)
+        compare(rule(Path('x'), b'#!/usr/bin/env'), expected=None)
+        compare(rule(Path('x'), b'sh'), expected=None)
+
+    def test_magic(self, tmp_path: Path) -> None:
+        path = tmp_path / 'generated'
+        path.write_text('<?xml version="1.0"?>\n<root/>')
+        classify = Classify(rules=[Shebang({'sh': ShellText}), Magic({b'<?xml': XMLText})])
+        compare(classified(classify, path), expected=XMLText)
+
+    def test_head_size(self, tmp_path: Path) -> None:
+        path = tmp_path / 'generated'
+        path.write_text('<?xml')
+        heads = []
+
+        def rule(path: Path, head: bytes) -> type[Text] | None:
+            heads.append(head)
+            return XMLText
+
+        classified(Classify(rules=[rule], head_size=2), path)
+        compare(heads, expected=[b'<?'])
+
+    def test_default(self, tmp_path: Path) -> None:
+        path = tmp_path / 'unknown'
+        path.write_text('stuff')
+        classify = Classify(rules=[Magic({b'<?xml': XMLText})], default=SampleText)
+        compare(classified(classify, path), expected=SampleText)
+
+    def test_default_without_rules(self) -> None:
+        classify = Classify({'.bar': ShellText}, default=SampleText)
+        compare(classified(classify, Path('foo.baz')), expected=SampleText)
+
+    def test_unable(self, tmp_path: Path) -> None:
+        path = tmp_path / 'unknown'
+        path.write_text('stuff')
+        classify = Classify(rules=[Magic({b'<?xml': XMLText})])
+        should_raise_on_iter(
+            classify([Start(File(path))]), ValueError(f'Unable to classify {path}')
+        )
+
+    def test_missing_file(self, tmp_path: Path) -> None:
+        classify = Classify(rules=[Magic({b'': XMLText})], default=SampleText)
+        compare(classified(classify, tmp_path / 'missing'), expected=SampleText)
+
+    def test_memoised(self, tmp_path: Path) -> None:
+        path = tmp_path / 'script'
+        path.write_text('#!/bin/sh\n')
+        calls = []
+
+        def rule(path: Path, head: bytes) -> type[Text] | None:
+            calls.append(path)
+            return ShellText
+
+        classify = Classify(rules=[rule])
+        compare(classified(classify, path), expected=ShellText)
+        compare(classified(classify, path), expected=ShellText)
+        compare(calls, expected=[path])
+
+    def test_memo_invalidated_by_change(self, tmp_path: Path) -> None:
+        path = tmp_path / 'script'
+        path.write_text('#!/bin/sh\n')
+        classify = Classify(rules=[Shebang({'sh': ShellText}), Magic({b'<?xml': XMLText})])
+        compare(classified(classify, path), expected=ShellText)
+        path.write_text('<?xml version="1.0"?>')
+        compare(classified(classify, path), expected=XMLText)
+
+    def test_repr(self) -> None:
+        compare(
+            repr(Classify({'.sh': ShellText}, rules=[Magic({b'<?xml': XMLText})])),
+            expected=(
+                "Classify(extensions={'.sh': <class 'tests.test_actions.ShellText'>}, "
+                "rules=[Magic(prefixes={b'<?xml': <class 'tests.test_actions.XMLText'>})], "
+                "default=None, head_size=4096)"
+            ),
+        )
+
+
+@dataclass
+class Add(Transform):
+    amount: int
+
+    def transform(self, element: Element[Any]) -> Element[Any] | None:
+        return Element(element.value + self.amount)
+
+
+@dataclass
+class DropOdd(Transform):
+
+    def transform(self, element: Element[Any]) -> Element[Any] | None:
+        return None if element.value % 2 else element
+
+
+def passthrough(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+    return elements
+
+
+class TestTransform:
+
+    def test_transform(self) -> None:
+        compare(Add(1)([Element(1), Element(2)]), expected=generator(Element(2), Element(3)))
+
+    def test_filter(self) -> None:
+        compare(DropOdd()([Element(1), Element(2)]), expected=generator(Element(2)))
+
+    def test_not_implemented(self) -> None:
+        with ShouldRaise(NotImplementedError):
+            next(iter(Transform()([Element(1)])))
+
+
+class TestFused:
+
+    def test_single_pass(self) -> None:
+        fused = Fused([Add(1), DropOdd(), Add(10)])
+        compare(
+            fused([Element(1), Element(2), Element(3)]),
+            expected=generator(Element(12), Element(14)),
+        )
+        compare(fused.failure, expected=None)
+
+    def test_stateful(self) -> None:
+        f1 = File(Path('a'))
+        f2 = File(Path('b'))
+        fused = Fused([Container(File), Container(File)])
+        with ShouldRaise(ValueError("attempt to open b before a was closed")):
+            list(fused([Start(f1), Start(f2)]))
+        compare(fused.failure, expected=(Container(File), Start(f2)))
+
+    def test_failure(self) -> None:
+        add = Add(1)
+        fused = Fused([add, DropOdd(), Add(1), add])
+        elements = iter(fused([Element(1), Element('x')]))
+        compare(next(elements), expected=Element(4))
+        with ShouldRaise(TypeError):
+            next(elements)
+        compare(fused.failure, expected=(add, Element('x')))
+
+    def test_failure_upstream(self) -> None:
+        def upstream() -> Iterable[Element[Any]]:
+            yield Element(1)
+            raise Exception('boom!')
+
+        fused = Fused([Add(1), Add(1)])
+        elements = iter(fused(upstream()))
+        next(elements)
+        with ShouldRaise(Exception('boom!')):
+            next(elements)
+        compare(fused.failure, expected=None)
+
+
+class TestFuse:
+
+    def test_empty(self) -> None:
+        compare(fuse([]), expected=[])
+
+    def test_single_transform_left_alone(self) -> None:
+        add = Add(1)
+        compare(fuse([passthrough, add, passthrough]), expected=[passthrough, add, passthrough])
+
+    def test_runs(self) -> None:
+        compare(
+            fuse([Add(1), Add(2), passthrough, Container(File), Classify({}), DropOdd()]),
+            expected=[
+                Fused([Add(1), Add(2)]),
+                passthrough,
+                Fused([Container(File), Classify({}), DropOdd()]),
+            ],
+        )
+
+
+class TestBatch:
+
+    def test_file(self) -> None:
+        file = File(Path('x'))
+        texts = [Text(str(i), parent=file, line=i, column=1) for i in range(5)]
+        compare(
+            Batch(2)([Start(file), *texts, End(file)]),
+            expected=generator(
+                Start(file),
+                Block.of(texts[:2]),
+                Block.of(texts[2:4]),
+                Block.of(texts[4:]),
+                End(file),
+            ),
+        )
+
+    def test_type_change(self) -> None:
+        compare(
+            Batch()([Text('a'), Text('b'), SampleText('c'), Element(1)]),
+            expected=generator(
+                Block.of([Text('a'), Text('b')]),
+                Block.of([SampleText('c')]),
+                Block.of([Element(1)]),
+            ),
+        )
+
+    def test_parent_change(self) -> None:
+        parent1 = Element(1)
+        parent2 = Element(2)
+        compare(
+            Batch()([Text('a', parent1), Text('b', parent2)]),
+            expected=generator(Block.of([Text('a', parent1)]), Block.of([Text('b', parent2)])),
+        )
+
+    def test_prefix_not_batched(self) -> None:
+        compare(
+            Batch()([Text('a'), Text('b', prefix='#'), Text('c')]),
+            expected=generator(
+                Block.of([Text('a')]), Text('b', prefix='#'), Block.of([Text('c')])
+            ),
+        )
+
+    def test_rope_text_not_batched(self) -> None:
+        rope = RopeText('b').insert(1, 'c')
+        compare(
+            Batch()([Text('a'), rope, Text('d')]),
+            expected=generator(Block.of([Text('a')]), RopeText('bc'), Block.of([Text('d')])),
+        )
+
+    def test_existing_blocks(self) -> None:
+        block = Block.of([Text('a')])
+        compare(
+            Batch()([block, Text('b')]),
+            expected=generator(block, Block.of([Text('b')])),
+        )
+
+
+class TestSelect:
+
+    def test_drops_files(self) -> None:
+        kept = File(Path('kept.py'))
+        dropped = File(Path('dropped.txt'))
+        select = Select(lambda path: path.suffix == '.py')
+        compare(
+            select([
+                Text('outside'),
+                Start(dropped), Text('a', parent=dropped), End(dropped),
+                Start(kept), Text('b', parent=kept), End(kept),
+            ]),
+            expected=generator(
+                Text('outside'), Start(kept), Text('b', parent=kept), End(kept),
+            ),
+        )
+
+    def test_nested_files_dropped(self) -> None:
+        outer = File(Path('outer.zip'))
+        inner = File(Path('inner.py'))
+        after = File(Path('after.py'))
+        select = Select(lambda path: path.suffix == '.py')
+        compare(
+            select([
+                Start(outer), Start(inner), Text('a', parent=inner), End(inner), End(outer),
+                Start(after), End(after),
+            ]),
+            expected=generator(Start(after), End(after)),
+        )
+
+    def test_path_predicate(self) -> None:
+        def predicate(path: Path) -> bool:
+            return True
+
+        compare(Select(predicate).path_predicate, expected=predicate)
+
+
+class TestUnbatch:
+
+    def test_it(self) -> None:
+        file = File(Path('x'))
+        texts = [Text('a', file, 1, 1), Text('b', file, 1, 2)]
+        compare(
+            unbatch([Start(file), Block.of(texts), End(file)]),
+            expected=generator(Start(file), *texts, End(file)),
+        )
+
+    def test_round_trip(self) -> None:
+        elements: list[Element[Any]] = [
+            Text('a'), Element(1), Start(1), Text('b', prefix='#'), Text('c'), End(1)
+        ]
+        compare(list(unbatch(Batch(2)(elements))), expected=elements)
+
+
+def chunks(text: str, size: int, parent: Element[Any] | None = None) -> list[Text]:
+    texts = []
+    line = column = 1
+    for start in range(0, len(text), size):
+        chunk = text[start:start + size]
+        texts.append(Text(chunk, parent=parent, line=line, column=column))
+        line, column = advance(chunk, line, column)
+    return texts
+
+
+class TestReplace:
+
+    def test_literal(self) -> None:
+        compare(
+            Replace({'foo': 'bar'})([Text('a foo b foo', line=1, column=1)]),
+            expected=generator(Text('a bar b bar', line=1, column=1)),
+        )
+
+    def test_multiple(self) -> None:
+        compare(
+            Replace({'a': 'b', 'b': 'a', 'c': ''})([Text('abcab')]),
+            expected=generator(Text('baba')),
+        )
+
+    def test_longest_literal_wins(self) -> None:
+        compare(
+            Replace({'ab': '1', 'abc': '2'})([Text('abcab')]),
+            expected=generator(Text('21')),
+        )
+
+    def test_literal_before_pattern(self) -> None:
+        compare(
+            Replace({re.compile('a.'): '1', re.compile('ab'): '2', 'a': '3'}, 2)([Text('abac')]),
+            expected=generator(Text('3b3c')),
+        )
+
+    def test_earliest_pattern_wins(self) -> None:
+        compare(
+            Replace({re.compile('a.'): '1', re.compile('ab'): '2'}, 2)([Text('abac')]),
+            expected=generator(Text('11')),
+        )
+
+    def test_literal_not_expanded(self) -> None:
+        compare(Replace({'a': r'\1'})([Text('a')]), expected=generator(Text(r'\1')))
+
+    def test_regex(self) -> None:
+        compare(
+            Replace({re.compile(r'(\w+)@(\w+)'): r'\2 at \1', 'x': 'y'}, 10)([Text('me@host x')]),
+            expected=generator(Text('host at me y')),
+        )
+
+    def test_regex_groups_after_regex(self) -> None:
+        replace = Replace({re.compile('(a)(b)'): r'\2\1', re.compile('(c)'): r'<\1>', 'd': 'e'}, 2)
+        compare(replace([Text('abcd')]), expected=generator(Text('ba<c>e')))
+
+    def test_regex_flags(self) -> None:
+        replace = Replace({re.compile('foo', re.IGNORECASE): 'bar', 'X': 'y'}, 3)
+        compare(replace([Text('FOO X x')]), expected=generator(Text('bar y x')))
+
+    def test_regex_verbose(self) -> None:
+        replace = Replace({re.compile('f o o  # a comment', re.VERBOSE): 'bar', 'x': 'y'}, 3)
+        compare(replace([Text('foo x')]), expected=generator(Text('bar y')))
+
+    def test_empty(self) -> None:
+        compare(Replace({})([Text('foo')]), expected=generator(Text('foo')))
+
+    def test_others_passed_through(self) -> None:
+        file = File(Path('x'))
+        compare(
+            Replace({'a': 'b'})([Start(file), Text('a', file), Element(1), End(file)]),
+            expected=generator(Start(file), Text('b', file), Element(1), End(file)),
+        )
+
+    def test_type_and_prefix_preserved(self) -> None:
+        compare(
+            Replace({'a': 'b'})([SampleText('a', prefix='# ')]),
+            expected=generator(SampleText('b', prefix='# ')),
+            strict=True,
+        )
+
+    def test_across_chunks(self) -> None:
+        file = File(Path('x'))
+        text = 'one foo\ntwo\nfoo three foo\nfo\no\n' * 5
+        replacements: dict[str | re.Pattern[str], str] = {'foo': 'longer\nbar', 'o\nt': 'O-T'}
+        replace = Replace(replacements)
+        expected = re.sub('foo|o\nt', lambda m: replacements[m.group()], text)
+        for size in range(1, 12):
+            result = list(replace([Start(file), *chunks(text, size, file), End(file)]))
+            compare(result[0], expected=Start(file))
+            compare(result[-1], expected=End(file))
+            texts = result[1:-1]
+            compare(
+                ''.join(t.value for t in texts),
+                expected=expected,
+            )
+            line = column = 1
+            for t in texts:
+                compare((t.line, t.column), expected=(line, column))
+                line, column = advance(t.value, line, column)
+
+    def test_regex_across_chunks(self) -> None:
+        replace = Replace({re.compile('a+b'): 'X'}, max_length=5)
+        compare(
+            ''.join(t.value for t in replace(chunks('caaabcab', 2))),
+            expected='cXcX',
+        )
+
+    def test_anchor_across_chunks(self) -> None:
+        replace = Replace({re.compile('^a', re.MULTILINE): 'X'}, max_length=2)
+        compare(
+            ''.join(t.value for t in replace(chunks('baa\na', 2))),
+            expected='baa\nX',
+        )
+
+    def test_context_across_chunks(self) -> None:
+        text = 'xa ab a\nba (a) xab a'
+        patterns = [r'\ba\b', r'(?<=x)a', r'(?<![a-z])a(?=b)', r'(?m)^b']
+        for pattern in patterns:
+            replace = Replace({re.compile(pattern): 'X'}, max_length=2)
+            expected = re.sub(pattern, 'X', text)
+            for size in range(1, 8):
+                compare(
+                    ''.join(t.value for t in replace(chunks(text, size))),
+                    expected=expected,
+                    prefix=f'{pattern!r} in chunks of {size}',
+                )
+
+    def test_leading_global_flags(self) -> None:
+        replace = Replace({re.compile('(?i)abc'): 'X', re.compile('d'): 'Y'}, max_length=3)
+        compare(replace([Text('ABC d D')]), expected=generator(Text('X Y D')))
+
+    def test_named_groups(self) -> None:
+        replace = Replace(
+            {re.compile('x'): 'y', re.compile(r'(?P<c>a)(?P=c)'): r'<\g<c>>'}, max_length=2
+        )
+        compare(replace([Text('aax')]), expected=generator(Text('<a>y')))
+
+    def test_numbered_backreference(self) -> None:
+        with ShouldRaise(ValueError(
+            r"'(a)\\1' refers to a group by number, use a named group"
+        )):
+            Replace({re.compile(r'(a)\1'): 'X'}, max_length=2)
+
+    def test_numbered_conditional(self) -> None:
+        with ShouldRaise(ValueError(
+            "'(a)?(?(1)b|c)' refers to a group by number, use a named group"
+        )):
+            Replace({re.compile('(a)?(?(1)b|c)'): 'X'}, max_length=2)
+
+    def test_not_backreferences(self) -> None:
+        replace = Replace(
+            {re.compile(r'[\1]\\1\101'): 'X', re.compile(r'\d'): 'Y'}, max_length=4
+        )
+        compare(replace([Text('\x01\\1A 2')]), expected=generator(Text('X Y')))
+
+    def test_duplicate_group_name(self) -> None:
+        with ShouldRaise(ValueError("group 'x' is used in more than one pattern")):
+            Replace({re.compile('(?P<x>a)'): '', re.compile('(?P<x>b)'): ''}, max_length=1)
+
+    def test_patterns_need_max_length(self) -> None:
+        with ShouldRaise(ValueError('max_length must be given when there are patterns')):
+            Replace({re.compile('a+'): 'b', 'cc': 'd'})
+
+    def test_different_parents_not_joined(self) -> None:
+        parent1 = Element(1)
+        parent2 = Element(2)
+        compare(
+            Replace({'ab': 'X'})([Text('a', parent1), Text('b', parent2)]),
+            expected=generator(Text('a', parent1), Text('b', parent2)),
+        )
+
+    def test_whole_texts_not_split(self) -> None:
+        file1 = File(Path('1'))
+        file2 = File(Path('2'))
+        compare(
+            Replace({'foo': 'bar'})([
+                Start(file1), Text('a foo', file1, 1, 1), End(file1),
+                Start(file2), Text('foo', file2, 1, 1), End(file2),
+            ]),
+            expected=generator(
+                Start(file1), Text('a bar', file1, 1, 1), End(file1),
+                Start(file2), Text('bar', file2, 1, 1), End(file2),
+            ),
+        )
@@ -0,0 +1,298 @@
+import ast
+import os
+import pickle
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Any
+
+import pytest
+from testfixtures import compare, ShouldRaise
+
+from manipulate import manipulate
+from manipulate.actions import Action, Classify
+from manipulate.cache import Cache, ParseCache, fingerprint
+from manipulate.destinations import Files as FilesDestination
+from manipulate.elements import Element, Text, File
+from manipulate.sources import Files
+
+from .helpers import Upper
+
+
+def action(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+    return elements
+
+
+class TestFingerprint:
+
+    def test_stable(self) -> None:
+        compare(fingerprint([Upper(), action]), expected=fingerprint([Upper(), action]))
+
+    def test_order(self) -> None:
+        assert fingerprint([Upper(), action]) != fingerprint([action, Upper()])
+
+    def test_parameters(self) -> None:
+        assert fingerprint([Classify({'.a': Text})]) != fingerprint([Classify({'.b': Text})])
+
+
+class TestCache:
+
+    def test_unknown(self, tmp_path: Path) -> None:
+        cache = Cache(tmp_path / 'cache.json', [Upper()])
+        path = tmp_path / 'a.txt'
+        path.write_text('a')
+        compare(cache.unchanged(path), expected=False)
+
+    def test_recorded(self, tmp_path: Path) -> None:
+        cache = Cache(tmp_path / 'cache.json', [Upper()])
+        path = tmp_path / 'a.txt'
+        path.write_text('a')
+        cache.record(path)
+        compare(cache.unchanged(path), expected=True)
+
+    def test_changed(self, tmp_path: Path) -> None:
+        cache = Cache(tmp_path / 'cache.json', [Upper()])
+        path = tmp_path / 'a.txt'
+        path.write_text('a')
+        cache.record(path)
+        path.write_text('ab')
+        compare(cache.unchanged(path), expected=False)
+
+    def test_missing(self, tmp_path: Path) -> None:
+        cache = Cache(tmp_path / 'cache.json', [Upper()])
+        path = tmp_path / 'a.txt'
+        path.write_text('a')
+        cache.record(path)
+        path.unlink()
+        compare(cache.unchanged(path), expected=False)
+
+    def test_hash_content(self, tmp_path: Path) -> None:
+        cache = Cache(tmp_path / 'cache.json', [Upper()], hash_content=True)
+        path = tmp_path / 'a.txt'
+        path.write_text('a')
+        cache.record(path)
+        os.utime(path, ns=(0, 0))
+        compare(cache.unchanged(path), expected=True)
+        path.write_text('b')
+        compare(cache.unchanged(path), expected=False)
+
+    def test_persisted(self, tmp_path: Path) -> None:
+        path = tmp_path / 'a.txt'
+        path.write_text('a')
+        cache = Cache(tmp_path / 'cache.json', [Upper()])
+        cache.record(path)
+        cache.save()
+        compare(Cache(tmp_path / 'cache.json', [Upper()]).unchanged(path), expected=True)
+
+    def test_actions_changed(self, tmp_path: Path) -> None:
+        path = tmp_path / 'a.txt'
+        path.write_text('a')
+        cache = Cache(tmp_path / 'cache.json', [Upper()])
+        cache.record(path)
+        cache.save()
+        compare(Cache(tmp_path / 'cache.json', [Upper(), action]).unchanged(path), expected=False)
+
+    def test_corrupt(self, tmp_path: Path) -> None:
+        (tmp_path / 'cache.json').write_text('{')
+        compare(Cache(tmp_path / 'cache.json', [Upper()]).entries, expected={})
+
+    def test_repr(self, tmp_path: Path) -> None:
+        compare(
+            repr(Cache(tmp_path / 'cache.json', [Upper()])),
+            expected=f"Cache(path=PosixPath('{tmp_path / 'cache.json'}'), hash_content=False)",
+        )
+
+    def test_incremental_run(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.chdir(tmp_path)
+        a = Path('a.txt')
+        b = Path('b.txt')
+        a.write_text('a')
+        b.write_text('b')
+        out = tmp_path / 'out'
+        out.mkdir()
+        actions = [Upper()]
+
+        def run() -> list[Path]:
+            seen: list[Path] = []
+
+            def record(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+                for element in elements:
+                    if isinstance(element, Text) and element.parent is not None:
+                        seen.append(element.parent.value)
+                    yield element
+
+            cache = Cache(tmp_path / 'cache.json', [record, *actions])
+            manipulate(
+                Files([a, b], cache=cache), [record, *actions], FilesDestination(out, cache=cache)
+            )
+            return seen
+
+        compare(run(), expected=[a, b])
+        compare((out / 'a.txt').read_text(), expected='A')
+        compare(run(), expected=[])
+        b.write_text('bb')
+        compare(run(), expected=[b])
+        compare((out / 'b.txt').read_text(), expected='BB')
+
+    def test_source_cache_for_different_actions(self, tmp_path: Path) -> None:
+        path = tmp_path / 'cache.json'
+        cache = Cache(path, [Upper()])
+        with ShouldRaise(ValueError(f'{path} is a cache for different actions')):
+            manipulate(Files([], cache=cache), [action], FilesDestination(tmp_path))
+
+    def test_destination_cache_for_different_actions(self, tmp_path: Path) -> None:
+        path = tmp_path / 'cache.json'
+        cache = Cache(path, [Upper()])
+        with ShouldRaise(ValueError(f'{path} is a cache for different actions')):
+            manipulate(Files([]), [Upper(), action], FilesDestination(tmp_path, cache=cache))
+
+
+class PythonText(Text):
+    __slots__ = ()
+
+
+@dataclass
+class Parser:
+    calls: int = field(default=0, repr=False)
+
+    def __call__(self, text: str) -> list[str]:
+        self.calls += 1
+        return text.split()
+
+
+@dataclass
+class Rename:
+    """
+    An action that renames a variable, using a shared cache of parsed text.
+    """
+
+    cache: ParseCache[ast.Module]
+    old: str
+    new: str
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            if isinstance(element, PythonText):
+                tree = self.cache.get(element)
+                names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+                if self.old in names:
+                    element = PythonText(
+                        element.value.replace(self.old, self.new),
+                        element.parent, element.line, element.column
+                    )
+            yield element
+
+
+class TestParseCache:
+
+    def test_parsed_once(self) -> None:
+        parser = Parser()
+        cache = ParseCache(parser)
+        compare(cache.get(Text('a b')), expected=['a', 'b'])
+        result = cache.get(Text('a b', parent=File(Path('other'))))
+        compare(result, expected=['a', 'b'])
+        compare(parser.calls, expected=1)
+        compare((cache.hits, cache.misses), expected=(1, 1))
+
+    def test_keyed_by_type(self) -> None:
+        parser = Parser()
+        cache = ParseCache(parser)
+        cache.get(Text('a b'))
+        cache.get(PythonText('a b'))
+        compare(parser.calls, expected=2)
+
+    def test_lru(self) -> None:
+        parser = Parser()
+        cache = ParseCache(parser, size=2)
+        cache.get(Text('a'))
+        cache.get(Text('b'))
+        cache.get(Text('a'))
+        cache.get(Text('c'))
+        compare(parser.calls, expected=3)
+        cache.get(Text('a'))
+        compare(parser.calls, expected=3)
+        cache.get(Text('b'))
+        compare(parser.calls, expected=4)
+
+    def test_disk(self, tmp_path: Path) -> None:
+        parser = Parser()
+        ParseCache(parser, path=tmp_path / 'parsed').get(Text('a b'))
+        compare(len(list((tmp_path / 'parsed').glob('*.pickle'))), expected=1)
+        cache = ParseCache(parser, path=tmp_path / 'parsed')
+        compare(cache.get(Text('a b')), expected=['a', 'b'])
+        compare(parser.calls, expected=1)
+        compare((cache.hits, cache.misses), expected=(1, 0))
+
+    def test_disk_keyed_by_parser(self, tmp_path: Path) -> None:
+        ParseCache(Parser(), path=tmp_path).get(Text('a b'))
+        cache = ParseCache(str.upper, path=tmp_path)
+        compare(cache.get(Text('a b')), expected='A B')
+
+    def test_disk_keyed_by_version(self, tmp_path: Path) -> None:
+        first = lambda text: text.split()  # noqa: E731
+        second = lambda text: text.upper()  # noqa: E731
+        ParseCache(first, path=tmp_path).get(Text('a b'))
+        compare(ParseCache(second, path=tmp_path, version='2').get(Text('a b')), expected='A B')
+        compare(ParseCache(first, path=tmp_path).get(Text('a b')), expected=['a', 'b'])
+
+    def test_unpicklable_result(self, tmp_path: Path) -> None:
+        def parser(text: str) -> Iterable[str]:
+            return (part for part in text.split())
+
+        cache = ParseCache(parser, path=tmp_path)
+        result = cache.get(Text('a b'))
+        compare(list(tmp_path.iterdir()), expected=[])
+        compare(cache.get(Text('a b')), expected=result)
+
+    def test_disk_corrupt(self, tmp_path: Path) -> None:
+        parser = Parser()
+        ParseCache(parser, path=tmp_path).get(Text('a b'))
+        for path in tmp_path.glob('*.pickle'):
+            path.write_bytes(b'junk')
+        compare(ParseCache(parser, path=tmp_path).get(Text('a b')), expected=['a', 'b'])
+        compare(parser.calls, expected=2)
+
+    def test_disk_pruned(self, tmp_path: Path) -> None:
+        cache = ParseCache(Parser(), path=tmp_path)
+        for i, value in enumerate('abcd'):
+            cache.get(Text(value))
+        paths = sorted(tmp_path.glob('*.pickle'))
+        for i, path in enumerate(paths):
+            os.utime(path, ns=(i, i))
+        ParseCache(Parser(), path=tmp_path, max_files=2)
+        compare(sorted(tmp_path.glob('*.pickle')), expected=paths[2:])
+
+    def test_pickle(self, tmp_path: Path) -> None:
+        cache = ParseCache(str.split, path=tmp_path)
+        cache.get(Text('a b'))
+        copy = pickle.loads(pickle.dumps(cache))
+        compare(repr(copy), expected=repr(cache))
+        compare(copy.get(Text('a b')), expected=['a', 'b'])
+        compare((copy.hits, copy.misses), expected=(1, 1))
+
+    def test_repr(self, tmp_path: Path) -> None:
+        compare(
+            repr(ParseCache(str.split, path=tmp_path)),
+            expected=(
+                f"ParseCache(parser=<method 'split' of 'str' objects>, size=128, "
+                f"path=PosixPath('{tmp_path}'), max_files=None, version='')"
+            ),
+        )
+
+    def test_shared_by_actions(self, tmp_path: Path) -> None:
+        parses = []
+
+        def parse(text: str) -> ast.Module:
+            parses.append(text)
+            return ast.parse(text)
+
+        cache = ParseCache(parse)
+        (tmp_path / 'source').mkdir()
+        paths = []
+        for i in range(3):
+            path = tmp_path / 'source' / f'{i}.py'
+            path.write_text(f'x{i} = 1\n')
+            paths.append(path)
+        actions: list[Action] = [Classify({'.py': PythonText})]
+        actions.extend(Rename(cache, f'y{i}', f'z{i}') for i in range(10))
+        manipulate(Files(paths), actions, FilesDestination(atomic=True))
+        compare(len(parses), expected=3)
@@ -0,0 +1,174 @@
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+
+from testfixtures import compare, ShouldRaise
+
+from manipulate.checkpoint import Writer, Reader, MAGIC
+from manipulate.elements import Element, Start, End, File, Text, Bytes, Block
+
+
+class PythonText(Text):
+    __slots__ = ()
+
+
+@dataclass(slots=True)
+class Token(Element[str]):
+    kind: str = 'name'
+    extra: Any = None
+
+
+def round_trip(*elements: Element[Any]) -> list[Element[Any]]:
+    stream = BytesIO()
+    writer = Writer(stream)
+    for element in elements:
+        writer.write(element)
+    stream.seek(0)
+    return list(Reader(stream))
+
+
+class TestCheckpoint:
+
+    def test_empty(self) -> None:
+        compare(round_trip(), expected=[])
+
+    def test_file(self) -> None:
+        file = File(Path('foo.py'))
+        elements: list[Element[Any]] = [
+            Start(file),
+            PythonText('x = 1\n', parent=file, line=1, column=1, prefix='# '),
+            End(file),
+        ]
+        compare(round_trip(*elements), expected=elements, strict=True)
+
+    def test_parents_shared(self) -> None:
+        root = Element('root')
+        file = File(Path('foo.py'), parent=root)
+        start, text1, text2, end = round_trip(
+            Start(file), Text('a', parent=file), Text('b', parent=file), End(file)
+        )
+        assert start.value is text1.parent
+        assert text2.parent is text1.parent
+        assert end.value is start.value
+        compare(start.value.parent, expected=root)
+
+    def test_element_used_as_parent_after_being_written(self) -> None:
+        parent = Element(1)
+        child = Element(2, parent=parent)
+        compare(round_trip(parent, child, parent), expected=[parent, child, parent])
+
+    def test_values(self) -> None:
+        elements: list[Element[Any]] = [
+            Element(None),
+            Element(42),
+            Element(-2**63),
+            Element(2**70),
+            Element(b'bytes'),
+            Bytes(memoryview(b'view')),
+            Element(3.5),
+            Element({'a': [1, 2]}),
+            Element('\udcff'),
+            Element(Path('a/\udcff')),
+            Element('x' * 100),
+        ]
+        result = round_trip(*elements)
+        compare(result[5], expected=Bytes(b'view'))
+        del elements[5], result[5]
+        compare(result, expected=elements, strict=True)
+
+    def test_extra_fields(self) -> None:
+        elements = [Token('a', kind='op', extra=(1, 2)), Token('b', parent=Element('p'))]
+        compare(round_trip(*elements), expected=elements, strict=True)
+
+    def test_block(self) -> None:
+        file = File(Path('x'))
+        block = Block.of([Text('a', file, 1, 1), Text('b', file, 1, 2)])
+        result, = round_trip(block)
+        compare(result, expected=block)
+        assert isinstance(result, Block)
+        assert result.type is Text
+
+    def test_interned(self) -> None:
+        stream = BytesIO()
+        writer = Writer(stream)
+        writer.write(Text('same'))
+        size = stream.tell()
+        writer.write(Text('same'))
+        second = stream.tell() - size
+        assert second < size - len(MAGIC)
+        stream.seek(0)
+        compare(list(Reader(stream)), expected=[Text('same'), Text('same')])
+
+    def test_interned_slots_reused(self) -> None:
+        stream = BytesIO()
+        writer = Writer(stream, intern_slots=2)
+        values = ['a', 'b', 'a', 'c', 'b', 'a', 'c', 'c']
+        for value in values:
+            writer.write(Element(value))
+        compare(len(writer.interned), expected=2)
+        stream.seek(0)
+        reader = Reader(stream)
+        compare(list(reader), expected=[Element(value) for value in values])
+        compare(reader.interned, expected=['c', 'a'])
+
+    def test_least_recently_used_evicted(self) -> None:
+        stream = BytesIO()
+        writer = Writer(stream, intern_slots=2)
+        writer.write(Element('a'))
+        writer.write(Element('b'))
+        writer.write(Element('a'))
+        writer.write(Element('c'))
+        compare(list(writer.interned), expected=[(str, 'a'), (str, 'c')])
+
+    def test_no_intern_slots(self) -> None:
+        with ShouldRaise(ValueError('intern_slots must be at least 1, not 0')):
+            Writer(BytesIO(), intern_slots=0)
+
+    def test_interned_nested(self) -> None:
+        # nested elements are defined before the values of the element that refers to them:
+        elements: list[Element[Any]] = [
+            Start(File(Path('a'), parent=Element('x'))), Element('x'), Element('a')
+        ]
+        compare(round_trip(*elements), expected=elements)
+
+    def test_positions(self) -> None:
+        elements: list[Element[Any]] = [
+            Text('a'),
+            Text('b', line=0, column=0),
+            Text('c', line=1),
+            Text('d', column=0),
+            Text('e', line=2**32 - 1, column=7),
+        ]
+        compare(round_trip(*elements), expected=elements, strict=True)
+
+    def test_position_out_of_range(self) -> None:
+        stream = BytesIO()
+        writer = Writer(stream)
+        writer.write(Text('a'))
+        with ShouldRaise(ValueError(
+            f"line of Text('b') at line -1 must be between 0 and {2**32 - 1}"
+        )):
+            writer.write(Text('b', line=-1))
+        with ShouldRaise(ValueError(
+            f"column of Text('c'), column {2**32} must be between 0 and {2**32 - 1}"
+        )):
+            writer.write(Text('c', column=2**32))
+        # nothing was written for the rejected elements:
+        writer.write(Text('d'))
+        stream.seek(0)
+        compare(list(Reader(stream)), expected=[Text('a'), Text('d')])
+
+    def test_not_a_checkpoint(self) -> None:
+        with ShouldRaise(ValueError('not a checkpoint')):
+            Reader(BytesIO(b'junk'))
+
+    def test_truncated(self) -> None:
+        stream = BytesIO()
+        Writer(stream).write(Text('some text'))
+        with ShouldRaise(ValueError('checkpoint is truncated')):
+            list(Reader(BytesIO(stream.getvalue()[:-2])))
+
+    def test_unknown_record(self) -> None:
+        with ShouldRaise(ValueError('unknown record kind in checkpoint: 99')):
+            list(Reader(BytesIO(MAGIC + b'\x63')))
@@ -1,9 +1,22 @@
+import asyncio
+import gc
+import os
 from pathlib import Path
+from typing import Any, AsyncIterator, Iterable
 
+import pytest
 from testfixtures import generator, compare, TempDirectory, ShouldRaise
 
-from manipulate.destinations import Memory, Files
-from manipulate.elements import Start, File, Text, End, Element
+from manipulate import manipulate
+from manipulate.destinations import (
+    Memory, Files, BinaryFiles, AsyncFiles, Spool, Checkpoint
+)
+from manipulate.elements import Start, File, Text, End, Element, Bytes, Block, RopeText
+from manipulate.sources import Files as Source
+
+
+class SampleText(Text):
+    __slots__ = ()
 
 
 class TestMemory:
@@ -87,6 +100,14 @@ class TestFiles:
         with ShouldRaise(TypeError(f'not a directory: {file_path}')):
             Files(file_path)
 
+    def test_negative_writers(self) -> None:
+        with ShouldRaise(ValueError('writers must not be negative, not -1')):
+            Files(writers=-1)
+
+    def test_no_pending(self) -> None:
+        with ShouldRaise(ValueError('max_pending must be at least 1, not 0')):
+            Files(writers=2, max_pending=0)
+
     def test_write_to_supplied_directory(self, tempdir: TempDirectory) -> None:
         directory = (tempdir / 'out')
         directory.mkdir()
@@ -111,5 +132,417 @@ class TestFiles:
         with ShouldRaise(ValueError(f'no directory for foo.txt')):
             files.handle(generator(Start(file), Text('text'), End(file)))
 
+    def test_blocks(self, tempdir: TempDirectory) -> None:
+        files = Files()
+        file = File(tempdir / 'foo.txt')
+        block = Block.of([Text('some ', file), SampleText('text', file)])
+        files.handle(generator(Start(file), block, Text('!'), End(file)))
+        compare(tempdir.read('foo.txt'), expected='some text!')
+
+    def test_blocks_write_behind(self, tempdir: TempDirectory) -> None:
+        files = Files(writers=1)
+        file = File(tempdir / 'foo.txt')
+        block = Block.of([Text('some ', file), Text('text', file)])
+        files.handle(generator(Start(file), block, End(file)))
+        compare(tempdir.read('foo.txt'), expected='some text')
+
+    def test_rope_text(self, tempdir: TempDirectory) -> None:
+        files = Files()
+        file = File(tempdir / 'foo.txt')
+        text = RopeText('some text', file).insert(5, 'more ')
+        files.handle(generator(Start(file), text, End(file)))
+        compare(tempdir.read('foo.txt'), expected='some more text')
+        # the pieces were not joined:
+        compare(list(text.pieces()), expected=['some ', 'more ', 'text'])
+
+    def test_rope_text_write_behind(self, tempdir: TempDirectory) -> None:
+        files = Files(writers=1)
+        file = File(tempdir / 'foo.txt')
+        text = RopeText('some text', file).insert(5, 'more ')
+        files.handle(generator(Start(file), text, End(file)))
+        compare(tempdir.read('foo.txt'), expected='some more text')
+
+    def test_block_of_wrong_type(self, tempdir: TempDirectory) -> None:
+        files = Files()
+        f = File(tempdir / 'foo.txt')
+        with ShouldRaise(TypeError("Files can't handle Block(1 x Element)")):
+            files.handle(generator(Start(f), Block.of([Element(1)]), End(f)))
+
     def test_repr(self, tmp_path: Path) -> None:
-        compare(repr(Files(tmp_path)), expected=f"Files(path=PosixPath('{tmp_path}'))")
+        compare(
+            repr(Files(tmp_path)),
+            expected=(
+                f"Files(path=PosixPath('{tmp_path}'), "
+                f"cache=None, atomic=False, skip_unchanged=False, writers=0, max_pending=16)"
+            ),
+        )
+
+
+class TestAtomicFiles:
+
+    def test_write(self, tempdir: TempDirectory) -> None:
+        files = Files(atomic=True)
+        file = File(tempdir / 'foo.txt')
+        files.handle(generator(Start(file), Text('some '), Text('text'), End(file)))
+        tempdir.compare(['foo.txt'])
+        compare(tempdir.read('foo.txt'), expected='some text')
+
+    def test_not_visible_until_complete(self, tempdir: TempDirectory) -> None:
+        files = Files(atomic=True)
+        path = Path(tempdir.write('foo.txt', 'old'))
+        file = File(path)
+
+        def elements() -> Iterable[Element[Any]]:
+            yield Start(file)
+            yield Text('new')
+            compare(tempdir.read('foo.txt'), expected='old')
+            yield End(file)
+
+        files.handle(elements())
+        compare(tempdir.read('foo.txt'), expected='new')
+
+    def test_error_leaves_target_untouched(self, tempdir: TempDirectory) -> None:
+        files = Files(atomic=True)
+        path = Path(tempdir.write('foo.txt', 'old'))
+        f = File(path)
+        with ShouldRaise(TypeError("Files can't handle Element(1)")):
+            files.handle(generator(Start(f), Text('new'), Element[int](1), End(f)))
+        tempdir.compare(['foo.txt'])
+        compare(tempdir.read('foo.txt'), expected='old')
+
+    def test_mode_preserved(self, tempdir: TempDirectory) -> None:
+        files = Files(atomic=True)
+        path = Path(tempdir.write('foo.txt', 'old'))
+        path.chmod(0o640)
+        files.handle(generator(Start(File(path)), Text('new'), End(File(path))))
+        compare(path.stat().st_mode & 0o777, expected=0o640)
+        compare(tempdir.read('foo.txt'), expected='new')
+
+    def test_in_place(self, tempdir: TempDirectory) -> None:
+        path = Path(tempdir.write('foo.txt', 'some text'))
+        manipulate(Source([path]), [], Files(atomic=True))
+        compare(tempdir.read('foo.txt'), expected='some text')
+
+    def test_skip_unchanged(self, tempdir: TempDirectory) -> None:
+        path = Path(tempdir.write('foo.txt', 'same'))
+        os.utime(path, ns=(0, 0))
+        files = Files(skip_unchanged=True)
+        files.handle(generator(Start(File(path)), Text('sa'), Text('me'), End(File(path))))
+        tempdir.compare(['foo.txt'])
+        compare(path.stat().st_mtime_ns, expected=0)
+
+    def test_skip_unchanged_but_changed(self, tempdir: TempDirectory) -> None:
+        path = Path(tempdir.write('foo.txt', 'same'))
+        os.utime(path, ns=(0, 0))
+        files = Files(skip_unchanged=True)
+        files.handle(generator(Start(File(path)), Text('different'), End(File(path))))
+        tempdir.compare(['foo.txt'])
+        compare(tempdir.read('foo.txt'), expected='different')
+        assert path.stat().st_mtime_ns != 0
+
+    def test_skip_unchanged_new_file(self, tempdir: TempDirectory) -> None:
+        files = Files(skip_unchanged=True)
+        file = File(tempdir / 'foo.txt')
+        files.handle(generator(Start(file), Text('text'), End(file)))
+        tempdir.compare(['foo.txt'])
+        compare(tempdir.read('foo.txt'), expected='text')
+
+
+class TestWriteBehindFiles:
+
+    def test_multiple_files(self, tempdir: TempDirectory) -> None:
+        files = Files(writers=2)
+        file1 = File(tempdir / 'foo.txt')
+        file2 = File(tempdir / 'bar.txt')
+        files.handle(
+            generator(
+                Start(file1),
+                Text('some text'),
+                End(file1),
+                Start(file2),
+                Text('other'),
+                Text(' text'),
+                End(file2),
+            )
+        )
+        tempdir.compare(['foo.txt', 'bar.txt'])
+        compare(tempdir.read('foo.txt'), expected='some text')
+        compare(tempdir.read('bar.txt'), expected='other text')
+
+    def test_many_files(self, tempdir: TempDirectory) -> None:
+        paths = [Path(tempdir.write(f'{i}.txt', f'{i}')) for i in range(50)]
+        manipulate(Source(paths), [], Files(atomic=True, writers=4, max_pending=2))
+        for i in range(50):
+            compare(tempdir.read(f'{i}.txt'), expected=f'{i}')
+
+    def test_relative(self, tempdir: TempDirectory) -> None:
+        files = Files(Path(tempdir.path), writers=1)
+        file = File(Path('foo.txt'))
+        files.handle(generator(Start(file), Text('text'), End(file)))
+        compare(tempdir.read('foo.txt'), expected='text')
+
+    @pytest.mark.parametrize('writers', [0, 1])
+    def test_unterminated_atomic(self, tempdir: TempDirectory, writers: int) -> None:
+        path = Path(tempdir.write('foo.txt', 'old'))
+        files = Files(atomic=True, writers=writers)
+        files.handle(generator(Start(File(path)), Text('text')))
+        tempdir.compare(['foo.txt'])
+        compare(tempdir.read('foo.txt'), expected='old')
+
+    def test_unterminated_not_written(self, tempdir: TempDirectory) -> None:
+        files = Files(writers=1)
+        files.handle(generator(Start(File(tempdir / 'foo.txt')), Text('text')))
+        tempdir.compare([])
+
+    def test_write_error(self, tempdir: TempDirectory) -> None:
+        files = Files(writers=2)
+        file = File(tempdir / 'missing' / 'foo.txt')
+        with ShouldRaise(FileNotFoundError) as s:
+            files.handle(generator(Start(file), Text('text'), End(file)))
+        compare(s.raised.__notes__, expected=[f'Writing {file}'])
+
+    def test_write_error_stops_pipeline(self, tempdir: TempDirectory) -> None:
+        files = Files(writers=1, max_pending=1)
+        bad = File(tempdir / 'missing' / 'foo.txt')
+        handled = []
+
+        def elements() -> Iterable[Element[Any]]:
+            yield Start(bad)
+            yield End(bad)
+            for i in range(100):
+                file = File(tempdir / f'{i}.txt')
+                handled.append(file)
+                yield Start(file)
+                yield End(file)
+
+        with ShouldRaise(FileNotFoundError):
+            files.handle(elements())
+        assert len(handled) < 100
+
+    def test_error_in_pipeline_flushes(self, tempdir: TempDirectory) -> None:
+        files = Files(writers=1)
+        file = File(tempdir / 'foo.txt')
+        with ShouldRaise(TypeError("Files can't handle Element(1)")):
+            files.handle(generator(Start(file), Text('text'), End(file), Element[int](1)))
+        compare(tempdir.read('foo.txt'), expected='text')
+
+    def test_text_before_element(self) -> None:
+        files = Files(writers=1)
+        with ShouldRaise(ValueError("no path specified to write Text('foo')")):
+            files.handle(generator(Text('foo')))
+
+
+class TestBinaryFiles:
+
+    def test_multiple_files(self, tempdir: TempDirectory) -> None:
+        files = BinaryFiles()
+        file1 = File(tempdir / 'foo.bin')
+        file2 = File(tempdir / 'bar.bin')
+        data = memoryview(b'\x00\x01\x02\x03')
+        files.handle(
+            generator(
+                Start(file1),
+                Bytes(b'\xff'),
+                End(file1),
+                Start(file2),
+                Bytes(data[:2]),
+                Bytes(data[2:]),
+                End(file2),
+            )
+        )
+        compare((tempdir / 'foo.bin').read_bytes(), expected=b'\xff')
+        compare((tempdir / 'bar.bin').read_bytes(), expected=b'\x00\x01\x02\x03')
+
+    def test_text_inside_file_element(self, tempdir: TempDirectory) -> None:
+        files = BinaryFiles()
+        f = File(tempdir / 'foo.bin')
+        with ShouldRaise(TypeError("BinaryFiles can't handle Text('x')")):
+            files.handle(generator(Start(f), Text('x'), End(f)))
+
+    def test_repr(self, tmp_path: Path) -> None:
+        compare(
+            repr(BinaryFiles(tmp_path)),
+            expected=(
+                f"BinaryFiles(path=PosixPath('{tmp_path}'), "
+                f"cache=None, atomic=False, skip_unchanged=False, writers=0, max_pending=16)"
+            ),
+        )
+
+
+async def async_generator(*elements: Element[Any]) -> AsyncIterator[Element[Any]]:
+    for element in elements:
+        yield element
+
+
+class TestAsyncFiles:
+
+    def test_multiple_files(self, tempdir: TempDirectory) -> None:
+        files = AsyncFiles(concurrency=1)
+        file1 = File(tempdir / 'foo.txt')
+        file2 = File(tempdir / 'bar.txt')
+        asyncio.run(
+            files.handle(
+                async_generator(
+                    Start(file1),
+                    Text('some text'),
+                    End(file1),
+                    Start(file2),
+                    Text('other'),
+                    Text(' text'),
+                    End(file2),
+                )
+            )
+        )
+        tempdir.compare(['foo.txt', 'bar.txt'])
+        compare(tempdir.read('foo.txt'), expected='some text')
+        compare(tempdir.read('bar.txt'), expected='other text')
+
+    def test_write_error(self, tempdir: TempDirectory) -> None:
+        files = AsyncFiles()
+        good = File(tempdir / 'good.txt')
+        bad = File(tempdir / 'bad.txt')
+        with ShouldRaise(TypeError("Files can't handle Element(1)")):
+            asyncio.run(
+                files.handle(
+                    async_generator(
+                        Start(bad), Element[int](1), End(bad), Start(good), Text('x'), End(good)
+                    )
+                )
+            )
+
+    def test_text_before_element(self) -> None:
+        with ShouldRaise(ValueError("no path specified to write Text('some text')")):
+            asyncio.run(AsyncFiles().handle(async_generator(Text('some text'))))
+
+    def test_path_is_not_a_directory(self, tmp_path: Path) -> None:
+        file_path = tmp_path / 'foo.txt'
+        with ShouldRaise(TypeError(f'not a directory: {file_path}')):
+            AsyncFiles(file_path)
+
+    def test_no_concurrency(self) -> None:
+        with ShouldRaise(ValueError('concurrency must be at least 1, not 0')):
+            AsyncFiles(concurrency=0)
+
+    def test_repr(self, tmp_path: Path) -> None:
+        compare(
+            repr(AsyncFiles(tmp_path)),
+            expected=f"AsyncFiles(path=PosixPath('{tmp_path}'), concurrency=8)",
+        )
+
+
+def file_elements(count: int) -> list[Element[Any]]:
+    elements: list[Element[Any]] = []
+    for i in range(count):
+        file = File(Path(f'{i}.txt'))
+        elements.extend((Start(file), Text(f'text {i}', parent=file, line=1, column=1), End(file)))
+    return elements
+
+
+class TestSpool:
+
+    def test_in_memory(self, tmp_path: Path) -> None:
+        spool = Spool(max_elements=10, directory=tmp_path)
+        elements = file_elements(3)
+        spool.handle(iter(elements))
+        compare(spool.elements, expected=elements)
+        compare(spool.spilled, expected=0)
+        compare(list(spool), expected=elements)
+        compare(len(spool), expected=9)
+        compare(list(tmp_path.iterdir()), expected=[])
+
+    def test_spilled(self, tmp_path: Path) -> None:
+        spool = Spool(max_elements=4, directory=tmp_path)
+        elements = file_elements(10)
+        spool.handle(iter(elements))
+        compare(len(spool.elements), expected=4)
+        compare(spool.spilled, expected=26)
+        compare(len(spool), expected=30)
+        compare(len(list(tmp_path.iterdir())), expected=1)
+        compare(list(spool), expected=elements)
+        # can be read more than once:
+        compare(list(spool), expected=elements)
+
+    def test_identity_preserved(self) -> None:
+        spool = Spool(max_elements=1)
+        root = Element('root')
+        file = File(Path('x'), parent=root)
+        elements: list[Element[Any]] = [
+            Start(file), Text('a', parent=file), Text('b', parent=file), End(file)
+        ]
+        spool.handle(iter(elements))
+        start, a, b, end = spool
+        assert start.value is file
+        assert a.parent is file
+        assert b.parent is file
+        assert end.value is file
+        assert file.parent is root
+
+    def test_identity_preserved_between_spilled(self) -> None:
+        spool = Spool(max_elements=1)
+        parent = Element('p')
+        elements: list[Element[Any]] = [
+            Element(0), Text('a', parent=parent), Text('b', parent=parent)
+        ]
+        spool.handle(iter(elements))
+        _, a, b = spool
+        assert a.parent is b.parent
+
+    def test_max_bytes(self) -> None:
+        spool = Spool(max_elements=None, max_bytes=1000)
+        spool.handle(iter([Text('x' * 100)] * 20))
+        assert 0 < len(spool.elements) < 20
+        compare(len(spool), expected=20)
+        compare(list(spool), expected=[Text('x' * 100)] * 20)
+
+    def test_close(self, tmp_path: Path) -> None:
+        spool = Spool(max_elements=1, directory=tmp_path)
+        spool.handle(iter(file_elements(2)))
+        spool.close()
+        compare(list(tmp_path.iterdir()), expected=[])
+        compare(list(spool), expected=[])
+
+    def test_handle_again(self, tmp_path: Path) -> None:
+        spool = Spool(max_elements=1, directory=tmp_path)
+        spool.handle(iter(file_elements(2)))
+        spool.handle(iter(file_elements(1)))
+        compare(len(list(tmp_path.iterdir())), expected=1)
+        compare(list(spool), expected=file_elements(1))
+
+    def test_removed_when_discarded(self, tmp_path: Path) -> None:
+        spool = Spool(max_elements=1, directory=tmp_path)
+        spool.handle(iter(file_elements(2)))
+        del spool
+        gc.collect()
+        compare(list(tmp_path.iterdir()), expected=[])
+
+    def test_manipulate(self, tmp_path: Path) -> None:
+        paths = [Path(tmp_path / f'{i}.txt') for i in range(5)]
+        for path in paths:
+            path.write_text(str(path))
+        spool = Spool(max_elements=2)
+        manipulate(Source(paths), [], spool)
+        compare(
+            [element.value for element in spool if isinstance(element, Text)],
+            expected=[str(path) for path in paths],
+        )
+
+    def test_repr(self) -> None:
+        compare(
+            repr(Spool()), expected='Spool(max_elements=100000, max_bytes=None, directory=None)'
+        )
+
+
+class TestCheckpoint:
+
+    def test_error_leaves_existing(self, tmp_path: Path) -> None:
+        path = tmp_path / 'checkpoint'
+        path.write_bytes(b'old')
+
+        def elements() -> Iterable[Element[Any]]:
+            yield Text('x')
+            raise Exception('boom!')
+
+        with ShouldRaise(Exception('boom!')):
+            Checkpoint(path).handle(elements())
+        compare(list(tmp_path.iterdir()), expected=[path])
+        compare(path.read_bytes(), expected=b'old')
@@ -1,6 +1,12 @@
-from testfixtures import compare
+from pathlib import Path
+from typing import Any
 
-from manipulate.elements import Element, Text
+import pytest
+from testfixtures import compare, ShouldRaise
+
+from manipulate.elements import (
+    Element, Text, advance, Start, End, File, Bytes, Block, RopeText
+)
 
 
 class TestElement:
@@ -28,6 +34,17 @@ class TestElement:
             expected='Element(13) at line 1, column 2',
         )
 
+    @pytest.mark.parametrize(
+        'element',
+        [
+            Element(1), Start(1), End(1), File(Path('x')), Bytes(b'x'), Text('x'), Block([]),
+            RopeText('x'),
+        ],
+        ids=lambda e: type(e).__qualname__,
+    )
+    def test_no_instance_dict(self, element: Element[Any]) -> None:
+        assert not hasattr(element, '__dict__')
+
 
 class TestText:
 
@@ -57,3 +74,168 @@ class TestText:
                 " at line 1, column 2"
             ),
         )
+
+
+class TestTextPositions:
+
+    text = Text('ab\ncde\n\nf', line=3, column=5)
+
+    @pytest.mark.parametrize(
+        'offset, position',
+        [(0, (3, 5)), (1, (3, 6)), (2, (3, 7)), (3, (4, 1)), (6, (4, 4)), (7, (5, 1)),
+         (8, (6, 1)), (9, (6, 2))],
+    )
+    def test_round_trip(self, offset: int, position: tuple[int, int]) -> None:
+        compare(self.text.position(offset), expected=position)
+        compare(self.text.offset(*position), expected=offset)
+
+    def test_position_out_of_range(self) -> None:
+        with ShouldRaise(ValueError(f'offset 10 is not within {self.text}')):
+            self.text.position(10)
+
+    @pytest.mark.parametrize(
+        'line, column', [(2, 1), (3, 4), (3, 8), (4, 5), (5, 2), (7, 1), (6, 3)]
+    )
+    def test_offset_out_of_range(self, line: int, column: int) -> None:
+        with ShouldRaise(ValueError(f'line {line}, column {column} is not within {self.text}')):
+            self.text.offset(line, column)
+
+    def test_no_position(self) -> None:
+        with ShouldRaise(ValueError("Text('x') has no line and column")):
+            Text('x').position(0)
+
+    def test_index_cached(self) -> None:
+        text = Text('a\nb\n', line=1, column=1)
+        newlines = text.newlines()
+        compare(newlines, expected=[1, 3])
+        assert text.newlines() is newlines
+
+    def test_index_rebuilt_when_value_changes(self) -> None:
+        text = Text('a\nb\n', line=1, column=1)
+        text.newlines()
+        text.value = 'ab\n'
+        compare(text.newlines(), expected=[2])
+
+    def test_index_not_compared(self) -> None:
+        text = Text('a\nb')
+        text.newlines()
+        compare(text, expected=Text('a\nb'))
+
+    def test_slice(self) -> None:
+        file = File(Path('x'))
+        text = Text('ab\ncde\n\nf', parent=file, line=3, column=5)
+        compare(text.slice(4, 8), expected=Text('de\n\n', parent=file, line=4, column=2))
+        compare(text.slice(4, 8).newlines(), expected=[2, 3])
+
+    def test_slice_matches_rescan(self) -> None:
+        text = Text('ab\ncde\n\nf', line=3, column=5)
+        for start in range(len(text.value) + 1):
+            for stop in range(start, len(text.value) + 1):
+                sliced = text.slice(start, stop)
+                fresh = Text(sliced.value, line=sliced.line, column=sliced.column)
+                compare(sliced.newlines(), expected=fresh.newlines())
+                compare((sliced.line, sliced.column), expected=text.position(start))
+
+    def test_slice_to_end(self) -> None:
+        compare(Text('ab\nc', line=1, column=1).slice(3), expected=Text('c', line=2, column=1))
+
+    def test_slice_negative(self) -> None:
+        compare(Text('abc', line=1, column=1).slice(-2, -1), expected=Text('b', line=1, column=2))
+
+    def test_slice_keeps_type_and_prefix(self) -> None:
+        class SampleText(Text):
+            __slots__ = ()
+
+        compare(
+            SampleText('abc', prefix='# ').slice(1),
+            expected=SampleText('bc', prefix='# '),
+            strict=True,
+        )
+
+
+class TestRopeText:
+
+    def test_value(self) -> None:
+        compare(RopeText('abc').value, expected='abc')
+
+    def test_splice(self) -> None:
+        text = RopeText('hello world', line=2, column=3)
+        spliced = text.splice(0, 5, 'goodbye')
+        compare(list(spliced.pieces()), expected=['goodbye', ' world'])
+        compare(spliced, expected=RopeText('goodbye world', line=2, column=3))
+        # the original is unchanged:
+        compare(text.value, expected='hello world')
+
+    def test_insert_and_delete(self) -> None:
+        text = RopeText('abcdef').insert(3, 'XY').delete(1, 2).insert(0, '>').insert(8, '<')
+        compare(text.value, expected='>acXYdef<')
+
+    def test_edits_across_pieces(self) -> None:
+        text = RopeText('0123456789')
+        expected = '0123456789'
+        for start, stop, insert in (4, 4, 'ab'), (2, 8, 'c'), (1, 4, ''), (0, 3, 'def'), (2, 2, ''):
+            text = text.splice(start, stop, insert)
+            expected = expected[:start] + insert + expected[stop:]
+            compare(''.join(text.pieces()), expected=expected)
+        compare(text.value, expected=expected)
+
+    def test_splice_negative_and_out_of_range(self) -> None:
+        compare(RopeText('abcdef').splice(-2, 100, 'X').value, expected='abcdX')
+
+    def test_empty(self) -> None:
+        compare(list(RopeText('').pieces()), expected=[])
+        compare(RopeText('').insert(0, 'a').value, expected='a')
+
+    def test_pattern_matching(self) -> None:
+        match RopeText('abc', line=1).insert(3, 'def'):
+            case Text(value, None, line):
+                compare(value, expected='abcdef')
+                compare(line, expected=1)
+            case _:  # pragma: no cover
+                raise AssertionError('no match')
+
+    def test_str_long_without_joining(self) -> None:
+        text = RopeText('Z' * 60).insert(0, 'A').insert(61, 'C')
+        compare(
+            str(text),
+            expected="RopeText('AZZZZZZZZZZZZZZZZZZZZZZZZ...ZZZZZZZZZZZZZZZZZZZZZZZZC')",
+        )
+        compare(len(list(text.pieces())), expected=3)
+
+    def test_str_short(self) -> None:
+        compare(str(RopeText('ab').insert(1, 'c')), expected="RopeText('acb')")
+
+    def test_positions(self) -> None:
+        text = RopeText('a\nb', line=1, column=1).insert(3, '\nc')
+        compare(text.position(4), expected=(3, 1))
+
+
+class TestBlock:
+
+    def test_round_trip(self) -> None:
+        file = File(Path('x'))
+        elements = [Text('a', file, 1, 1), Text('b\n', file, 1, 2), Text('c', file, 2, 1)]
+        block = Block.of(elements)
+        compare(block.value, expected=['a', 'b\n', 'c'])
+        compare(block.parent, expected=file)
+        compare(block.lines, expected=[1, 1, 2])
+        compare(block.columns, expected=[1, 2, 1])
+        compare(list(block.elements()), strict=True, expected=elements)
+
+    def test_len(self) -> None:
+        compare(len(Block.of([Element(1), Element(2)])), expected=2)
+
+    def test_str(self) -> None:
+        compare(str(Block.of([Text('a'), Text('b')])), expected='Block(2 x Text)')
+
+
+class TestAdvance:
+
+    def test_no_newline(self) -> None:
+        compare(advance('abc', 2, 3), expected=(2, 6))
+
+    def test_trailing_newline(self) -> None:
+        compare(advance('abc\n', 2, 3), expected=(3, 1))
+
+    def test_multiple_lines(self) -> None:
+        compare(advance('a\nb\ncd', 2, 3), expected=(4, 3))
@@ -0,0 +1,158 @@
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Event, Thread
+from time import sleep
+from typing import Any, Iterable
+
+from testfixtures import compare, ShouldRaise
+
+from manipulate import manipulate
+from manipulate.actions import Batch
+from manipulate.destinations import Memory, Files as FilesDestination
+from manipulate.elements import Element, Text, Start, File, Block
+from manipulate.fanout import FanOut, Branch, BATCH_SIZE
+from manipulate.sources import Memory as Source, Files
+
+from .helpers import Upper
+
+
+@dataclass
+class Fail:
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            raise Exception('boom!')
+        yield from ()
+
+
+class First:
+    """
+    A destination that stops after the first element.
+    """
+
+    elements: list[Element[Any]]
+
+    def handle(self, elements: Iterable[Element[Any]]) -> None:
+        self.elements = [next(iter(elements))]
+
+
+class BlockMemory(Memory):
+    blocks = True
+
+
+class TestFanOut:
+
+    def test_branches(self) -> None:
+        plain = Memory()
+        upper = Memory()
+        manipulate(
+            Source(Text('a'), Text('b')),
+            [],
+            FanOut([Branch([], plain), Branch([Upper()], upper)]),
+        )
+        compare(plain.elements, expected=[Text('a'), Text('b')])
+        compare(upper.elements, expected=[Text('A'), Text('B')])
+
+    def test_many_elements(self) -> None:
+        first = Memory()
+        second = Memory()
+        texts = [Text(str(i)) for i in range(BATCH_SIZE * 10 + 3)]
+        manipulate(
+            Source(*texts), [], FanOut([Branch([], first), Branch([], second)], max_pending=200)
+        )
+        compare(first.elements, expected=texts)
+        compare(second.elements, expected=texts)
+
+    def test_single_source_pass(self, tmp_path: Path) -> None:
+        reads = []
+        paths = []
+        for i in range(3):
+            path = tmp_path / f'{i}.txt'
+            path.write_text(f'text {i}')
+            paths.append(path)
+
+        def source_paths() -> Iterable[Path]:
+            for path in paths:
+                reads.append(path)
+                yield path
+
+        output = tmp_path / 'output'
+        output.mkdir()
+        memory = Memory()
+        manipulate(
+            Files(source_paths()),
+            [],
+            FanOut([Branch([], memory), Branch([Upper()], FilesDestination(output))]),
+        )
+        compare(reads, expected=paths)
+        compare((output / paths[0]).read_text(), expected='TEXT 0')
+        compare(len(memory.elements), expected=9)
+
+    def test_backpressure(self) -> None:
+        release = Event()
+        produced = []
+        observed = []
+
+        class Slow:
+            def handle(self, elements: Iterable[Element[Any]]) -> None:
+                release.wait()
+                for _ in elements:
+                    pass
+
+        def elements() -> Iterable[Element[Any]]:
+            for i in range(BATCH_SIZE * 100):
+                produced.append(i)
+                yield Text(str(i))
+
+        def release_later() -> None:
+            sleep(0.1)
+            observed.append(len(produced))
+            release.set()
+
+        thread = Thread(target=release_later)
+        thread.start()
+        FanOut([Branch([], Slow()), Branch([], Memory())], max_pending=BATCH_SIZE * 2).handle(
+            elements()
+        )
+        thread.join()
+        # the slow branch held up the source:
+        assert observed[0] <= BATCH_SIZE * 4, observed
+        compare(len(produced), expected=BATCH_SIZE * 100)
+
+    def test_branch_error(self) -> None:
+        expected = Exception('boom!')
+        expected.add_note("Performing Fail() on Text('0')")
+        with ShouldRaise(expected):
+            manipulate(
+                Source(*[Text(str(i)) for i in range(BATCH_SIZE * 10)]),
+                [],
+                FanOut([Branch([Fail()], Memory()), Branch([], Memory())], max_pending=100),
+            )
+
+    def test_branch_stops_early(self) -> None:
+        first = First()
+        memory = Memory()
+        texts = [Text(str(i)) for i in range(BATCH_SIZE * 10)]
+        FanOut([Branch([], first), Branch([], memory)], max_pending=100).handle(texts)
+        compare(first.elements, expected=[Text('0')])
+        compare(memory.elements, expected=texts)
+
+    def test_source_error_aborts_branches(self, tmp_path: Path) -> None:
+        def elements() -> Iterable[Element[Any]]:
+            file = File(tmp_path / 'out.txt')
+            yield Start(file)
+            yield Text('partial', parent=file)
+            raise Exception('source failed')
+
+        with ShouldRaise(Exception('source failed')):
+            FanOut([Branch([], FilesDestination(atomic=True))]).handle(elements())
+        compare(list(tmp_path.iterdir()), expected=[])
+
+    def test_blocks(self) -> None:
+        plain = Memory()
+        blocks = BlockMemory()
+        FanOut([Branch([Batch()], plain), Branch([Batch()], blocks)]).handle(
+            [Text('a'), Text('b')]
+        )
+        compare(plain.elements, expected=[Text('a'), Text('b')])
+        compare(blocks.elements, expected=[Block.of([Text('a'), Text('b')])])
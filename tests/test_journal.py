@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Any
+
+from pytest import MonkeyPatch
+from testfixtures import compare, ShouldRaise
+
+from manipulate import manipulate
+from manipulate.actions import Action
+from manipulate.destinations import Files as FilesDestination, Memory as Destination
+from manipulate.elements import Element, Text, Start, End, File
+from manipulate.journal import Journal
+from manipulate.sources import Files, Memory as Source
+
+from .helpers import Upper
+
+
+@dataclass
+class FailOn:
+    value: str
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            if isinstance(element, Text) and element.value == self.value:
+                raise Exception('boom!')
+            yield element
+
+
+class TestJournal:
+
+    def test_empty(self, tmp_path: Path) -> None:
+        journal = Journal(tmp_path / 'journal', [Upper()])
+        compare(journal.completed, expected=set())
+        compare(journal.pending(Path('a.txt')), expected=True)
+
+    def test_record_and_reload(self, tmp_path: Path) -> None:
+        journal = Journal(tmp_path / 'journal', [Upper()])
+        journal.record(Path('a.txt'))
+        compare(journal.pending(Path('a.txt')), expected=False)
+        compare(
+            Journal(tmp_path / 'journal', [Upper()]).completed, expected={'a.txt'}
+        )
+        journal.record(Path('b.txt'))
+        journal.close()
+        compare(
+            Journal(tmp_path / 'journal', [Upper()]).completed, expected={'a.txt', 'b.txt'}
+        )
+
+    def test_different_actions(self, tmp_path: Path) -> None:
+        journal = Journal(tmp_path / 'journal', [Upper()])
+        journal.record(Path('a.txt'))
+        journal.close()
+        journal = Journal(tmp_path / 'journal', [Upper(), Upper()])
+        compare(journal.completed, expected=set())
+        journal.record(Path('b.txt'))
+        journal.close()
+        compare(
+            Journal(tmp_path / 'journal', [Upper(), Upper()]).completed, expected={'b.txt'}
+        )
+
+    def test_partial_entry(self, tmp_path: Path) -> None:
+        journal = Journal(tmp_path / 'journal', [Upper()])
+        journal.record(Path('a.txt'))
+        journal.close()
+        with (tmp_path / 'journal').open('a') as stream:
+            stream.write('"b.t')
+        journal = Journal(tmp_path / 'journal', [Upper()])
+        compare(journal.completed, expected={'a.txt'})
+        journal.record(Path('c.txt'))
+        journal.close()
+        compare(
+            Journal(tmp_path / 'journal', [Upper()]).completed, expected={'a.txt', 'c.txt'}
+        )
+
+    def test_not_a_journal(self, tmp_path: Path) -> None:
+        (tmp_path / 'journal').write_text('junk')
+        compare(Journal(tmp_path / 'journal', [Upper()]).completed, expected=set())
+
+    def test_remove(self, tmp_path: Path) -> None:
+        journal = Journal(tmp_path / 'journal', [Upper()])
+        journal.record(Path('a.txt'))
+        journal.remove()
+        compare(list(tmp_path.iterdir()), expected=[])
+        compare(journal.completed, expected=set())
+
+    def test_track(self, tmp_path: Path) -> None:
+        journal = Journal(tmp_path / 'journal', [])
+        outer = File(Path('outer.zip'))
+        inner = File(Path('inner.txt'))
+        tracked = journal.track([Start(outer), Start(inner), End(inner), End(outer), Text('x')])
+        compare([next(tracked) for _ in range(4)][-1], expected=End(outer))
+        # not recorded until the destination asks for the next element:
+        compare(journal.completed, expected=set())
+        compare(next(tracked), expected=Text('x'))
+        compare(journal.completed, expected={'outer.zip'})
+
+
+class TestManipulate:
+
+    def test_resume(self, tmp_path: Path, monkeypatch: MonkeyPatch) -> None:
+        monkeypatch.chdir(tmp_path)
+        output = tmp_path / 'output'
+        (output / 'source').mkdir(parents=True)
+        Path('source').mkdir()
+        paths = [Path('source', f'{name}.txt') for name in 'abc']
+        for path in paths:
+            path.write_text(path.stem)
+        journal_path = tmp_path / 'journal'
+        actions: list[Action] = [FailOn('c'), Upper()]
+
+        expected = Exception('boom!')
+        expected.add_note(
+            f"Performing FailOn(value='c') on {File(paths[2])} -> Text('c') at line 1, column 1"
+        )
+        with ShouldRaise(expected):
+            manipulate(
+                Files(paths), actions, FilesDestination(output),
+                journal=Journal(journal_path, actions),
+            )
+        compare(Journal(journal_path, actions).completed, expected={'source/a.txt', 'source/b.txt'})
+
+        # completed files are not read again:
+        paths[0].unlink()
+        paths[2].write_text('d')
+        manipulate(
+            Files(paths), actions, FilesDestination(output),
+            journal=Journal(journal_path, actions),
+        )
+        compare((output / paths[1]).read_text(), expected='B')
+        compare((output / paths[2]).read_text(), expected='D')
+        compare(journal_path.exists(), expected=False)
+
+    def test_source_without_where(self, tmp_path: Path) -> None:
+        journal = Journal(tmp_path / 'journal', [])
+        journal.record(Path('a.txt'))
+        journal.close()
+        a = File(Path('a.txt'))
+        b = File(Path('b.txt'))
+        dest = Destination()
+        manipulate(
+            Source(Start(a), Text('a', parent=a), End(a), Start(b), End(b)),
+            [],
+            dest,
+            journal=Journal(tmp_path / 'journal', []),
+        )
+        compare(dest.elements, expected=[Start(b), End(b)])
+
+    def test_different_actions(self, tmp_path: Path) -> None:
+        journal = Journal(tmp_path / 'journal', [])
+        with ShouldRaise(ValueError(f'{journal.path} is a journal for different actions')):
+            manipulate(Source(), [Upper()], Destination(), journal=journal)
@@ -1,13 +1,24 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Iterable, Any
+from itertools import filterfalse
+from pathlib import Path
+from typing import Iterable, Any, AsyncIterator, AsyncIterable
 
 import pytest
 from testfixtures import compare, ShouldRaise
 
-from manipulate import manipulate
-from manipulate.destinations import Memory as Destination
-from manipulate.elements import Element, Text
-from manipulate.sources import Memory as Source
+from manipulate import manipulate, manipulate_async, Tracker
+from manipulate.actions import Container, Transform, Batch, Classify, Select
+from manipulate.destinations import (
+    Memory as Destination, Files as FileDestination, AsyncFiles as AsyncFileDestination
+)
+from manipulate.elements import Element, Text, Start, End, File, Block
+from manipulate.sources import (
+    Memory as Source, Files as FileSource, AsyncFiles as AsyncFileSource
+)
+
+from .helpers import files
 
 
 def test_no_actions() -> None:
@@ -75,3 +86,485 @@ def test_exception_in_action(
             [Parse('first', parse1_bad_value), Parse('second', parse2_bad_value)],
             Destination(),
         )
+
+
+@dataclass
+class Double:
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            match element:
+                case Text(value, parent, line, column):
+                    yield Text(value * 2, parent, line, column)
+                case _:
+                    yield element
+
+
+@dataclass
+class Fail:
+    bad_value: str
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            match element:
+                case Text(self.bad_value):
+                    raise Exception('boom!')
+                case _:
+                    yield element
+
+
+@dataclass
+class Record:
+    """
+    Record the elements received, which may include blocks.
+    """
+
+    blocks: bool = False
+
+    def __post_init__(self) -> None:
+        self.elements: list[Element[Any]] = []
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            self.elements.append(element)
+            yield element
+
+
+class BlockDestination(Destination):
+    blocks = True
+
+
+def passthrough(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+    yield from elements
+
+
+class TestPushdown:
+
+    @staticmethod
+    def paths(tmp_path: Path) -> tuple[Path, Path]:
+        wanted = tmp_path / 'wanted.txt'
+        wanted.write_text('text')
+        # reading this would fail:
+        return wanted, tmp_path / 'unwanted.txt'
+
+    @staticmethod
+    def wanted(path: Path) -> bool:
+        return path.name == 'wanted.txt'
+
+    def test_pushed_into_source(self, tmp_path: Path) -> None:
+        wanted, unwanted = self.paths(tmp_path)
+        dest = Destination()
+        manipulate(FileSource([unwanted, wanted]), [Select(self.wanted)], dest)
+        file = File(wanted)
+        compare(
+            dest.elements,
+            expected=[Start(file), Text('text', parent=file, line=1, column=1), End(file)],
+        )
+
+    def test_through_container_and_classify(self, tmp_path: Path) -> None:
+        wanted, unwanted = self.paths(tmp_path)
+        dest = Destination()
+        manipulate(
+            FileSource([unwanted, wanted]),
+            [Container(File), Classify({'.txt': Text}), Select(self.wanted)],
+            dest,
+        )
+        compare(len(dest.elements), expected=3)
+
+    def test_not_past_other_actions(self, tmp_path: Path) -> None:
+        wanted, unwanted = self.paths(tmp_path)
+        with ShouldRaise(FileNotFoundError):
+            manipulate(
+                FileSource([unwanted, wanted]), [passthrough, Select(self.wanted)], Destination()
+            )
+
+    def test_parallel(self, tmp_path: Path) -> None:
+        wanted, unwanted = self.paths(tmp_path)
+        dest = Destination()
+        with ThreadPoolExecutor() as executor:
+            manipulate(
+                FileSource([unwanted, wanted]), [Select(self.wanted)], dest, executor=executor
+            )
+        compare(len(dest.elements), expected=3)
+
+    def test_source_without_where(self) -> None:
+        unwanted = File(Path('unwanted.txt'))
+        dest = Destination()
+        manipulate(
+            Source(Start(unwanted), Text('text', parent=unwanted), End(unwanted), Text('other')),
+            [Select(self.wanted)],
+            dest,
+        )
+        compare(dest.elements, expected=[Text('other')])
+
+
+class TestBlocks:
+
+    def test_source_blocks_unbatched_for_action(self, tmp_path: Path) -> None:
+        path = tmp_path / 'test.txt'
+        path.write_text('a\nb\n')
+        record = Record()
+        dest = Destination()
+        manipulate(FileSource([path], chunk_size=2, block_size=10), [record], dest)
+        file = File(path)
+        expected = [Start(file), Text('a\n', file, 1, 1), Text('b\n', file, 2, 1), End(file)]
+        compare(record.elements, expected=expected)
+        compare(dest.elements, expected=expected)
+
+    def test_block_action(self) -> None:
+        record = Record(blocks=True)
+        dest = Destination()
+        manipulate(Source(Text('a'), Text('b')), [Batch(), record, Double()], dest)
+        compare(record.elements, expected=[Block.of([Text('a'), Text('b')])])
+        compare(dest.elements, expected=[Text('aa'), Text('bb')])
+
+    def test_blocks_unbatched_for_destination(self) -> None:
+        dest = Destination()
+        manipulate(Source(Text('a'), Text('b')), [Batch()], dest)
+        compare(dest.elements, expected=[Text('a'), Text('b')])
+
+    def test_block_destination(self) -> None:
+        dest = BlockDestination()
+        manipulate(Source(Text('a'), Text('b')), [Batch()], dest)
+        compare(dest.elements, expected=[Block.of([Text('a'), Text('b')])])
+
+    def test_parallel(self) -> None:
+        dest = Destination()
+        with ThreadPoolExecutor(2) as executor:
+            manipulate(Source(*files('a', 'b')), [Batch()], dest, executor=executor)
+        compare(dest.elements, expected=files('a', 'b'))
+
+    def test_async(self) -> None:
+        dest = AsyncDestination()
+        asyncio.run(manipulate_async(AsyncSource(Text('a'), Text('b')), [Batch()], dest))
+        compare(dest.elements, expected=[Text('a'), Text('b')])
+
+
+class TestParallel:
+
+    def test_process_pool(self) -> None:
+        dest = Destination()
+        with ProcessPoolExecutor(2) as executor:
+            manipulate(Source(*files('a', 'b', 'c')), [Double()], dest, executor=executor)
+        compare(
+            dest.elements,
+            expected=[
+                Start(File(Path('a'))), Text('aa', parent=File(Path('a'))), End(File(Path('a'))),
+                Start(File(Path('b'))), Text('bb', parent=File(Path('b'))), End(File(Path('b'))),
+                Start(File(Path('c'))), Text('cc', parent=File(Path('c'))), End(File(Path('c'))),
+            ],
+        )
+
+    def test_results_preserve_identity(self, tmp_path: Path) -> None:
+        (tmp_path / 'a').write_text('a')
+        (tmp_path / 'b').write_text('b')
+        with ProcessPoolExecutor(2) as executor:
+            manipulate(
+                FileSource([tmp_path / 'a', tmp_path / 'b']),
+                [Double()],
+                FileDestination(),
+                executor=executor,
+            )
+        compare((tmp_path / 'a').read_text(), expected='aa')
+        compare((tmp_path / 'b').read_text(), expected='bb')
+
+    def test_unordered(self) -> None:
+        dest = Destination()
+        with ThreadPoolExecutor(4) as executor:
+            manipulate(
+                Source(*files(*'abcdefgh'), Text('outside')),
+                [Double()],
+                dest,
+                executor=executor,
+                ordered=False,
+                max_pending=3,
+            )
+        compare(
+            sorted(e.value for e in dest.elements if isinstance(e, Text)),
+            expected=['aa', 'bb', 'cc', 'dd', 'ee', 'ff', 'gg', 'hh', 'outsideoutside'],
+        )
+        compare(len(dest.elements), expected=25)
+
+    def test_ordered_bounded(self) -> None:
+        dest = Destination()
+        with ThreadPoolExecutor(4) as executor:
+            manipulate(
+                Source(Text('x'), *files(*'abcdefgh')),
+                [Double()],
+                dest,
+                executor=executor,
+                max_pending=2,
+            )
+        compare(
+            [e.value for e in dest.elements if isinstance(e, Text)],
+            expected=['xx', 'aa', 'bb', 'cc', 'dd', 'ee', 'ff', 'gg', 'hh'],
+        )
+
+    @pytest.mark.parametrize('ordered', [True, False])
+    def test_max_pending_not_positive(self, ordered: bool) -> None:
+        with ShouldRaise(ValueError('max_pending must be at least 1, not 0')):
+            with ThreadPoolExecutor() as executor:
+                manipulate(
+                    Source(Text('a')), [], Destination(),
+                    executor=executor, ordered=ordered, max_pending=0,
+                )
+
+    def test_exception_note(self) -> None:
+        file = File(Path('b'))
+        expected = Exception('boom!')
+        expected.add_note(f"Performing Fail(bad_value='bb') on {file} -> Text('bb')")
+        with ProcessPoolExecutor(2) as executor:
+            with ShouldRaise(expected):
+                manipulate(
+                    Source(*files('a', 'b', 'c')),
+                    [Double(), Fail('bb')],
+                    Destination(),
+                    executor=executor,
+                )
+
+
+class AsyncSource:
+    def __init__(self, *elements: Element[Any]) -> None:
+        self._elements = elements
+
+    async def elements(self) -> AsyncIterator[Element[Any]]:
+        for element in self._elements:
+            yield element
+
+
+class AsyncDestination:
+    elements: list[Element[Any]]
+
+    async def handle(self, elements: AsyncIterable[Element[Any]]) -> None:
+        self.elements = [element async for element in elements]
+
+
+@dataclass
+class AsyncUpper:
+
+    async def __call__(self, elements: AsyncIterable[Element[Any]]) -> AsyncIterator[Element[Any]]:
+        async for element in elements:
+            match element:
+                case Text(value, parent, line, column):
+                    yield Text(value.upper(), parent, line, column)
+                case _:
+                    yield element
+
+
+class TestAsync:
+
+    def test_no_actions(self) -> None:
+        dest = AsyncDestination()
+        asyncio.run(manipulate_async(AsyncSource(Text('a'), Text('b')), [], dest))
+        compare(dest.elements, expected=[Text('a'), Text('b')])
+
+    def test_sync_actions(self) -> None:
+        dest = AsyncDestination()
+        asyncio.run(
+            manipulate_async(AsyncSource(*files('a', 'b')), [Double(), Double()], dest)
+        )
+        compare(
+            [e.value for e in dest.elements if isinstance(e, Text)],
+            expected=['aaaa', 'bbbb'],
+        )
+
+    def test_mixed_actions(self) -> None:
+        dest = AsyncDestination()
+        asyncio.run(
+            manipulate_async(
+                AsyncSource(*[Text(c) for c in 'abcdef']),
+                [Double(), AsyncUpper(), Double()],
+                dest,
+                max_pending=2,
+            )
+        )
+        compare(
+            [e.value for e in dest.elements],
+            expected=['AAAA', 'BBBB', 'CCCC', 'DDDD', 'EEEE', 'FFFF'],
+        )
+
+    def test_async_generator_function(self) -> None:
+        async def drop_b(elements: AsyncIterable[Element[Any]]) -> AsyncIterator[Element[Any]]:
+            async for element in elements:
+                if element.value != 'b':
+                    yield element
+
+        dest = AsyncDestination()
+        asyncio.run(manipulate_async(AsyncSource(Text('a'), Text('b')), [drop_b], dest))
+        compare(dest.elements, expected=[Text('a')])
+
+    def test_exception_in_sync_action(self) -> None:
+        file = File(Path('b'))
+        expected = Exception('boom!')
+        expected.add_note(f"Performing Fail(bad_value='B') on {file} -> Text('B')")
+        with ShouldRaise(expected):
+            asyncio.run(
+                manipulate_async(
+                    AsyncSource(*files('a', 'b', 'c')),
+                    [AsyncUpper(), Fail('B')],
+                    AsyncDestination(),
+                )
+            )
+
+    def test_exception_in_async_action(self) -> None:
+        async def fail(elements: AsyncIterable[Element[Any]]) -> AsyncIterator[Element[Any]]:
+            async for element in elements:
+                if element.value == 'bb':
+                    raise Exception('boom!')
+                yield element
+
+        expected = Exception('boom!')
+        expected.add_note(f"Performing {fail} on Text('bb')")
+        with ShouldRaise(expected):
+            asyncio.run(
+                manipulate_async(
+                    AsyncSource(Text('a'), Text('b')), [Double(), fail], AsyncDestination()
+                )
+            )
+
+    def test_destination_stops_early(self) -> None:
+        class First:
+            elements: list[Element[Any]]
+
+            async def handle(self, elements: AsyncIterable[Element[Any]]) -> None:
+                async for element in elements:
+                    raise ValueError(element.value)
+
+        with ShouldRaise(ValueError('aa')):
+            asyncio.run(
+                manipulate_async(
+                    AsyncSource(*[Text(c) for c in 'abcdef']), [Double()], First(), max_pending=1
+                )
+            )
+
+    def test_files(self, tmp_path: Path) -> None:
+        paths = [tmp_path / f'{i}.txt' for i in range(20)]
+        for path in paths:
+            path.write_text(path.name)
+        asyncio.run(
+            manipulate_async(
+                AsyncFileSource(paths, concurrency=3),
+                [Double()],
+                AsyncFileDestination(concurrency=3),
+            )
+        )
+        compare([path.read_text() for path in paths], expected=[p.name * 2 for p in paths])
+
+
+class TestTracker:
+
+    def test_no_generator_per_action(self) -> None:
+        tracker = Tracker()
+        compare(type(tracker.before(Double(), [Text('a')])), expected=filterfalse)
+
+    def test_same_action_repeated(self) -> None:
+        def fail_on_doubled(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+            for element in elements:
+                if element.value == 'aaaa':
+                    raise Exception('boom!')
+                yield element
+
+        double = Double()
+        expected = Exception('boom!')
+        expected.add_note(f"Performing {fail_on_doubled} on Text('aaaa')")
+        with ShouldRaise(expected):
+            manipulate(Source(Text('a')), [double, double, fail_on_doubled, double], Destination())
+
+    def test_not_a_generator(self) -> None:
+        def to_int(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+            return map(lambda e: Element(int(e.value)), elements)
+
+        expected = ValueError("invalid literal for int() with base 10: 'bb'")
+        expected.add_note(f"Performing {to_int} on Text('bb')")
+        with ShouldRaise(expected):
+            manipulate(Source(Text('1'), Text('b')), [Double(), to_int], Destination())
+
+    def test_not_a_generator_between_generators(self) -> None:
+        def to_int(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+            return map(lambda e: Element(int(e.value)), elements)
+
+        expected = ValueError("invalid literal for int() with base 10: 'b'")
+        expected.add_note(f"Performing {to_int} on Text('b')")
+        with ShouldRaise(expected):
+            manipulate(
+                Source(Text('1'), Text('b'), Text('3')),
+                [passthrough, to_int, Record()],
+                Destination(),
+            )
+
+    def test_generator_after_not_a_generator_fails(self) -> None:
+        def wrap(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+            return map(lambda e: Text(e.value, parent=e), elements)
+
+        fail = Fail(bad_value='b')
+        expected = Exception('boom!')
+        expected.add_note(f"Performing {fail} on Text('b') -> Text('b')")
+        with ShouldRaise(expected):
+            manipulate(
+                Source(Text('a'), Text('b'), Text('c')), [passthrough, wrap, fail], Destination()
+            )
+
+    def test_list_between_generators(self) -> None:
+        def to_list(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+            return list(elements)
+
+        fail = Fail(bad_value='b')
+        expected = Exception('boom!')
+        expected.add_note(f"Performing {fail} on Text('b')")
+        with ShouldRaise(expected):
+            manipulate(
+                Source(Text('a'), Text('b')), [passthrough, to_list, fail], Destination()
+            )
+
+    def test_list_fails(self) -> None:
+        def to_ints(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+            return [Element(int(e.value)) for e in elements]
+
+        expected = ValueError("invalid literal for int() with base 10: 'b'")
+        expected.add_note(f"Performing {to_ints} on Text('b')")
+        with ShouldRaise(expected):
+            manipulate(
+                Source(Text('1'), Text('b')), [passthrough, to_ints, Record()], Destination()
+            )
+
+    def test_exception_in_source(self) -> None:
+        class BadSource:
+            def elements(self) -> Iterable[Element[Any]]:
+                yield Text('a')
+                raise Exception('boom!')
+
+        expected = Exception('boom!')
+        expected.add_note("Performing Double() on Text('a')")
+        with ShouldRaise(expected):
+            manipulate(BadSource(), [Double()], Destination())
+
+    def test_fused_transform_fails(self) -> None:
+        @dataclass
+        class Parse(Transform):
+            def transform(self, element: Element[Any]) -> Element[Any] | None:
+                match element:
+                    case Text(value):
+                        return Element(int(value), parent=element)
+                return element
+
+        file = File(Path('a.txt'))
+        expected = ValueError("invalid literal for int() with base 10: 'x'")
+        expected.add_note(
+            "Performing TestTracker.test_fused_transform_fails.<locals>.Parse() on "
+            "File(PosixPath('a.txt')) -> Text('x')"
+        )
+        with ShouldRaise(expected):
+            manipulate(
+                Source(Start(file), Text('1', parent=file), Text('x', parent=file), End(file)),
+                [Container(File), Parse(), Container(File)],
+                Destination(),
+            )
+
+    def test_exception_in_source_before_any_element(self) -> None:
+        class BadSource:
+            def elements(self) -> Iterable[Element[Any]]:
+                raise Exception('boom!')
+                yield
+
+        with ShouldRaise(Exception('boom!')):
+            manipulate(BadSource(), [Double()], Destination())
@@ -0,0 +1,124 @@
+from testfixtures import compare
+
+from manipulate.patterns import translate, parse, ignored, matched, Rule
+
+
+class TestTranslate:
+
+    def test_star(self) -> None:
+        compare(translate('*.py'), expected=r'[^/]*\.py')
+
+    def test_question_mark(self) -> None:
+        compare(translate('a?c'), expected='a[^/]c')
+
+    def test_double_star_leading(self) -> None:
+        compare(translate('**/foo'), expected='(?:.*/)?foo')
+
+    def test_double_star_trailing(self) -> None:
+        compare(translate('foo/**'), expected='foo/.*')
+
+    def test_double_star_middle(self) -> None:
+        compare(translate('a/**/b'), expected='a/(?:.*/)?b')
+
+    def test_class(self) -> None:
+        compare(translate('[abc].txt'), expected=r'[abc]\.txt')
+
+    def test_negated_class(self) -> None:
+        compare(translate('[!abc]'), expected='[^abc]')
+
+    def test_unclosed_class(self) -> None:
+        compare(translate('[a'), expected=r'\[a')
+
+    def test_escape(self) -> None:
+        compare(translate(r'\*'), expected=r'\*')
+
+
+class TestRule:
+
+    def test_blank(self) -> None:
+        compare(Rule.parse('\n'), expected=None)
+
+    def test_comment(self) -> None:
+        compare(Rule.parse('# comment'), expected=None)
+
+    def test_unanchored(self) -> None:
+        rule = Rule.parse('*.pyc')
+        assert rule is not None
+        assert rule.matches('foo.pyc')
+        assert rule.matches('a/b/foo.pyc')
+        assert not rule.matches('foo.py')
+
+    def test_anchored(self) -> None:
+        rule = Rule.parse('/build')
+        assert rule is not None
+        assert rule.matches('build')
+        assert not rule.matches('a/build')
+
+    def test_with_slash(self) -> None:
+        rule = Rule.parse('doc/*.txt')
+        assert rule is not None
+        assert rule.matches('doc/a.txt')
+        assert not rule.matches('doc/a/b.txt')
+        assert not rule.matches('x/doc/a.txt')
+
+    def test_directory_only(self) -> None:
+        rule = Rule.parse('build/')
+        assert rule is not None
+        assert rule.matches('build', directory=True)
+        assert rule.matches('a/build', directory=True)
+        assert not rule.matches('build')
+
+    def test_base(self) -> None:
+        rule = Rule.parse('/out', base='sub')
+        assert rule is not None
+        assert rule.matches('sub/out')
+        assert not rule.matches('out')
+        assert not rule.matches('other/out')
+
+    def test_trailing_spaces(self) -> None:
+        rule = Rule.parse('foo  \n')
+        assert rule is not None
+        assert rule.matches('foo')
+
+    def test_escaped_trailing_space(self) -> None:
+        rule = Rule.parse('foo\\ ')
+        assert rule is not None
+        assert rule.matches('foo ')
+        assert not rule.matches('foo')
+
+    def test_escaped_hash(self) -> None:
+        rule = Rule.parse('\\#foo')
+        assert rule is not None
+        assert rule.matches('#foo')
+
+
+class TestIgnored:
+
+    def test_no_rules(self) -> None:
+        assert not ignored((), 'foo')
+
+    def test_last_match_wins(self) -> None:
+        rules = parse(['*.log', '!keep.log'])
+        assert ignored(rules, 'debug.log')
+        assert not ignored(rules, 'keep.log')
+        assert not ignored(rules, 'foo.txt')
+
+    def test_negation_then_ignore(self) -> None:
+        rules = parse(['!keep.log', '*.log'])
+        assert ignored(rules, 'keep.log')
+
+
+class TestMatched:
+
+    def test_no_match(self) -> None:
+        compare(matched(parse(['*.log']), 'foo.txt'), expected=None)
+
+    def test_last_match_wins(self) -> None:
+        rules = parse(['*.log', '!keep.log'])
+        compare(matched(rules, 'debug.log'), expected=True)
+        compare(matched(rules, 'keep.log'), expected=False)
+
+    def test_directory(self) -> None:
+        rules = parse(['src/'])
+        compare(matched(rules, 'src'), expected=None)
+        compare(matched(rules, 'src', directory=True), expected=True)
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from testfixtures import compare
+
+from manipulate._pipeline import spans
+from manipulate.elements import Text, Start, End, File
+
+
+class TestSpans:
+
+    def test_files_and_outside(self) -> None:
+        a = File(Path('a'))
+        inner = File(Path('inner'))
+        compare(
+            list(spans([
+                Text('x'),
+                Start(a), Start(inner), End(inner), Text('y', parent=a), End(a),
+                Text('z'),
+            ])),
+            expected=[
+                [Text('x')],
+                [Start(a), Start(inner), End(inner), Text('y', parent=a), End(a)],
+                [Text('z')],
+            ],
+        )
+
+    def test_unterminated(self) -> None:
+        a = File(Path('a'))
+        compare(list(spans([Start(a), Text('y')])), expected=[[Start(a), Text('y')]])
@@ -0,0 +1,170 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from time import sleep
+from typing import Iterable, Any
+
+from testfixtures import compare, ShouldRaise
+
+from manipulate import manipulate
+from manipulate.actions import Fused, Transform
+from manipulate.destinations import Memory as Destination
+from manipulate.elements import Element, Text, File
+from manipulate.profile import Profile, Report, ActionProfile, FileProfile
+from manipulate.sources import Memory as Source
+
+from .helpers import files
+
+
+class Up(Transform):
+
+    def transform(self, element: Element[Any]) -> Element[Any]:
+        match element:
+            case Text(value, parent, line, column):
+                return Text(value.upper(), parent, line, column)
+        return element
+
+    def __repr__(self) -> str:
+        return 'Up()'
+
+
+class Bad(Transform):
+
+    def transform(self, element: Element[Any]) -> Element[Any]:
+        if element == Text('B', parent=element.parent):
+            raise Exception('boom!')
+        return element
+
+    def __repr__(self) -> str:
+        return 'Bad()'
+
+
+@dataclass
+class Slow:
+    seconds: float
+    drop: bool = False
+
+    def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+        for element in elements:
+            if isinstance(element, Text):
+                sleep(self.seconds)
+                if self.drop:
+                    continue
+            yield element
+
+
+class TestProfile:
+
+    def test_report(self) -> None:
+        fast = Slow(0)
+        slow = Slow(0.02)
+        reports: list[Report] = []
+        profile = Profile(callback=reports.append)
+        manipulate(
+            Source(*files('a', 'b')),
+            [fast, slow, Slow(0, drop=True)],
+            Destination(),
+            tracker=profile,
+        )
+        report = profile.report
+        assert report is not None
+        compare(reports, expected=[report])
+        compare(
+            [(p.action, p.elements_in, p.elements_out) for p in report.actions],
+            expected=[(fast, 6, 6), (slow, 6, 6), (Slow(0, drop=True), 6, 4)],
+        )
+        fast_profile, slow_profile, _ = report.actions
+        assert slow_profile.seconds >= 0.04, slow_profile
+        assert fast_profile.seconds < 0.02, fast_profile
+        assert report.source_seconds < 0.02, report.source_seconds
+
+    def test_slowest_files(self) -> None:
+        @dataclass
+        class SlowFile:
+            name: str
+
+            def __call__(self, elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+                for element in elements:
+                    match element:
+                        case Text(self.name):
+                            sleep(0.02)
+                    yield element
+
+        profile = Profile(slowest=2)
+        manipulate(
+            Source(Text('outside'), *files('a', 'b', 'c')),
+            [SlowFile('b')],
+            Destination(),
+            tracker=profile,
+        )
+        assert profile.report is not None
+        compare([f.path for f in profile.report.files][0], expected=Path('b'))
+        compare(len(profile.report.files), expected=2)
+        assert profile.report.files[0].seconds >= 0.02
+
+    def test_no_actions(self) -> None:
+        profile = Profile()
+        dest = Destination()
+        manipulate(Source(Text('a')), [], dest, tracker=profile)
+        compare(dest.elements, expected=[Text('a')])
+        assert profile.report is not None
+        compare(profile.report.actions, expected=[])
+
+    def test_exception_note_and_report(self) -> None:
+        def fail(elements: Iterable[Element[Any]]) -> Iterable[Element[Any]]:
+            for element in elements:
+                raise Exception('boom!')
+                yield element
+
+        expected = Exception('boom!')
+        expected.add_note(f"Performing {fail} on Text('a')")
+        profile = Profile()
+        with ShouldRaise(expected):
+            manipulate(Source(Text('a')), [fail], Destination(), tracker=profile)
+        assert profile.report is not None
+        compare(profile.report.actions[0].elements_in, expected=1)
+
+    def test_transforms_not_fused(self) -> None:
+        up = Up()
+        bad = Bad()
+        expected = Exception('boom!')
+        expected.add_note(f"Performing Bad() on {File(Path('b'))} -> Text('B')")
+        profile = Profile()
+        with ShouldRaise(expected):
+            manipulate(Source(*files('a', 'b')), [up, bad], Destination(), tracker=profile)
+        assert profile.report is not None
+        compare(
+            [(p.action, p.elements_in, p.elements_out) for p in profile.report.actions],
+            expected=[(up, 5, 5), (bad, 5, 4)],
+        )
+
+    def test_explicitly_fused(self) -> None:
+        expected = Exception('boom!')
+        expected.add_note(f"Performing Bad() on {File(Path('b'))} -> Text('B')")
+        with ShouldRaise(expected):
+            manipulate(
+                Source(*files('a', 'b')), [Fused([Up(), Bad()])], Destination(), tracker=Profile()
+            )
+
+    def test_not_with_executor(self) -> None:
+        with ThreadPoolExecutor() as executor:
+            with ShouldRaise(TypeError('a tracker cannot be used with an executor')):
+                manipulate(Source(), [], Destination(), executor=executor, tracker=Profile())
+
+    def test_str(self) -> None:
+        report = Report(
+            source_seconds=0.5,
+            actions=[ActionProfile(Slow(0), 1.25, 10, 5)],
+            files=[FileProfile(Path('a.txt'), 1.5)],
+        )
+        compare(
+            str(report),
+            expected=(
+                '   seconds         in        out  action\n'
+                '     0.500                        (source)\n'
+                '     1.250         10          5  Slow(seconds=0, drop=False)\n'
+                '\n'
+                '   seconds  file\n'
+                '     1.500  a.txt'
+            ),
+        )
@@ -1,12 +1,20 @@
+import asyncio
 import sys
 from io import StringIO
 from pathlib import Path
 from subprocess import run
+from typing import Any, Iterator
 
-from testfixtures import compare, generator
+import pytest
+from testfixtures import compare, generator, ShouldRaise
 
-from manipulate.elements import Start, File, Text, End
-from manipulate.sources import Files, Stream
+from manipulate import manipulate
+from manipulate.actions import Classify
+from manipulate.destinations import (
+    Files as FilesDestination, BinaryFiles, Checkpoint as CheckpointDestination
+)
+from manipulate.elements import Start, File, Text, End, Bytes, Element, Block
+from manipulate.sources import Files, Stream, MappedFiles, AsyncFiles, Tree, Checkpoint
 
 
 class TestFiles:
@@ -24,11 +32,285 @@ class TestFiles:
             ),
         )
 
+    def test_chunked(self, tmp_path: Path) -> None:
+        path = tmp_path / 'test.txt'
+        path.write_text('line 1\nline 2\nline 3\n')
+        file = File(path)
+        compare(
+            Files([path], chunk_size=14).elements(),
+            expected=generator(
+                Start(file),
+                Text('line 1\nline 2\n', parent=file, line=1, column=1),
+                Text('line 3\n', parent=file, line=3, column=1),
+                End(file),
+            ),
+        )
+
+    def test_chunked_long_line(self, tmp_path: Path) -> None:
+        path = tmp_path / 'test.txt'
+        path.write_text('ab\ncdefgh\ni')
+        file = File(path)
+        compare(
+            Files([path], chunk_size=4).elements(),
+            expected=generator(
+                Start(file),
+                Text('ab\n', parent=file, line=1, column=1),
+                Text('cdef', parent=file, line=2, column=1),
+                Text('gh\ni', parent=file, line=2, column=5),
+                End(file),
+            ),
+        )
+
+    def test_chunked_empty(self, tmp_path: Path) -> None:
+        path = tmp_path / 'test.txt'
+        path.write_text('')
+        file = File(path)
+        compare(
+            Files([path], chunk_size=4).elements(),
+            expected=generator(Start(file), End(file)),
+        )
+
+    def test_chunked_round_trip(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        class SampleText(Text):
+            pass
+
+        content = ''.join(f'line {i}\n' for i in range(1000))
+        source = tmp_path / 'source'
+        source.mkdir()
+        (source / 'test.txt').write_text(content)
+        target = tmp_path / 'target'
+        target.mkdir()
+        monkeypatch.chdir(source)
+        files = Files([Path('test.txt')], chunk_size=100)
+        compare(len([e for e in files.elements() if isinstance(e, Text)]), expected=91)
+        manipulate(files, [Classify({'.txt': SampleText})], FilesDestination(target))
+        compare((target / 'test.txt').read_text(), expected=content)
+
+    def test_chunk_size_not_positive(self) -> None:
+        with ShouldRaise(ValueError('chunk_size must be positive, not 0')):
+            Files([Path('foo')], chunk_size=0)
+
+    def test_prefetch(self, tmp_path: Path) -> None:
+        paths = []
+        for i in range(20):
+            path = tmp_path / f'{i}.txt'
+            path.write_text(f'file {i}')
+            paths.append(path)
+        compare(
+            [e.value for e in Files(paths, prefetch=4).elements() if isinstance(e, Text)],
+            expected=[f'file {i}' for i in range(20)],
+        )
+
+    @staticmethod
+    def pulled(paths: list[Path], pulled: list[Path]) -> Iterator[Path]:
+        for path in paths:
+            pulled.append(path)
+            yield path
+
+    def test_prefetch_count(self, tmp_path: Path) -> None:
+        paths = [tmp_path / f'{i}.txt' for i in range(10)]
+        for path in paths:
+            path.write_text('x')
+        pulled: list[Path] = []
+        elements = iter(Files(self.pulled(paths, pulled), prefetch=3).elements())
+        compare(next(elements), expected=Start(File(paths[0])))
+        # the first file has been provided, so a fourth can be read ahead:
+        compare(pulled, expected=paths[:4])
+
+    def test_prefetch_bytes(self, tmp_path: Path) -> None:
+        paths = [tmp_path / f'{i}.txt' for i in range(10)]
+        for path in paths:
+            path.write_text('x' * 10)
+        pulled: list[Path] = []
+        elements = iter(
+            Files(self.pulled(paths, pulled), prefetch=5, prefetch_bytes=25).elements()
+        )
+        compare(next(elements), expected=Start(File(paths[0])))
+        compare(pulled, expected=paths[:4])
+
+    def test_prefetch_bytes_large_file(self, tmp_path: Path) -> None:
+        paths = [tmp_path / f'{i}.txt' for i in range(3)]
+        for path in paths:
+            path.write_text('x' * 100)
+        compare(
+            len(list(Files(paths, prefetch=2, prefetch_bytes=10).elements())),
+            expected=9,
+        )
+
+    def test_prefetch_error(self, tmp_path: Path) -> None:
+        present = tmp_path / 'present.txt'
+        present.write_text('x')
+        missing = tmp_path / 'missing.txt'
+        elements = iter(Files([present, missing], prefetch=2).elements())
+        compare(next(elements), expected=Start(File(present)))
+        compare(next(elements), expected=Text('x', parent=File(present), line=1, column=1))
+        compare(next(elements), expected=End(File(present)))
+        with ShouldRaise(FileNotFoundError):
+            next(elements)
+
+    def test_blocks(self, tmp_path: Path) -> None:
+        path = tmp_path / 'test.txt'
+        path.write_text('a\nb\nc\n')
+        file = File(path)
+        files = Files([path], chunk_size=2, block_size=2)
+        assert files.blocks
+        compare(
+            files.elements(),
+            expected=generator(
+                Start(file),
+                Block.of([Text('a\n', file, 1, 1), Text('b\n', file, 2, 1)]),
+                Block.of([Text('c\n', file, 3, 1)]),
+                End(file),
+            ),
+        )
+
+    def test_no_blocks(self) -> None:
+        assert not Files([Path('foo')]).blocks
+
+    def test_block_size_without_chunk_size(self) -> None:
+        with ShouldRaise(ValueError('block_size can only be used with chunk_size')):
+            Files([Path('foo')], block_size=2)
+
+    def test_block_size_not_positive(self) -> None:
+        with ShouldRaise(ValueError('block_size must be positive, not 0')):
+            Files([Path('foo')], chunk_size=2, block_size=0)
+
+    def test_prefetch_not_negative(self) -> None:
+        with ShouldRaise(ValueError('prefetch must not be negative, not -1')):
+            Files([Path('foo')], prefetch=-1)
+
+    def test_prefetch_with_chunk_size(self) -> None:
+        with ShouldRaise(ValueError('prefetch cannot be used with chunk_size')):
+            Files([Path('foo')], chunk_size=10, prefetch=2)
+
+    def test_prefetch_bytes_without_prefetch(self) -> None:
+        with ShouldRaise(ValueError('prefetch_bytes can only be used with prefetch')):
+            Files([Path('foo')], prefetch_bytes=100)
+
     def test_str(self) -> None:
         compare(str(Files([Path('foo')])), expected="Files")
 
     def test_repr(self) -> None:
-        compare(repr(Files([Path('foo')])), expected="Files(paths=[PosixPath('foo')])")
+        compare(
+            repr(Files([Path('foo')])),
+            expected=(
+                "Files(paths=[PosixPath('foo')], chunk_size=None, cache=None, "
+                "prefetch=0, prefetch_bytes=None, block_size=None, predicate=None)"
+            ),
+        )
+
+    def test_predicate(self, tmp_path: Path) -> None:
+        wanted = tmp_path / 'wanted.txt'
+        wanted.write_text('text')
+        # never read, so doesn't need to exist:
+        unwanted = tmp_path / 'unwanted.txt'
+        files = Files([unwanted, wanted], predicate=lambda path: path.name.startswith('w'))
+        compare(
+            files.elements(),
+            expected=generator(
+                Start(File(wanted)),
+                Text('text', parent=File(wanted), line=1, column=1),
+                End(File(wanted)),
+            ),
+        )
+
+    def test_where(self, tmp_path: Path) -> None:
+        paths = [tmp_path / name for name in ('a.txt', 'b.txt', 'a.py')]
+        for path in paths:
+            path.write_text(path.name)
+        files = Files(paths)
+        selected = files.where(lambda path: path.suffix == '.txt').where(
+            lambda path: path.stem == 'a'
+        )
+        compare(
+            [e.value for e in selected.elements() if isinstance(e, Text)],
+            expected=['a.txt'],
+        )
+        # the original is unchanged:
+        compare(files.predicate, expected=None)
+
+
+class TestAsyncFiles:
+
+    def test_order_preserved(self, tmp_path: Path) -> None:
+        paths = [tmp_path / f'{i}.txt' for i in range(10)]
+        for path in paths:
+            path.write_text(path.name)
+
+        async def collect() -> list[Element[Any]]:
+            return [e async for e in AsyncFiles(paths, concurrency=3).elements()]
+
+        expected: list[Element[Any]] = []
+        for path in paths:
+            file = File(path)
+            expected.extend((Start(file), Text(path.name, file, 1, 1), End(file)))
+        compare(asyncio.run(collect()), expected=expected)
+
+    def test_missing_file(self, tmp_path: Path) -> None:
+        path = tmp_path / 'missing.txt'
+
+        async def collect() -> list[Element[Any]]:
+            return [e async for e in AsyncFiles([path]).elements()]
+
+        with ShouldRaise(FileNotFoundError):
+            asyncio.run(collect())
+
+    def test_no_concurrency(self) -> None:
+        with ShouldRaise(ValueError('concurrency must be at least 1, not 0')):
+            AsyncFiles([Path('foo')], concurrency=0)
+
+    def test_str(self) -> None:
+        compare(str(AsyncFiles([Path('foo')])), expected="AsyncFiles")
+
+
+class TestMappedFiles:
+
+    def test_one(self, tmp_path: Path) -> None:
+        path = tmp_path / 'test.bin'
+        path.write_bytes(b'\x00\x01\x02')
+        elements = list(MappedFiles([path]).elements())
+        compare(elements[0], expected=Start(File(path)))
+        compare(elements[2], expected=End(File(path)))
+        data = elements[1]
+        assert isinstance(data, Bytes)
+        assert isinstance(data.value, memoryview)
+        compare(data.value.tobytes(), expected=b'\x00\x01\x02')
+        compare(data.parent, expected=File(path))
+        compare(len(elements), expected=3)
+
+    def test_chunked(self, tmp_path: Path) -> None:
+        path = tmp_path / 'test.bin'
+        path.write_bytes(b'abcdefg')
+        compare(
+            [bytes(e.value) for e in MappedFiles([path], chunk_size=3).elements()
+             if isinstance(e, Bytes)],
+            expected=[b'abc', b'def', b'g'],
+        )
+
+    def test_empty(self, tmp_path: Path) -> None:
+        path = tmp_path / 'test.bin'
+        path.write_bytes(b'')
+        compare(
+            MappedFiles([path]).elements(),
+            expected=generator(Start(File(path)), End(File(path))),
+        )
+
+    def test_round_trip(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        source = tmp_path / 'source'
+        source.mkdir()
+        (source / 'test.bin').write_bytes(bytes(range(256)) * 100)
+        target = tmp_path / 'target'
+        target.mkdir()
+        monkeypatch.chdir(source)
+        manipulate(MappedFiles([Path('test.bin')], chunk_size=1000), [], BinaryFiles(target))
+        compare((target / 'test.bin').read_bytes(), expected=bytes(range(256)) * 100)
+
+    def test_chunk_size_not_positive(self) -> None:
+        with ShouldRaise(ValueError('chunk_size must be positive, not -1')):
+            MappedFiles([Path('foo')], chunk_size=-1)
+
+    def test_str(self) -> None:
+        compare(str(MappedFiles([Path('foo')])), expected="MappedFiles")
 
 
 class TestStream:
@@ -72,3 +354,171 @@ class TestStream:
             repr(Stream(sys.stdin)),
             expected="Stream(stream=<_io.TextIOWrapper name='<stdin>' mode='r' encoding='utf-8'>)",
         )
+
+
+class TestTree:
+
+    @staticmethod
+    def write(root: Path, *paths: str) -> None:
+        for relative in paths:
+            path = root / relative
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(relative)
+
+    def test_walk(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a.txt', 'b/c.txt', 'b/d/e.txt')
+        compare(
+            sorted(Tree([tmp_path])),
+            expected=[tmp_path / 'a.txt', tmp_path / 'b/c.txt', tmp_path / 'b/d/e.txt'],
+        )
+
+    def test_multiple_roots(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a/x.txt', 'b/y.txt', 'c/z.txt')
+        compare(
+            sorted(Tree([tmp_path / 'a', tmp_path / 'b'], workers=1)),
+            expected=[tmp_path / 'a/x.txt', tmp_path / 'b/y.txt'],
+        )
+
+    def test_file_root(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a.txt')
+        compare(list(Tree([tmp_path / 'a.txt'])), expected=[tmp_path / 'a.txt'])
+
+    def test_file_root_filtered(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a.py', 'a.txt', 'b.py')
+        compare(
+            list(Tree(
+                [tmp_path / 'a.py', tmp_path / 'a.txt', tmp_path / 'b.py'],
+                include=['*.py'],
+                exclude=['b.*'],
+            )),
+            expected=[tmp_path / 'a.py'],
+        )
+
+    def test_empty(self, tmp_path: Path) -> None:
+        compare(list(Tree([tmp_path])), expected=[])
+
+    def test_include(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a.py', 'a.txt', 'b/c.py', 'b/c.txt')
+        compare(
+            sorted(Tree([tmp_path], include=['*.py'])),
+            expected=[tmp_path / 'a.py', tmp_path / 'b/c.py'],
+        )
+
+    def test_include_directory(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a.py', 'src/b.py', 'src/sub/c.txt', 'other/src.py')
+        expected = [tmp_path / 'src/b.py', tmp_path / 'src/sub/c.txt']
+        compare(sorted(Tree([tmp_path], include=['src/'])), expected=expected)
+        compare(sorted(Tree([tmp_path], include=['src'])), expected=expected)
+
+    def test_include_directory_negated(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'src/a.py', 'src/b.txt', 'src/vendor/c.py', 'src/vendor/d.py')
+        compare(
+            sorted(Tree([tmp_path], include=['src/', '!*.txt', '!vendor/', 'd.py'])),
+            expected=[tmp_path / 'src/a.py', tmp_path / 'src/vendor/d.py'],
+        )
+
+    def test_exclude(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a.txt', 'build/b.txt', 'src/build/c.txt', 'src/d.txt')
+        compare(
+            sorted(Tree([tmp_path], exclude=['/build/'])),
+            expected=[tmp_path / 'a.txt', tmp_path / 'src/build/c.txt', tmp_path / 'src/d.txt'],
+        )
+
+    def test_git_excluded_by_default(self, tmp_path: Path) -> None:
+        self.write(tmp_path, '.git/HEAD', 'a.txt')
+        compare(list(Tree([tmp_path])), expected=[tmp_path / 'a.txt'])
+
+    def test_gitignore(self, tmp_path: Path) -> None:
+        self.write(
+            tmp_path, 'a.txt', 'a.log', 'keep.log', 'sub/b.log', 'sub/out/c.txt', 'out/d.txt'
+        )
+        (tmp_path / '.gitignore').write_text('*.log\n!keep.log\n')
+        (tmp_path / 'sub' / '.gitignore').write_text('/out/\n')
+        compare(
+            sorted(Tree([tmp_path])),
+            expected=[
+                tmp_path / '.gitignore',
+                tmp_path / 'a.txt',
+                tmp_path / 'keep.log',
+                tmp_path / 'out/d.txt',
+                tmp_path / 'sub/.gitignore',
+            ],
+        )
+
+    def test_no_ignore_file(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a.log')
+        (tmp_path / '.gitignore').write_text('*.log\n')
+        compare(
+            sorted(Tree([tmp_path], ignore_file=None)),
+            expected=[tmp_path / '.gitignore', tmp_path / 'a.log'],
+        )
+
+    def test_symlinked_directory_not_followed(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'real/a.txt')
+        (tmp_path / 'link').symlink_to(tmp_path / 'real')
+        compare(list(Tree([tmp_path])), expected=[tmp_path / 'real/a.txt'])
+
+    def test_missing_root(self, tmp_path: Path) -> None:
+        # left for the source reading the file to report:
+        compare(list(Tree([tmp_path / 'missing'])), expected=[tmp_path / 'missing'])
+
+    def test_error(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        self.write(tmp_path, 'a/b.txt')
+
+        def scandir(path: Path) -> Any:
+            raise PermissionError(path)
+
+        monkeypatch.setattr('os.scandir', scandir)
+        with ShouldRaise(PermissionError(tmp_path)):
+            list(Tree([tmp_path]))
+
+    def test_stop_early(self, tmp_path: Path) -> None:
+        self.write(tmp_path, *(f'{i}/{j}.txt' for i in range(10) for j in range(10)))
+        tree = iter(Tree([tmp_path], workers=2))
+        next(tree)
+        tree.close()  # type: ignore[attr-defined]
+
+    def test_as_files_source(self, tmp_path: Path) -> None:
+        self.write(tmp_path, 'a.py', 'b.txt')
+        path = tmp_path / 'a.py'
+        compare(
+            Files(Tree([tmp_path], include=['*.py'])).elements(),
+            expected=generator(
+                Start(File(path)),
+                Text('a.py', parent=File(path), line=1, column=1),
+                End(File(path)),
+            ),
+        )
+
+
+class ClassifiedText(Text):
+    __slots__ = ()
+
+
+class TestCheckpoint:
+
+    def test_round_trip(self, tmp_path: Path) -> None:
+        source = tmp_path / 'source'
+        source.mkdir()
+        paths = []
+        for i in range(3):
+            path = source / f'{i}.txt'
+            path.write_text(f'line 1\nline {i}\n')
+            paths.append(path)
+        checkpoint = tmp_path / 'checkpoint'
+        manipulate(
+            Files(paths, chunk_size=7),
+            [Classify({'.txt': ClassifiedText})],
+            CheckpointDestination(checkpoint),
+        )
+        expected = list(Classify({'.txt': ClassifiedText})(Files(paths, chunk_size=7).elements()))
+        compare(list(Checkpoint(checkpoint).elements()), expected=expected, strict=True)
+
+    def test_not_a_checkpoint(self, tmp_path: Path) -> None:
+        path = tmp_path / 'junk'
+        path.write_bytes(b'junk')
+        with ShouldRaise(ValueError('not a checkpoint')):
+            list(Checkpoint(path).elements())
+
+    def test_str(self) -> None:
+        compare(str(Checkpoint(Path('x'))), expected='Checkpoint')